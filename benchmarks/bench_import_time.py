@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import re
+import statistics
+import subprocess
+from rebade.FriendlyArgumentParser import FriendlyArgumentParser
+
+IMPORT_TIME_RE = re.compile(r"^import time:\s+(?P<self_us>\d+) \|\s+(?P<cumulative_us>\d+) \| (?P<indent>\s*)(?P<module>\S+)$")
+
+def measure(args, cmdline: list[str]):
+	code = "import sys; sys.argv[0] = 'rebade'; from rebade.__main__ import main; sys.exit(main())"
+	result = subprocess.run([ args.python, "-X", "importtime", "-c", code ] + cmdline, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, check = False, text = True)
+	modules = { }
+	startup_done = False
+	for line in result.stderr.split("\n"):
+		rematch = IMPORT_TIME_RE.match(line)
+		if rematch is None:
+			continue
+		# Everything before the first rebade module is interpreter startup
+		startup_done = startup_done or rematch["module"].startswith("rebade")
+		if startup_done:
+			modules[rematch["module"]] = (int(rematch["self_us"]), int(rematch["cumulative_us"]), len(rematch["indent"]) == 0)
+	total_us = sum(cumulative_us for (self_us, cumulative_us, toplevel) in modules.values() if toplevel)
+	return (total_us, modules)
+
+parser = FriendlyArgumentParser(description = "Measure the import time of the rebade command line interface and check it against a budget.")
+parser.add_argument("--python", metavar = "filename", default = sys.executable, help = "Python interpreter to use. Defaults to %(default)s.")
+parser.add_argument("-n", "--repetitions", metavar = "count", type = int, default = 10, help = "Number of measurements per command line, the median is reported. Defaults to %(default)d.")
+parser.add_argument("-b", "--budget-ms", metavar = "ms", type = float, default = 50, help = "Maximum permissible median import time per command line. Defaults to %(default).0f ms.")
+parser.add_argument("-f", "--forbidden-module", metavar = "name", action = "append", default = [ "requests", "urllib3", "ssl", "idna", "charset_normalizer", "chardet", "sqlite3", "asyncio" ], help = "Module that must not be imported for the given command lines. Can be given multiple times. Defaults to %(default)s.")
+parser.add_argument("-t", "--top", metavar = "count", type = int, default = 10, help = "Show this many modules with the highest cumulative import time. Defaults to %(default)d.")
+parser.add_argument("cmdline", nargs = "*", default = [ "snapshots --help", "backup --help", "daemon --help", "--help" ], help = "rebade command lines to measure. Defaults to %(default)s.")
+args = parser.parse_args(sys.argv[1:])
+
+failed = False
+for cmdline in args.cmdline:
+	measurements = [ measure(args, cmdline.split()) for _ in range(args.repetitions) ]
+	median_us = statistics.median(total_us for (total_us, modules) in measurements)
+	modules = measurements[-1][1]
+	forbidden = sorted(module for module in modules if module.split(".")[0] in args.forbidden_module)
+	verdict = "OK" if ((median_us / 1000 <= args.budget_ms) and (len(forbidden) == 0)) else "FAIL"
+	failed = failed or (verdict != "OK")
+
+	print(f"rebade {cmdline}: {median_us / 1000:.1f} ms median over {args.repetitions} runs, {len(modules)} modules imported, budget {args.budget_ms:.0f} ms: {verdict}")
+	if len(forbidden) > 0:
+		print(f"    forbidden modules imported: {', '.join(forbidden)}")
+	for (module, (self_us, cumulative_us, toplevel)) in sorted(modules.items(), key = lambda item: -item[1][1])[:args.top]:
+		print(f"    {cumulative_us / 1000:7.1f} ms  {module}")
+sys.exit(1 if failed else 0)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import json
+import time
+import glob
+import struct
+import tempfile
+import threading
+import subprocess
+from rebade.FriendlyArgumentParser import FriendlyArgumentParser
+from rebade.ControlSocket import ControlClient
+
+# struct input_event: timeval, type, code, value
+EVENT = struct.Struct("llHHi")
+EV_SYN = 0
+EV_REL = 2
+
+def create_environment(tmpdir: str, device_count: int):
+	keyfile = os.path.join(tmpdir, "key")
+	with open(keyfile, "w") as f:
+		print("benchmark", file = f)
+	os.chmod(keyfile, 0o600)
+	config = {
+		"cache_dir": os.path.join(tmpdir, "cache"),
+		"database_file": os.path.join(tmpdir, "plandb.json"),
+		"plans": {
+			"flood": {
+				"default": True,
+				"keyfile": keyfile,
+				# Never due, the daemon only accounts activity
+				"soft_period_secs": 10 ** 9,
+				"hard_period_secs": 10 ** 9,
+				"source": { "paths": [ tmpdir ] },
+				"target": { "method": "local", "remote_path": os.path.join(tmpdir, "repo") },
+			},
+		},
+	}
+	with open(os.path.join(tmpdir, "config.json"), "w") as f:
+		json.dump(config, f)
+
+	# Open FIFOs read-write so that neither side blocks on open and the
+	# daemon never sees EOF
+	devices = [ ]
+	for i in range(device_count):
+		filename = os.path.join(tmpdir, f"event{i}")
+		os.mkfifo(filename)
+		devices.append(os.open(filename, os.O_RDWR | os.O_NONBLOCK))
+	return devices
+
+def generate_events(args, devices: list[int], rate_hz: float, t0: float, tend: float, stop: threading.Event):
+	# Alternates between active phases, in which every device emits events
+	# at the given rate, and idle phases without any events
+	interval = 1 / rate_hz
+	period = args.active_secs + args.idle_secs
+	next_event = t0
+	while not stop.is_set():
+		now = time.time()
+		if now >= tend:
+			return
+		phase = (now - t0) % period
+		if phase >= args.active_secs:
+			time.sleep(period - phase)
+			next_event = time.time()
+			continue
+		if next_event > now:
+			time.sleep(next_event - now)
+		timestamp = time.time()
+		(secs, usecs) = (int(timestamp), int((timestamp % 1) * 1e6))
+		event = EVENT.pack(secs, usecs, EV_REL, 0, 1) + EVENT.pack(secs, usecs, EV_SYN, 0, 0)
+		for fd in devices:
+			try:
+				os.write(fd, event)
+			except BlockingIOError:
+				# Pipe full, the daemon is not draining
+				pass
+		next_event += interval
+		if time.time() - next_event > 1:
+			# Cannot keep up with the rate, do not try to catch up
+			next_event = time.time()
+
+def process_counters(pid: int) -> tuple[float, int]:
+	with open(f"/proc/{pid}/stat") as f:
+		fields = f.read().rsplit(")", 1)[1].split()
+	cpu_secs = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+	wakeups = 0
+	for status_filename in glob.glob(f"/proc/{pid}/task/*/status"):
+		with open(status_filename) as f:
+			for line in f:
+				if line.startswith(("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches")):
+					wakeups += int(line.split()[1])
+	return (cpu_secs, wakeups)
+
+def measure(args, rate_hz: float):
+	with tempfile.TemporaryDirectory(prefix = "rebade_flood_") as tmpdir:
+		devices = create_environment(tmpdir, args.devices)
+		control_socket = os.path.join(tmpdir, "control.sock")
+		code = "import sys; sys.argv[0] = 'rebade'; from rebade.__main__ import main; sys.exit(main())"
+		cmdline = [ args.python, "-c", code, "daemon", "-c", os.path.join(tmpdir, "config.json"), "-s", os.path.join(tmpdir, "state.json"), "--control-socket", control_socket, "--device-glob", os.path.join(tmpdir, "event*"), "--timestep-secs", str(args.timestep_secs), "--no-forecast", "--mount-dir", os.path.join(tmpdir, "mnt") ]
+		daemon = subprocess.Popen(cmdline, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+		try:
+			tstart = time.time() + 1
+			while not os.path.exists(control_socket):
+				if daemon.poll() is not None:
+					raise Exception(f"Daemon exited with status {daemon.returncode}")
+				time.sleep(0.1)
+			time.sleep(max(0, tstart - time.time()))
+
+			(cpu_before, wakeups_before) = process_counters(daemon.pid)
+			stop = threading.Event()
+			tend = tstart + args.duration_secs
+			generator = threading.Thread(target = generate_events, args = (args, devices, rate_hz, tstart, tend, stop))
+			generator.start()
+			generator.join()
+			(cpu_after, wakeups_after) = process_counters(daemon.pid)
+			status = ControlClient(control_socket).request("status")
+		finally:
+			daemon.terminate()
+			daemon.wait()
+			for fd in devices:
+				os.close(fd)
+
+	elapsed_secs = time.time() - tstart
+	period = args.active_secs + args.idle_secs
+	return {
+		"rate_hz": rate_hz,
+		"cpu_percent": 100 * (cpu_after - cpu_before) / args.duration_secs,
+		"wakeups_per_sec": (wakeups_after - wakeups_before) / args.duration_secs,
+		"activity_secs": status["plans"]["flood"]["activity_secs"],
+		"expected_activity_secs": args.duration_secs * args.active_secs / period,
+	}
+
+parser = FriendlyArgumentParser(description = "Feed the rebade daemon synthetic input events at various rates and measure its CPU usage, wakeups and activity accounting.")
+parser.add_argument("--python", metavar = "filename", default = sys.executable, help = "Python interpreter to use. Defaults to %(default)s.")
+parser.add_argument("-d", "--devices", metavar = "count", type = int, default = 2, help = "Number of synthetic input devices. Defaults to %(default)d.")
+parser.add_argument("-t", "--timestep-secs", metavar = "secs", type = int, default = 2, help = "Timestep of the daemon. Defaults to %(default)d secs.")
+parser.add_argument("-D", "--duration-secs", metavar = "secs", type = int, default = 24, help = "Duration of each measurement. Defaults to %(default)d secs.")
+parser.add_argument("--active-secs", metavar = "secs", type = float, default = 6, help = "Length of the phases in which events are generated. Defaults to %(default).0f secs.")
+parser.add_argument("--idle-secs", metavar = "secs", type = float, default = 6, help = "Length of the phases without events in between. Defaults to %(default).0f secs.")
+parser.add_argument("-m", "--max-cpu-percent", metavar = "percent", type = float, default = 5, help = "Maximum permissible CPU usage of the daemon at any rate. Defaults to %(default).0f%%.")
+parser.add_argument("rate_hz", nargs = "*", type = float, default = [ 10, 125, 1000, 8000 ], help = "Event rates per device to measure. Defaults to %(default)s.")
+args = parser.parse_args(sys.argv[1:])
+
+failed = False
+print(f"{'rate':>8s} {'cpu':>7s} {'wakeups/s':>10s} {'activity':>9s} {'expected':>9s}")
+for rate_hz in args.rate_hz:
+	result = measure(args, rate_hz)
+	verdict = "OK" if (result["cpu_percent"] <= args.max_cpu_percent) else "FAIL"
+	failed = failed or (verdict != "OK")
+	print(f"{result['rate_hz']:>6.0f}Hz {result['cpu_percent']:>6.2f}% {result['wakeups_per_sec']:>10.1f} {result['activity_secs']:>8d}s {result['expected_activity_secs']:>8.0f}s  {verdict}")
+sys.exit(1 if failed else 0)
@@ -0,0 +1,89 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import time
+
+class ActivityProfile():
+	# Histogram of user activity per weekday and time of day. Every bucket
+	# keeps the activity percentages of the last "depth" weeks in a fixed-size
+	# ring buffer, so the profile adapts to changing habits and never grows.
+	def __init__(self, data: dict, slot_secs: int = 900, depth: int = 8, idle_threshold: float = 0.2, min_samples: int = 2):
+		self._data = data
+		self._idle_threshold = idle_threshold
+		self._min_samples = min_samples
+		if (self._data.get("slot_secs") != slot_secs) or (self._data.get("depth") != depth):
+			# Layout changed (or new profile), start over
+			self._data.clear()
+			self._data.update({
+				"slot_secs": slot_secs,
+				"depth": depth,
+				"values": [ [ None ] * depth for _ in range(self.bucket_count(slot_secs)) ],
+				"positions": [ 0 ] * self.bucket_count(slot_secs),
+				"current": [ None, 0, 0 ],
+			})
+
+	@staticmethod
+	def bucket_count(slot_secs: int):
+		return 7 * 86400 // slot_secs
+
+	@property
+	def slot_secs(self):
+		return self._data["slot_secs"]
+
+	def _bucket_and_offset(self, timestamp: float) -> tuple[int, int]:
+		localtime = time.localtime(timestamp)
+		secs_of_week = (86400 * localtime.tm_wday) + (3600 * localtime.tm_hour) + (60 * localtime.tm_min) + localtime.tm_sec
+		return (secs_of_week // self.slot_secs, secs_of_week % self.slot_secs)
+
+	def _push(self, bucket: int, activity_percent: int):
+		position = self._data["positions"][bucket]
+		self._data["values"][bucket][position] = activity_percent
+		self._data["positions"][bucket] = (position + 1) % self._data["depth"]
+
+	def record(self, timestamp: float, active_secs: float, observed_secs: float):
+		(bucket, offset) = self._bucket_and_offset(timestamp)
+		current = self._data["current"]
+		if current[0] != bucket:
+			if (current[0] is not None) and (current[2] > 0):
+				self._push(current[0], round(100 * current[1] / current[2]))
+			current[:] = [ bucket, 0, 0 ]
+		current[1] += active_secs
+		current[2] += observed_secs
+
+	def predicted_activity(self, bucket: int) -> float | None:
+		values = [ value for value in self._data["values"][bucket] if value is not None ]
+		if len(values) < self._min_samples:
+			return None
+		return sum(values) / len(values) / 100
+
+	def predict_idle_secs(self, timestamp: float) -> int | None:
+		# Length of the idle window that starts now, zero if we expect the
+		# user to be active and None if there is no prediction yet
+		(bucket, offset) = self._bucket_and_offset(timestamp)
+		if self.predicted_activity(bucket) is None:
+			return None
+		idle_secs = 0
+		for i in range(len(self._data["values"])):
+			predicted_activity = self.predicted_activity((bucket + i) % len(self._data["values"]))
+			if (predicted_activity is None) or (predicted_activity > self._idle_threshold):
+				break
+			idle_secs += self.slot_secs - (offset if (i == 0) else 0)
+		return idle_secs
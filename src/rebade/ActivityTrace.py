@@ -0,0 +1,85 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import time
+import dataclasses
+
+@dataclasses.dataclass
+class TraceSegment():
+	start: float
+	end: float
+	active: bool
+
+class ActivityTrace():
+	# Compact record of when the user was active, one line per change:
+	#   <timestamp> S <timestep_secs>     daemon started
+	#   <timestamp> A                     active from here on
+	#   <timestamp> I                     idle from here on
+	# Unchanged states are repeated every keepalive_secs. Longer gaps between
+	# lines mean that the machine was off or asleep and are not replayed.
+	def __init__(self, filename: str, timestep_secs: int, keepalive_secs: int = 3600):
+		self._f = open(filename, "a", buffering = 1)
+		self._keepalive_secs = keepalive_secs
+		self._last_state = None
+		self._last_written = None
+		print(f"{round(time.time())} S {timestep_secs}", file = self._f)
+
+	def record(self, timestamp: float, active: bool):
+		# Called after a tick, which covered the timestep before timestamp
+		state = "A" if active else "I"
+		if (state != self._last_state) or (timestamp - self._last_written >= self._keepalive_secs):
+			print(f"{round(timestamp)} {state}", file = self._f)
+			self._last_state = state
+			self._last_written = timestamp
+
+	def close(self):
+		self._f.close()
+
+	@classmethod
+	def read_segments(cls, filename: str, keepalive_secs: int = 3600) -> list[TraceSegment]:
+		entries = [ ]
+		timestep_secs = 30
+		with open(filename) as f:
+			for line in f:
+				fields = line.split()
+				if (len(fields) < 2) or (fields[1] not in [ "S", "A", "I" ]):
+					continue
+				if fields[1] == "S":
+					timestep_secs = int(fields[2])
+					entries.append((float(fields[0]), None, timestep_secs))
+				else:
+					# The state was observed during the tick before the timestamp
+					entries.append((float(fields[0]) - timestep_secs, fields[1] == "A", timestep_secs))
+
+		segments = [ ]
+		for (i, (timestamp, active, timestep_secs)) in enumerate(entries):
+			if active is None:
+				continue
+			end = timestamp + timestep_secs
+			if i + 1 < len(entries):
+				(next_timestamp, next_active, next_timestep_secs) = entries[i + 1]
+				if (next_active is not None) and (next_timestamp - timestamp <= keepalive_secs + 2 * timestep_secs):
+					end = next_timestamp
+			if (len(segments) > 0) and (segments[-1].end == timestamp) and (segments[-1].active == active):
+				segments[-1].end = end
+			elif end > timestamp:
+				segments.append(TraceSegment(start = timestamp, end = end, active = active))
+		return segments
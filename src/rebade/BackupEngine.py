@@ -21,15 +21,28 @@
 
 import os
 import math
+import time
+import json
+import uuid
+import tempfile
+import concurrent.futures
 import contextlib
 import subprocess
 import logging
 import dataclasses
-import requests
 from rebade.Configuration import BackupMethod, HookMethod, Condition
 from rebade.Tools import FileSystemTools
+from rebade.TreeScanner import TreeScanner
+from rebade.ShardPlanner import ShardPlanner
+from rebade.PipelineExecutor import PipelineExecutor
+from rebade.MemoryGovernor import MemoryGovernor
+from rebade.TargetProbe import TargetProbe
+from rebade.SshMultiplexer import SshMultiplexer
+from rebade.ProcessSupervisor import ProcessSupervisor, ProcessLimits
 from rebade.CmdlineEscape import CmdlineEscape
 from rebade.Enums import ResticBackupReturncodes
+from rebade.Tracing import tracer
+from rebade.Exceptions import TargetUnreachableException, ConfigurationException
 
 _log = logging.getLogger(__spec__.name)
 
@@ -37,6 +50,8 @@ _log = logging.getLogger(__spec__.name)
 class ExecutionCommand():
 	cmdline: list[str] = dataclasses.field(default_factory = list)
 	env: dict = dataclasses.field(default_factory = dict)
+	# SFTP target whose SSH master is only started right before execution
+	multiplex_target: dict | None = None
 
 	def append(self, args: list[str]):
 		self.cmdline += args
@@ -44,13 +59,76 @@ class ExecutionCommand():
 	def prepend(self, args: list[str]):
 		self.cmdline = args + self.cmdline
 
+@dataclasses.dataclass
+class CapturedOutput():
+	returncode: int
+	stdout: bytes
+	stderr: bytes
+	duration_secs: float
+
 class BackupEngine():
-	def __init__(self, restic_binary: str, nice: int = 19, ionice_class: str = "idle"):
+	def __init__(self, restic_binary: str, nice: int = 19, ionice_class: str = "idle", plan_db: "PlanDatabase | None" = None):
 		self._restic_binary = restic_binary
 		self._nice = nice
 		self._ionice_class = ionice_class
+		self._plan_db = plan_db
+		self._memory_governor = MemoryGovernor()
+		self._target_probe = TargetProbe()
+		self._ssh_multiplexer = SshMultiplexer()
+		self._supervisor = ProcessSupervisor()
+
+	@property
+	def plan_db(self):
+		return self._plan_db
+
+	def performance_settings(self, plan: "BackupPlan") -> dict:
+		# Explicitly configured values always take precedence over the ones
+		# that "rebade tune" determined
+		settings = { }
+		if self._plan_db is not None:
+			settings.update(self.tuned_settings(plan, self._plan_db.get(plan.name, "tuning")))
+		settings.update(plan.performance)
+		return settings
+
+	@staticmethod
+	def tuned_settings(plan: "BackupPlan", tuning: dict | None) -> dict:
+		# Settings are benchmarked against a local repository, so only those
+		# that carry over to the actual target are applied: nothing if the
+		# target method changed since, no compression for version 1
+		# repositories and never a connection count
+		if (tuning is None) or (tuning.get("method") != plan.target["method"]):
+			return { }
+		settings = { key: value for (key, value) in tuning.get("settings", { }).items() if key != "connections" }
+		if tuning.get("repository_version", 1) < 2:
+			settings.pop("compression", None)
+		return settings
+
+	def source_excludes(self, plan: "BackupPlan") -> list[str]:
+		# Patterns stored by "rebade analyze-excludes --apply" extend the
+		# configured ones
+		excludes = list(plan.source.exclude)
+		if self._plan_db is not None:
+			excludes += self._plan_db.get(plan.name, "auto_excludes", { }).get("patterns", [ ])
+		return excludes
 
-	def _restic_target_command(self, cmd: ExecutionCommand, target: dict):
+	def _restic_performance_options(self, cmd: ExecutionCommand, plan: "BackupPlan"):
+		settings = self.performance_settings(plan)
+		if "pack_size" in settings:
+			cmd.append([ "--pack-size", str(settings["pack_size"]) ])
+		if "compression" in settings:
+			cmd.append([ "--compression", settings["compression"] ])
+		if "connections" in settings:
+			match BackupMethod(plan.target["method"]):
+				case BackupMethod.SFTP:
+					cmd.append([ "-o", f"sftp.connections={settings['connections']}" ])
+
+				case BackupMethod.REST:
+					cmd.append([ "-o", f"rest.connections={settings['connections']}" ])
+
+	def close(self):
+		self._ssh_multiplexer.close()
+
+	def _restic_target_command(self, cmd: ExecutionCommand, target: dict, multiplex: bool = True):
 		method = BackupMethod(target["method"])
 		match method:
 			case BackupMethod.SFTP:
@@ -63,6 +141,8 @@ class BackupEngine():
 				repo_string.append("/")
 				repo_string.append(target["remote_path"])
 				cmd.append([ "-r", "".join(repo_string) ])
+				if multiplex:
+					cmd.multiplex_target = target
 
 			case BackupMethod.REST:
 				repo_string = [ "rest:" ]
@@ -88,29 +168,57 @@ class BackupEngine():
 			case _:
 				raise NotImplementedError(method)
 
-	def _restic_remote_command(self, cmd: ExecutionCommand, plan: "Plan") -> dict:
-		self._restic_target_command(cmd, plan.target)
+	def _restic_remote_command(self, cmd: ExecutionCommand, plan: "Plan", multiplex: bool = True) -> dict:
+		self._restic_target_command(cmd, plan.target, multiplex = multiplex)
 		cmd.prepend([ "-p", plan.keyfile ])
+		cmd.append([ "--cache-dir", plan.cache_dir ])
+		self._restic_performance_options(cmd, plan)
 
-	def _restic_backup_command(self, cmd: ExecutionCommand, plan: "Plan") -> dict:
-		self._restic_remote_command(cmd, plan)
-		cmd.prepend([ "backup" ])
-		for exclude in plan.source.exclude:
-			cmd.append([ "--exclude", exclude ])
+	def _restic_scope_options(self, cmd: ExecutionCommand, plans: list["BackupPlan"]):
+		# Restricts the snapshots restic considers to those of the given
+		# plans on this host instead of all snapshots in a shared repository
+		for host in sorted(set(plan.host for plan in plans)):
+			cmd.append([ "--host", host ])
+		for plan in plans:
+			cmd.append([ "--tag", plan.tag ])
+		# Snapshots created before rebade tagged them have no tags at all
+		cmd.append([ "--tag", "" ])
+
+	def excluded_mountpoints(self, plan: "BackupPlan"):
 		if len(plan.source.only_filesystems) > 0:
 			# List filesystems and exclude all those that are not in the list
-			for mounted_filesystem in FileSystemTools.get_mounted_filesystems():
+			with tracer.span("read_mounts"):
+				mounted_filesystems = list(FileSystemTools.get_mounted_filesystems())
+			for mounted_filesystem in mounted_filesystems:
 				if mounted_filesystem.fstype not in plan.source.only_filesystems:
-					cmd.append([ "--exclude", mounted_filesystem.mountpoint ])
-		for path in plan.source.paths:
+					yield mounted_filesystem.mountpoint
+
+	def _restic_backup_command(self, cmd: ExecutionCommand, plan: "Plan", paths: list[str] | None = None) -> dict:
+		self._restic_remote_command(cmd, plan)
+		cmd.prepend([ "backup" ])
+		cmd.append([ "--host", plan.host, "--tag", plan.tag ])
+		settings = self.performance_settings(plan)
+		if "read_concurrency" in settings:
+			cmd.append([ "--read-concurrency", str(settings["read_concurrency"]) ])
+		for exclude in self.source_excludes(plan):
+			cmd.append([ "--exclude", exclude ])
+		if plan.source.exclude_caches:
+			cmd.append([ "--exclude-caches" ])
+		for marker in plan.source.exclude_if_present:
+			cmd.append([ "--exclude-if-present", marker ])
+		for mountpoint in self.excluded_mountpoints(plan):
+			cmd.append([ "--exclude", mountpoint ])
+		for path in (plan.source.paths if (paths is None) else paths):
 			cmd.append([ path ])
 
 	@contextlib.contextmanager
 	def execute_pre_post_hooks(self, plan: "BackupPlan"):
 		run_args = { }
-		self.execute_hooks(plan.pre_hooks, run_args)
+		with tracer.span("pre_hooks", plan = plan.name):
+			self.execute_hooks(plan.pre_hooks, run_args)
 		yield run_args
-		self.execute_hooks(plan.post_hooks, run_args)
+		with tracer.span("post_hooks", plan = plan.name):
+			self.execute_hooks(plan.post_hooks, run_args)
 
 	def _condition_satisfied(self, hook: "Hook", run_args: dict):
 		match hook.condition:
@@ -120,6 +228,9 @@ class BackupEngine():
 			case Condition.Failure:
 				return not run_args.get("backup_success", False)
 
+			case Condition.Always:
+				return True
+
 		return False
 
 	def execute_hook(self, hook: "Hook", run_args: dict):
@@ -128,34 +239,313 @@ class BackupEngine():
 			return
 		_log.debug("Executing hook %s", str(hook))
 
-		match hook.method:
-			case HookMethod.HttpGet:
-				requests.get(hook.args["uri"])
+		with tracer.span("hook", method = hook.method.value):
+			match hook.method:
+				case HookMethod.HttpGet:
+					# requests is expensive to import, only do so when needed
+					import requests
+					requests.get(hook.args["uri"])
 
 	def execute_hooks(self, hooks: "BackupPlan", run_args: dict):
 		for hook in hooks:
 			self.execute_hook(hook, run_args)
 
-	def _run_cmd(self, command: ExecutionCommand) -> int:
-		env = dict(os.environ)
-		env.update(command.env)
+	def _start_multiplexing(self, command: ExecutionCommand, probe: bool = True):
+		# Starting the SSH master may take until the connect timeout, so it is
+		# deferred until right before execution and skipped for a target that
+		# does not respond; restic then reports the failure by itself
+		target = command.multiplex_target
+		if target is None:
+			return
+		command.multiplex_target = None
+		if probe:
+			cache_key = f"sftp:{target.get('username', '')}@{target['hostname']}:{target.get('port', 22)}"
+			if not self._target_probe.probe(target, cache_key).reachable:
+				return
+		options = self._ssh_multiplexer.restic_options(target)
+		index = (command.cmdline.index(self._restic_binary) + 1) if (self._restic_binary in command.cmdline) else len(command.cmdline)
+		command.cmdline[index : index] = options
+
+	def _run_cmd(self, command: ExecutionCommand, stdin = None, stdout = None, stderr = None, stdout_line_callback: callable = None, resource_usage: dict | None = None, limits: ProcessLimits | None = None) -> int:
+		self._start_multiplexing(command)
+		env = None if (len(command.env) == 0) else (os.environ | command.env)
 		cmdline = [ "systemd-inhibit", "--who=Rebade backup daemon", "--why=Backup action running", "--mode=delay", "--what=shutdown:sleep" ] + list(command.cmdline)
 		_log.debug("Execution of command: %s with %d environment vars", CmdlineEscape().cmdline(cmdline), len(command.env))
-		returncode = subprocess.run(cmdline, env = env, check = False).returncode
+		# Name restic rather than the nice/ionice wrapping it
+		name = os.path.basename(self._restic_binary if (self._restic_binary in command.cmdline) else command.cmdline[0])
+		with tracer.span("process", command = name) as span:
+			with tracer.span("spawn"):
+				process = self._supervisor.start(cmdline, env = env, stdin = stdin, stdout = stdout, stderr = stderr, capture_stdout = stdout_line_callback is not None, limits = limits, name = name)
+			if stdout_line_callback is not None:
+				for line in process.lines():
+					stdout_line_callback(line)
+			returncode = process.wait()
+			span.set("returncode", returncode)
+			span.set("first_output_secs", process.first_output_secs)
+			span.set("max_rss", process.max_rss)
+		if returncode != 0:
+			tail = process.stderr_tail.decode(errors = "replace").splitlines()[-10:]
+			_log.warning("%s exited with status %d%s%s", process.name, returncode, "" if (process.timeout_reason is None) else f" after it was interrupted ({process.timeout_reason})", "".join(f"\n    {line}" for line in tail))
+		if resource_usage is not None:
+			resource_usage["max_rss"] = process.max_rss
 		return returncode
 
+	def _memory_expectation(self, plan: "BackupPlan", operation: str) -> tuple[int | None, int]:
+		if self._plan_db is None:
+			return (None, 100)
+		history = [ entry for entry in self._plan_db.get(plan.name, "memory", [ ]) if entry["operation"] == operation ][-8:]
+		if len(history) == 0:
+			return (None, 100)
+		# Runs may have used different GOGC values, so compare them by their
+		# estimated live heap
+		worst = max(history, key = lambda entry: entry["peak_rss"] / (1 + entry["gogc"] / 100))
+		return (worst["peak_rss"], worst["gogc"])
+
+	def memory_fits(self, plan: "BackupPlan", operation: str = "backup") -> bool:
+		return self._memory_governor.fits(*self._memory_expectation(plan, operation))
+
+	def ensure_reachable(self, plan: "BackupPlan"):
+		with tracer.span("probe", plan = plan.name):
+			result = self._target_probe.probe(plan.target, plan.repository_key)
+		if not result.reachable:
+			raise TargetUnreachableException(f"Target of {plan.name} is unreachable: {result.reason}")
+
+	def _run_restic(self, command: ExecutionCommand, plan: "BackupPlan", operation: str, **kwargs) -> int:
+		with tracer.span("restic", plan = plan.name, operation = operation) as span:
+			try:
+				self.ensure_reachable(plan)
+			except TargetUnreachableException as e:
+				_log.warning("Not running %s: %s", operation, str(e))
+				return ResticBackupReturncodes.TargetUnreachable
+			self._start_multiplexing(command, probe = False)
+			(expected_peak_bytes, recorded_gogc) = self._memory_expectation(plan, operation)
+			timeouts = plan.timeouts.get(operation, { })
+			limits = ProcessLimits(total_secs = timeouts.get("total_secs"), no_progress_secs = timeouts.get("no_progress_secs"))
+			if (limits.no_progress_secs is not None) and ("RESTIC_PROGRESS_FPS" not in os.environ):
+				# Without a terminal, restic reports progress rarely, if at all
+				command.env["RESTIC_PROGRESS_FPS"] = f"{max(4 / limits.no_progress_secs, 1 / 60):.4f}"
+			t0 = time.monotonic()
+			with self._memory_governor.lease(expected_peak_bytes, recorded_gogc, name = f"{operation} of {plan.name}") as lease:
+				span.set("memory_wait_secs", time.monotonic() - t0)
+				# Explicitly set values from the environment take precedence
+				command.env.update({ key: value for (key, value) in lease.environment.items() if (key not in os.environ) and (key not in command.env) })
+				resource_usage = { }
+				returncode = self._run_cmd(command, resource_usage = resource_usage, limits = limits, **kwargs)
+			with contextlib.suppress(ValueError):
+				gogc = int(command.env.get("GOGC", os.environ.get("GOGC", "100")))
+				if self._plan_db is not None:
+					try:
+						self._plan_db.append(plan.name, "memory", { "operation": operation, "time": time.time(), "peak_rss": resource_usage["max_rss"], "gogc": gogc })
+					except OSError as e:
+						# Only a hint for later runs, the operation itself succeeded
+						_log.warning("Unable to record memory usage in plan database %s: %s", self._plan_db.filename, str(e))
+			span.set("returncode", returncode)
+			return returncode
+
+	@staticmethod
+	def _parse_backup_json_line(line: bytes, result: dict):
+		try:
+			message = json.loads(line)
+		except ValueError:
+			return
+		match message.get("message_type"):
+			case "summary":
+				result["summary"] = { key: message[key] for key in [ "files_new", "files_changed", "files_unmodified", "total_files_processed", "total_bytes_processed", "data_added", "total_duration", "snapshot_id" ] if key in message }
+				_log.info("Backup finished: %d files (%d new, %d changed) with %.1f MiB processed, %.1f MiB added in %.0f secs", message.get("total_files_processed", 0), message.get("files_new", 0), message.get("files_changed", 0), message.get("total_bytes_processed", 0) / 1024 / 1024, message.get("data_added", 0) / 1024 / 1024, message.get("total_duration", 0))
+
+			case "error":
+				_log.error("Error during backup of %s: %s", message.get("item", "?"), message.get("error", { }).get("message", str(message)))
+
+	def _backup_command(self, plan: "BackupPlan", paths: list[str] | None = None):
+		command = ExecutionCommand()
+		self._restic_backup_command(command, plan, paths = paths)
+		command.prepend([ self._restic_binary ])
+		command.prepend([ "nice", "-n", str(self._nice) ])
+		command.prepend([ "ionice", "-c", self._ionice_class ])
+		command.append([ "--json" ])
+		return command
+
+	@staticmethod
+	def _aggregate_summaries(summaries: list[dict], aggregate_duration: callable = max):
+		summary = { key: sum(part_summary.get(key, 0) for part_summary in summaries) for key in [ "files_new", "files_changed", "files_unmodified", "total_files_processed", "total_bytes_processed", "data_added" ] }
+		summary["total_duration"] = aggregate_duration(part_summary.get("total_duration", 0) for part_summary in summaries)
+		summary["snapshot_ids"] = [ ]
+		for part_summary in summaries:
+			if "snapshot_id" in part_summary:
+				summary["snapshot_ids"].append(part_summary["snapshot_id"])
+			summary["snapshot_ids"] += part_summary.get("snapshot_ids", [ ])
+		return summary
+
+	@staticmethod
+	def _combine_returncodes(returncodes: list[int]):
+		failures = [ returncode for returncode in returncodes if returncode not in [ ResticBackupReturncodes.Success, ResticBackupReturncodes.IncompleteSnapshot ] ]
+		if len(failures) > 0:
+			return failures[0]
+		return ResticBackupReturncodes.IncompleteSnapshot if (ResticBackupReturncodes.IncompleteSnapshot in returncodes) else ResticBackupReturncodes.Success
+
+	def shard_partition(self, plan: "BackupPlan", force_rescan: bool = False) -> list[list[dict]]:
+		stored = None if (self._plan_db is None) else self._plan_db.get(plan.name, "shards")
+		if (stored is not None) and ((stored["roots"] != plan.source.paths) or (stored["shard_count"] != plan.source.shards)):
+			stored = None
+		if (stored is not None) and (not force_rescan) and (time.time() - stored["timestamp"] < plan.source.reshard_secs):
+			return stored["shards"]
+
+		excludes = self.source_excludes(plan) + list(self.excluded_mountpoints(plan))
+		t0 = time.monotonic()
+		scan_result = TreeScanner(is_excluded = lambda path: FileSystemTools.matches_exclude(path, excludes)).scan(plan.source.paths)
+		planner = ShardPlanner(scan_result, plan.source.shards)
+		shards = planner.partition(plan.source.paths)
+		_log.info("Scanned sources of %s in %.1f secs, partitioned into %d shards with imbalance %.2f", plan.name, time.monotonic() - t0, len(shards), planner.imbalance(shards))
+		if (stored is not None) and (planner.imbalance(stored["shards"]) <= 1.25):
+			# Changing the partition means restic does not find parent
+			# snapshots once, so keep the old one while it is good enough
+			_log.info("Keeping previous partition of %s with imbalance %.2f", plan.name, planner.imbalance(stored["shards"]))
+			shards = stored["shards"]
+		if self._plan_db is not None:
+			self._plan_db.set(plan.name, "shards", { "timestamp": time.time(), "roots": plan.source.paths, "shard_count": plan.source.shards, "shards": shards })
+		return shards
+
+	def _run_parented_backup(self, plan: "BackupPlan", command: ExecutionCommand, parent_key: str, fingerprint: list) -> tuple[int, dict | None]:
+		# Naming the parent snapshot explicitly spares restic from loading all
+		# snapshots of a shared repository just to find it. The fingerprint
+		# (what was backed up) ensures the parent actually matches.
+		db_key = f"parent_{parent_key}"
+		parent = None if (self._plan_db is None) else self._plan_db.get(plan.name, db_key)
+		if (parent is not None) and (parent["fingerprint"] == fingerprint):
+			command.append([ "--parent", parent["snapshot_id"] ])
+		else:
+			parent = None
+		record = { }
+		returncode = self._run_restic(command, plan, "backup", stdout_line_callback = lambda line: self._parse_backup_json_line(line, record))
+		summary = record.get("summary")
+		if self._plan_db is not None:
+			if (summary is not None) and ("snapshot_id" in summary):
+				self._plan_db.set(plan.name, db_key, { "snapshot_id": summary["snapshot_id"], "fingerprint": fingerprint })
+			elif (parent is not None) and (returncode == ResticBackupReturncodes.FatalErrorNoSnapshot):
+				# The parent may have been forgotten in the meantime, let
+				# restic find one by itself next time
+				self._plan_db.set(plan.name, db_key, None)
+		return (returncode, summary)
+
+	def _run_backup_shard(self, plan: "BackupPlan", shard: list[dict], all_units: list[dict], tags: list[str], parent_key: str):
+		with tracer.span("shard", plan = plan.name, shard = parent_key):
+			excludes = self.source_excludes(plan)
+			paths = [ path for path in ShardPlanner.expand(shard, all_units) if not FileSystemTools.matches_exclude(path, excludes) ]
+			if len(paths) == 0:
+				return (ResticBackupReturncodes.Success, None)
+			with tempfile.NamedTemporaryFile("w", prefix = "rebade_shard_", suffix = ".txt") as filelist:
+				for path in paths:
+					print(path, file = filelist)
+				filelist.flush()
+				command = self._backup_command(plan, paths = [ ])
+				command.append([ "--files-from-verbatim", filelist.name ])
+				for tag in tags:
+					command.append([ "--tag", tag ])
+				return self._run_parented_backup(plan, command, parent_key = parent_key, fingerprint = shard)
+
+	def _execute_sharded_backup(self, plan: "BackupPlan", run_record: dict):
+		# All shards go into the same repository concurrently, restic only
+		# takes non-exclusive locks for backups. The common tag allows
+		# treating the shard snapshots as one logical backup.
+		shards = self.shard_partition(plan)
+		all_units = [ unit for shard in shards for unit in shard ]
+		group_id = uuid.uuid4().hex[:16]
+		with concurrent.futures.ThreadPoolExecutor(max_workers = len(shards)) as executor:
+			futures = [ executor.submit(self._run_backup_shard, plan, shard, all_units, [ f"rebade-shard-group={group_id}", f"rebade-shard={i + 1}/{len(shards)}" ], parent_key = f"shard_{i + 1}") for (i, shard) in enumerate(shards) ]
+			results = [ future.result() for future in futures ]
+
+		summaries = [ summary for (returncode, summary) in results if summary is not None ]
+		run_record["shards"] = len(shards)
+		run_record["group_id"] = group_id
+		return (self._combine_returncodes([ returncode for (returncode, summary) in results ]), self._aggregate_summaries(summaries) if (len(summaries) > 0) else None)
+
+	def _stream_producer_cmdline(self, stream: "StreamSource"):
+		return [ "ionice", "-c", self._ionice_class, "nice", "-n", str(self._nice) ] + list(stream.command)
+
+	def _run_backup_stream(self, plan: "BackupPlan", stream: "StreamSource"):
+		# The producer's stdout is handed to restic directly, so the data never
+		# touches the disk. restic cannot know if the producer succeeded and
+		# will happily create a snapshot of a truncated dump, so the exit
+		# codes of both ends need to be checked.
+		command = self._backup_command(plan, paths = [ ])
+		command.append([ "--stdin", "--stdin-filename", stream.filename ])
+		producer_cmdline = self._stream_producer_cmdline(stream)
+		_log.debug("Execution of stream producer: %s", CmdlineEscape().cmdline(producer_cmdline))
+		stream_record = { }
+		timeouts = plan.timeouts.get("stream", { })
+		limits = ProcessLimits(total_secs = timeouts.get("total_secs"))
+		(pipe_r, pipe_w) = os.pipe()
+		try:
+			producer = self._supervisor.start(producer_cmdline, stdin = subprocess.DEVNULL, stdout = pipe_w, limits = limits, name = os.path.basename(stream.command[0]))
+		except OSError as e:
+			_log.error("Unable to start producer of stream source %s: %s", stream.filename, str(e))
+			os.close(pipe_r)
+			return (ResticBackupReturncodes.StreamSourceFailed, None)
+		finally:
+			os.close(pipe_w)
+
+		returncode = None
+		try:
+			with os.fdopen(pipe_r, "rb") as stdin:
+				returncode = self._run_restic(command, plan, "stream", stdin = stdin, stdout_line_callback = lambda line: self._parse_backup_json_line(line, stream_record))
+		finally:
+			# Once restic is gone, the producer receives SIGPIPE on its next
+			# write; one that hangs without writing would keep us waiting
+			# forever, so it is interrupted as well
+			if returncode not in [ ResticBackupReturncodes.Success, ResticBackupReturncodes.IncompleteSnapshot ]:
+				producer.cancel(f"restic exited with status {returncode}")
+			elif producer.wait(limits.grace_secs) is None:
+				producer.cancel("still running after restic finished")
+			producer_returncode = producer.wait()
+
+		summary = stream_record.get("summary")
+		if producer_returncode != 0:
+			_log.error("Producer of stream source %s failed with returncode %d", stream.filename, producer_returncode)
+			if (summary is not None) and ("snapshot_id" in summary):
+				_log.warning("Removing snapshot %s of incomplete stream source %s", summary["snapshot_id"], stream.filename)
+				self.execute_forget_snapshot(plan, summary["snapshot_id"])
+				summary = None
+			if returncode in [ ResticBackupReturncodes.Success, ResticBackupReturncodes.IncompleteSnapshot ]:
+				returncode = ResticBackupReturncodes.StreamSourceFailed
+		return (returncode, summary)
+
 	def execute_backup(self, plan: "BackupPlan"):
+		# Probe before the hooks so that an unreachable target does not cause
+		# any activity at all
+		try:
+			self.ensure_reachable(plan)
+		except TargetUnreachableException as e:
+			_log.warning("Not starting backup: %s", str(e))
+			return ResticBackupReturncodes.TargetUnreachable
+
 		with self.execute_pre_post_hooks(plan) as run_args:
-			command = ExecutionCommand()
-			self._restic_backup_command(command, plan)
-			command.prepend([ self._restic_binary ])
-			command.prepend([ "nice", "-n", str(self._nice) ])
-			command.prepend([ "ionice", "-c", self._ionice_class ])
-			returncode = self._run_cmd(command)
-			try:
+			t0 = time.time()
+			run_record = { "start": t0 }
+			results = [ ]
+			if len(plan.source.paths) > 0:
+				if plan.source.shards > 1:
+					results.append(self._execute_sharded_backup(plan, run_record))
+				else:
+					results.append(self._run_parented_backup(plan, self._backup_command(plan), parent_key = "paths", fingerprint = plan.source.paths))
+			for stream in plan.source.streams:
+				with tracer.span("stream", plan = plan.name, filename = stream.filename):
+					results.append(self._run_backup_stream(plan, stream))
+
+			summaries = [ summary for (returncode, summary) in results if summary is not None ]
+			if len(summaries) == 1:
+				run_record["summary"] = summaries[0]
+			elif len(summaries) > 1:
+				run_record["summary"] = self._aggregate_summaries(summaries, aggregate_duration = sum)
+			returncode = self._combine_returncodes([ returncode for (returncode, summary) in results ])
+			t1 = time.time()
+			backup_status = returncode
+			with contextlib.suppress(ValueError):
 				backup_status = ResticBackupReturncodes(returncode)
-			except ValueError:
-				pass
+			if self._plan_db is not None:
+				run_record.update({ "duration_secs": t1 - t0, "returncode": returncode })
+				self._plan_db.append(plan.name, "runs", run_record)
+				if backup_status in [ ResticBackupReturncodes.Success, ResticBackupReturncodes.IncompleteSnapshot ]:
+					self._plan_db.set(plan.name, "last_backup", t1)
 
 			# Run the post-hook only if the backup was a complete success (so
 			# we get notified if there are only partial snapshots created)
@@ -168,10 +558,70 @@ class BackupEngine():
 		command = ExecutionCommand()
 		self._restic_remote_command(command, plan)
 		command.prepend([ self._restic_binary, "mount" ])
+		self._restic_scope_options(command, [ plan ])
 		command.append([ mountpoint ])
 		return self._run_cmd(command)
 
-	def execute_forget(self, plan: "BackupPlan", scale = 1.0):
+	def start_mount(self, plan: "BackupPlan", mountpoint: str) -> subprocess.Popen:
+		# Starts a mount that outlives the current execution round, so it
+		# must not depend on the SSH master connection that close() ends.
+		# It also does not inhibit shutdown, there is nothing to finish.
+		self.ensure_reachable(plan)
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(mountpoint)
+		command = ExecutionCommand()
+		self._restic_remote_command(command, plan, multiplex = False)
+		command.prepend([ self._restic_binary, "mount" ])
+		self._restic_scope_options(command, [ plan ])
+		command.append([ mountpoint ])
+		env = dict(os.environ)
+		env.update(command.env)
+		_log.debug("Starting mount: %s", CmdlineEscape().cmdline(command.cmdline))
+		return subprocess.Popen(command.cmdline, env = env, stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL)
+
+	def execute_cache_prewarm(self, plan: "BackupPlan"):
+		# Listing the latest snapshot loads the index and all tree blobs that
+		# the next backup needs to compare against its parent snapshot.
+		# Having them cached avoids downloading them when the backup runs.
+		command = ExecutionCommand()
+		self._restic_remote_command(command, plan)
+		command.prepend([ self._restic_binary, "ls", "latest" ])
+		self._restic_scope_options(command, [ plan ])
+		command.prepend([ "nice", "-n", str(self._nice) ])
+		command.prepend([ "ionice", "-c", self._ionice_class ])
+		t0 = time.monotonic()
+		returncode = self._run_restic(command, plan, "prewarm", stdout = subprocess.DEVNULL)
+		prewarm_secs = time.monotonic() - t0
+		if (returncode == 0) and (self._plan_db is not None):
+			cache_info = self._plan_db.get(plan.name, "cache", { })
+			cache_info.update({ "prewarmed_at": time.time(), "prewarm_secs": prewarm_secs })
+			self._plan_db.set(plan.name, "cache", cache_info)
+		return returncode
+
+	def execute_cache_cleanup(self, plan: "BackupPlan"):
+		command = ExecutionCommand([ self._restic_binary, "cache", "--cleanup", "--cache-dir", plan.cache_dir ])
+		returncode = self._run_cmd(command)
+		if (returncode == 0) and (self._plan_db is not None):
+			cache_info = self._plan_db.get(plan.name, "cache", { })
+			cache_info.update({ "cleanup_at": time.time() })
+			self._plan_db.set(plan.name, "cache", cache_info)
+		return returncode
+
+	def cache_due_for_prewarm(self, plan: "BackupPlan"):
+		if self._plan_db is None:
+			return False
+		last_backup = self._plan_db.get(plan.name, "last_backup")
+		if last_backup is None:
+			# Nothing to list yet
+			return False
+		return self._plan_db.get(plan.name, "cache", { }).get("prewarmed_at", 0) < last_backup
+
+	def cache_due_for_cleanup(self, plan: "BackupPlan", interval_secs: int = 86400):
+		if self._plan_db is None:
+			return False
+		return time.time() - self._plan_db.get(plan.name, "cache", { }).get("cleanup_at", 0) > interval_secs
+
+	def execute_forget(self, plan: "BackupPlan", scale = 1.0, prune: bool = True, scope_plans: list["BackupPlan"] | None = None):
 		time_params = {
 			"--keep-monthly": 12 * 3,
 			"--keep-weekly": 52,
@@ -183,16 +633,182 @@ class BackupEngine():
 		command = ExecutionCommand()
 		self._restic_remote_command(command, plan)
 		command.prepend([ self._restic_binary, "forget" ])
+		# Policies apply to each host/path combination separately, so one
+		# invocation covers all plans that share the repository
+		command.append([ "--group-by", "host,paths" ])
+		self._restic_scope_options(command, scope_plans or [ plan ])
 		command.append([ "--keep-yearly", "unlimited" ])
 
 		for (key, value) in time_params.items():
 			command.append([ key, value ])
-		command.append([ "--prune" ])
+		if prune:
+			command.append([ "--prune" ])
+		return self._run_restic(command, plan, "forget_prune" if prune else "forget")
+
+	def execute_prune(self, plan: "BackupPlan"):
+		command = ExecutionCommand()
+		self._restic_remote_command(command, plan)
+		command.prepend([ self._restic_binary, "prune" ])
+		return self._run_restic(command, plan, "prune")
+
+	def execute_check(self, plan: "BackupPlan", read_data_subset: str | None = None):
+		command = ExecutionCommand()
+		self._restic_remote_command(command, plan)
+		command.prepend([ self._restic_binary, "check" ])
+		if read_data_subset is not None:
+			command.append([ "--read-data-subset", read_data_subset ])
+		command.prepend([ "nice", "-n", str(self._nice) ])
+		command.prepend([ "ionice", "-c", self._ionice_class ])
+		return self._run_restic(command, plan, "check")
+
+	def _restic_copy_source_options(self, command: ExecutionCommand, plan: "BackupPlan"):
+		# The plan's repository is the source, its options are passed with
+		# their "--from-" counterparts. Environment variables would apply to
+		# both repositories, so the source's REST credentials become part of
+		# its URL instead, which is passed through the environment to keep it
+		# off the command line.
+		source = ExecutionCommand()
+		self._restic_target_command(source, plan.target, multiplex = False)
+		repository = source.cmdline[source.cmdline.index("-r") + 1]
+		username = source.env.pop("RESTIC_REST_USERNAME", None)
+		password = source.env.pop("RESTIC_REST_PASSWORD", None)
+		if (username is not None) or (password is not None):
+			# Only needed for credentials, urllib.parse is otherwise not loaded
+			import urllib.parse
+			userinfo = urllib.parse.quote(username or "", safe = "")
+			if password is not None:
+				userinfo += ":" + urllib.parse.quote(password, safe = "")
+			(scheme, _, location) = repository.partition("://")
+			command.env["RESTIC_FROM_REPOSITORY"] = f"{scheme}://{userinfo}@{location}"
+		else:
+			command.append([ "--from-repo", repository ])
+		command.append([ "--from-password-file", plan.keyfile ])
+
+		for (key, value) in source.env.items():
+			if command.env.get(key, value) != value:
+				raise ConfigurationException(f"Cannot copy {plan.name}: source and destination repository need different values of {key}.")
+		command.env.update(source.env)
+
+		# --cacert has no "--from-" counterpart, but can be given multiple
+		# times; whether the certificates are compatible is checked when the
+		# pipeline is parsed
+		if ("--cacert" in source.cmdline) and (plan.target.get("protocol", "https") == "https") and (plan.target["ca_filename"] not in command.cmdline):
+			command.append([ "--cacert", plan.target["ca_filename"] ])
+
+	def execute_copy(self, plan: "BackupPlan", target: dict, keyfile: str, cache_dir: str):
+		# sftp.args would apply to both repositories, so neither can use a
+		# multiplexed SSH connection
+		command = ExecutionCommand()
+		self._restic_target_command(command, target, multiplex = False)
+		command.prepend([ self._restic_binary, "copy", "-p", keyfile ])
+		command.append([ "--cache-dir", cache_dir ])
+		self._restic_copy_source_options(command, plan)
+		command.prepend([ "nice", "-n", str(self._nice) ])
+		command.prepend([ "ionice", "-c", self._ionice_class ])
+		return self._run_restic(command, plan, "copy")
+
+	def execute_command(self, cmdline: list[str]):
+		command = ExecutionCommand(list(cmdline))
+		command.prepend([ "nice", "-n", str(self._nice) ])
+		command.prepend([ "ionice", "-c", self._ionice_class ])
+		return self._run_cmd(command)
+
+	def execute_plan(self, plan: "BackupPlan"):
+		with tracer.span("plan", plan = plan.name) as span:
+			if len(plan.pipeline) == 0:
+				returncode = self.execute_backup(plan)
+			else:
+				try:
+					self.ensure_reachable(plan)
+				except TargetUnreachableException as e:
+					_log.warning("Not starting pipeline: %s", str(e))
+					return ResticBackupReturncodes.TargetUnreachable
+				returncode = PipelineExecutor(self, plan).run()
+			span.set("returncode", int(returncode))
+			return returncode
+
+	def execute_forget_snapshot(self, plan: "BackupPlan", snapshot_id: str):
+		command = ExecutionCommand()
+		self._restic_remote_command(command, plan)
+		command.prepend([ self._restic_binary, "forget" ])
+		command.append([ snapshot_id ])
 		return self._run_cmd(command)
 
-	def execute_generic_action(self, plan: "BackupPlan", action: str):
+	def execute_list_snapshots(self, plan: "BackupPlan", scope_plans: list["BackupPlan"] | None = None) -> list[dict]:
+		command = self._restic_action_command(plan, "snapshots", scope_plans = scope_plans)
+		command.append([ "--json" ])
+		output = bytearray()
+		returncode = self._run_cmd(command, stdout_line_callback = output.extend)
+		if returncode != 0:
+			return None
+		return json.loads(output)
+
+	def _restic_action_command(self, plan: "BackupPlan", action: str, scope_plans: list["BackupPlan"] | None = None) -> ExecutionCommand:
 		command = ExecutionCommand()
 		self._restic_remote_command(command, plan)
 		command.prepend([ self._restic_binary, action ])
+		if action == "snapshots":
+			self._restic_scope_options(command, scope_plans or [ plan ])
+		return command
+
+	def execute_captured_action(self, plan: "BackupPlan", action: str, json_output: bool = False, scope_plans: list["BackupPlan"] | None = None) -> CapturedOutput:
+		command = self._restic_action_command(plan, action, scope_plans = scope_plans)
+		if json_output:
+			command.append([ "--json" ])
+		output = bytearray()
+		# stderr goes to a file so that a chatty restic can never block on
+		# a full pipe while we read stdout
+		with tempfile.TemporaryFile() as stderr:
+			t0 = time.monotonic()
+			returncode = self._run_cmd(command, stderr = stderr, stdout_line_callback = output.extend)
+			duration_secs = time.monotonic() - t0
+			stderr.seek(0)
+			errors = stderr.read()
+		return CapturedOutput(returncode = returncode, stdout = bytes(output), stderr = errors, duration_secs = duration_secs)
+
+	def execute_ls(self, plan: "BackupPlan", snapshot_id: str, line_callback: callable, paths: list[str] | None = None) -> int:
+		# Without paths, the whole snapshot is listed recursively; with
+		# paths, only those directories and their immediate children
+		command = ExecutionCommand()
+		self._restic_remote_command(command, plan)
+		command.prepend([ self._restic_binary, "ls", "--json", snapshot_id ])
+		if paths is not None:
+			command.append(paths)
+		return self._run_restic(command, plan, "ls", stdout_line_callback = line_callback)
+
+	def execute_restore(self, plan: "BackupPlan", snapshot_id: str, target_dir: str, includes: list[str] | None = None, sparse: bool = False, verify: bool = False) -> int:
+		command = ExecutionCommand()
+		self._restic_remote_command(command, plan)
+		command.prepend([ self._restic_binary, "restore", snapshot_id, "--target", target_dir ])
+		for include in (includes or [ ]):
+			command.append([ "--include", include ])
+		if sparse:
+			command.append([ "--sparse" ])
+		if verify:
+			command.append([ "--verify" ])
+		return self._run_restic(command, plan, "restore")
+
+	def execute_dump(self, plan: "BackupPlan", snapshot_id: str, path: str, archive: str = "tar") -> int:
+		# Output is inherited, restic writes the archive directly to our
+		# stdout without any intermediate file
+		command = ExecutionCommand()
+		self._restic_remote_command(command, plan)
+		command.prepend([ self._restic_binary, "dump", "--archive", archive ])
+		command.append([ snapshot_id, path ])
+		return self._run_restic(command, plan, "dump")
+
+	def repository_version(self, plan: "BackupPlan") -> int | None:
+		command = self._restic_action_command(plan, "cat")
+		command.append([ "config" ])
+		output = bytearray()
+		if self._run_cmd(command, stdout_line_callback = output.extend) != 0:
+			return None
+		try:
+			return int(json.loads(output).get("version", 1))
+		except (ValueError, AttributeError):
+			return None
+
+	def execute_generic_action(self, plan: "BackupPlan", action: str, scope_plans: list["BackupPlan"] | None = None):
+		command = self._restic_action_command(plan, action, scope_plans = scope_plans)
 		success = self._run_cmd(command)
 		return success
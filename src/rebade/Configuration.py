@@ -22,7 +22,11 @@
 import os
 import stat
 import enum
+import glob
 import json
+import hashlib
+from rebade.PlanDatabase import PlanDatabase
+from rebade.Tracing import tracer
 from rebade.Exceptions import ConfigurationException, PlanNotFoundException, InsecurePermissionsException, NoDefaultPlanException
 
 class HookMethod(enum.Enum):
@@ -31,6 +35,7 @@ class HookMethod(enum.Enum):
 class Condition(enum.Enum):
 	Success = "success"
 	Failure = "failure"
+	Always = "always"
 
 class Hook():
 	def __init__(self, method: HookMethod, condition: Condition, args: dict):
@@ -66,11 +71,126 @@ class Hook():
 	def __str__(self):
 		return f"Hook<{self.method}, {self.condition}, {self.args}>"
 
+class StageType(enum.Enum):
+	Command = "command"
+	Backup = "backup"
+	Copy = "copy"
+	Forget = "forget"
+	Prune = "prune"
+	Check = "check"
+	Notify = "notify"
+
+class PipelineStage():
+	def __init__(self, name: str, stage_type: StageType, after: list[str], condition: Condition, args: dict):
+		self._name = name
+		self._stage_type = stage_type
+		self._after = after
+		self._condition = condition
+		self._args = args
+
+	@property
+	def name(self):
+		return self._name
+
+	@property
+	def stage_type(self):
+		return self._stage_type
+
+	@property
+	def after(self):
+		return self._after
+
+	@property
+	def condition(self):
+		return self._condition
+
+	@property
+	def args(self):
+		return self._args
+
+	@classmethod
+	def parse(cls, data: dict, cache_base_dir: str = "/var/cache/rebade"):
+		if "name" not in data:
+			raise ConfigurationException("No 'name' provided for pipeline stage.")
+		stage_type = StageType(data["type"])
+		after = data.get("after", [ ])
+		if isinstance(after, str):
+			after = [ after ]
+		condition = Condition(data.get("condition", "success"))
+		match stage_type:
+			case StageType.Command:
+				if "command" not in data:
+					raise ConfigurationException(f"No 'command' provided for command stage {data['name']}.")
+				args = { "command": [ data["command"] ] if isinstance(data["command"], str) else data["command"] }
+
+			case StageType.Backup | StageType.Prune:
+				args = { }
+
+			case StageType.Copy:
+				if ("target" not in data) or ("keyfile" not in data):
+					raise ConfigurationException(f"Copy stage {data['name']} needs a 'target' and a 'keyfile'.")
+				args = {
+					"target": data["target"],
+					"keyfile": data["keyfile"],
+					"cache_dir": data.get("cache_dir", os.path.join(cache_base_dir, BackupPlan.target_repository_key(data["target"]))),
+				}
+
+			case StageType.Forget:
+				args = {
+					"scale": float(data.get("scale", 1.0)),
+					"prune": bool(data.get("prune", False)),
+				}
+
+			case StageType.Check:
+				args = { }
+				if "read_data_subset" in data:
+					args["read_data_subset"] = str(data["read_data_subset"])
+
+			case StageType.Notify:
+				args = { "hook": Hook.parse({ "method": "http_get" } | data | { "condition": "always" }) }
+
+		return cls(name = data["name"], stage_type = stage_type, after = after, condition = condition, args = args)
+
+	def __str__(self):
+		return f"PipelineStage<{self.name}, {self.stage_type.value}>"
+
+class StreamSource():
+	def __init__(self, command: list[str], filename: str):
+		self._command = command
+		self._filename = filename
+
+	@property
+	def command(self):
+		return self._command
+
+	@property
+	def filename(self):
+		return self._filename
+
+	@classmethod
+	def parse(cls, data: dict):
+		if "command" not in data:
+			raise ConfigurationException("No 'command' provided for stream source.")
+		if "filename" not in data:
+			raise ConfigurationException("No 'filename' provided for stream source.")
+		command = data["command"]
+		if isinstance(command, str):
+			command = [ command ]
+		return cls(command = command, filename = data["filename"])
+
+	def __str__(self):
+		return f"StreamSource<{self.filename}>"
+
 class BackupSource():
-	def __init__(self, paths: list[str], exclude: list[str], only_filesystems: list[str]):
+	def __init__(self, paths: list[str], exclude: list[str], only_filesystems: list[str], shards: int = 1, reshard_secs: int = 7 * 86400, streams: list[StreamSource] | None = None, exclude_caches: bool = False, exclude_if_present: list[str] | None = None):
 		self._paths = paths
 		self._exclude = exclude
+		self._exclude_caches = exclude_caches
+		self._exclude_if_present = exclude_if_present if (exclude_if_present is not None) else [ ]
 		self._only_filesystems = set(only_filesystems)
+		self._shards = shards
+		self._reshard_secs = reshard_secs
+		self._streams = streams if (streams is not None) else [ ]
 
 	@property
 	def paths(self):
@@ -80,24 +200,63 @@ class BackupSource():
 	def exclude(self):
 		return self._exclude
 
+	@property
+	def exclude_caches(self):
+		return self._exclude_caches
+
+	@property
+	def exclude_if_present(self):
+		return self._exclude_if_present
+
 	@property
 	def only_filesystems(self):
 		return self._only_filesystems
 
+	@property
+	def shards(self):
+		return self._shards
+
+	@property
+	def reshard_secs(self):
+		return self._reshard_secs
+
+	@property
+	def streams(self):
+		return self._streams
+
 	@classmethod
 	def parse(cls, data: dict):
-		paths = data["paths"]
+		paths = data.get("paths", [ ])
+		streams = [ StreamSource.parse(stream_data) for stream_data in data.get("streams", [ ]) ]
+		if (len(paths) == 0) and (len(streams) == 0):
+			raise ConfigurationException("Backup source needs at least one path or stream.")
+		filenames = [ stream.filename for stream in streams ]
+		if len(set(filenames)) != len(filenames):
+			raise ConfigurationException("Filenames of stream sources must be unique.")
 		exclude = data.get("exclude", [ ])
+		exclude_caches = bool(data.get("exclude_caches", False))
+		exclude_if_present = data.get("exclude_if_present", [ ])
+		if any(("/" in marker) for marker in exclude_if_present):
+			raise ConfigurationException("Markers given in exclude_if_present must be plain filenames.")
 		only_filesystems = data.get("only_filesystems", [ ])
-		return cls(paths = paths, exclude = exclude, only_filesystems = only_filesystems)
+		shards = int(data.get("shards", 1))
+		if shards < 1:
+			raise ConfigurationException(f"Number of shards must be at least 1, but was {shards}.")
+		reshard_secs = int(data.get("reshard_secs", 7 * 86400))
+		return cls(paths = paths, exclude = exclude, only_filesystems = only_filesystems, shards = shards, reshard_secs = reshard_secs, streams = streams, exclude_caches = exclude_caches, exclude_if_present = exclude_if_present)
 
 class BackupMethod(enum.Enum):
 	SFTP = "sftp"
 	REST = "rest"
 	Local = "local"
 
+class Compression(enum.Enum):
+	Auto = "auto"
+	Off = "off"
+	Max = "max"
+
 class BackupPlan():
-	def __init__(self, name: str, is_default: bool, keyfile: str, soft_period_secs: int, hard_period_secs: int, source: BackupSource, target: dict, pre_hooks: list[Hook], post_hooks: list[Hook]):
+	def __init__(self, name: str, is_default: bool, keyfile: str, soft_period_secs: int, hard_period_secs: int, source: BackupSource, target: dict, pre_hooks: list[Hook], post_hooks: list[Hook], performance: dict, cache_dir: str, schedule: dict, pipeline: list[PipelineStage] | None = None, host: str | None = None, timeouts: dict | None = None, definition: dict | None = None):
 		self._validate_keyfile(keyfile)
 		self._name = name
 		self._is_default = is_default
@@ -108,9 +267,17 @@ class BackupPlan():
 		self._target = target
 		self._pre_hooks = pre_hooks
 		self._post_hooks = post_hooks
+		self._performance = performance
+		self._cache_dir = cache_dir
+		self._schedule = schedule
+		self._pipeline = pipeline if (pipeline is not None) else [ ]
+		self._host = host if (host is not None) else os.uname().nodename
+		self._timeouts = timeouts if (timeouts is not None) else { }
+		self._definition = definition
 
 	def _validate_keyfile(self, filename: str):
-		mode = stat.S_IMODE(os.stat(filename).st_mode)
+		with tracer.span("validate_keyfile", filename = filename):
+			mode = stat.S_IMODE(os.stat(filename).st_mode)
 		if mode != 0o600:
 			raise InsecurePermissionsException(f"Permissions of {filename} expected to be 600 but were {mode:o}. Refusing to work with this keyfile.")
 
@@ -150,17 +317,146 @@ class BackupPlan():
 	def post_hooks(self):
 		return self._post_hooks
 
+	@property
+	def performance(self):
+		return self._performance
+
+	@property
+	def cache_dir(self):
+		return self._cache_dir
+
+	@property
+	def schedule(self):
+		return self._schedule
+
+	@property
+	def pipeline(self):
+		return self._pipeline
+
+	@property
+	def host(self):
+		return self._host
+
+	@property
+	def timeouts(self):
+		return self._timeouts
+
+	@property
+	def tag(self):
+		return f"rebade-plan={self._name}"
+
+	@property
+	def definition(self):
+		return self._definition
+
+	@property
+	def repository_key(self):
+		return self.target_repository_key(self._target)
+
+	@staticmethod
+	def target_repository_key(target: dict):
+		# Identifies the repository independently of credentials so that
+		# plans which share a repository can also share its cache
+		identity = { key: target[key] for key in [ "method", "protocol", "username", "hostname", "port", "remote_path" ] if key in target }
+		return hashlib.sha256(json.dumps(identity, sort_keys = True).encode()).hexdigest()[:16]
+
+	@classmethod
+	def parse_performance(cls, data: dict):
+		performance = { }
+		for key in [ "pack_size", "read_concurrency", "connections" ]:
+			if key in data:
+				performance[key] = int(data[key])
+				if performance[key] < 1:
+					raise ConfigurationException(f"Performance setting '{key}' must be a positive integer, but was {performance[key]}.")
+		if "compression" in data:
+			performance["compression"] = Compression(data["compression"]).value
+		return performance
+
+	@classmethod
+	def parse_timeouts(cls, data: dict):
+		# Per restic operation (backup, forget, prune, check, ...), a limit of
+		# the total run time and of the time without any output
+		timeouts = { }
+		for (operation, limits) in data.items():
+			timeouts[operation] = { }
+			for key in [ "total_secs", "no_progress_secs" ]:
+				if key in limits:
+					timeouts[operation][key] = float(limits[key])
+					if timeouts[operation][key] <= 0:
+						raise ConfigurationException(f"Timeout '{key}' of {operation} must be positive, but was {limits[key]}.")
+		return timeouts
+
+	@classmethod
+	def parse_schedule(cls, data: dict):
+		schedule = {
+			"days": data.get("days", "*-*-*"),
+			"window_secs": int(data.get("window_secs", 3600)),
+		}
+		try:
+			time_fields = [ int(value) for value in data.get("window_start", "22:00").split(":") ]
+			if (len(time_fields) not in [ 2, 3 ]) or (not (0 <= time_fields[0] < 24)) or (not all(0 <= value < 60 for value in time_fields[1:])):
+				raise ValueError()
+		except ValueError:
+			raise ConfigurationException(f"Schedule window start must be given as HH:MM or HH:MM:SS, but was {data['window_start']}.")
+		schedule["window_start_secs"] = (3600 * time_fields[0]) + (60 * time_fields[1]) + (time_fields[2] if (len(time_fields) == 3) else 0)
+		if "on_calendar" in data:
+			schedule["on_calendar"] = data["on_calendar"]
+		return schedule
+
+	@classmethod
+	def parse_pipeline(cls, data: list[dict], target: dict, cache_base_dir: str = "/var/cache/rebade"):
+		stages = [ PipelineStage.parse(stage_data, cache_base_dir = cache_base_dir) for stage_data in data ]
+		stages_by_name = { stage.name: stage for stage in stages }
+		if len(stages_by_name) != len(stages):
+			raise ConfigurationException("Names of pipeline stages must be unique.")
+		if len([ stage for stage in stages if stage.stage_type == StageType.Backup ]) > 1:
+			raise ConfigurationException("A pipeline may contain at most one backup stage.")
+		for stage in stages:
+			for dependency in stage.after:
+				if dependency not in stages_by_name:
+					raise ConfigurationException(f"Pipeline stage {stage.name} depends on unknown stage {dependency}.")
+			if stage.stage_type == StageType.Copy:
+				# restic's --cacert applies to both repositories and replaces
+				# the system certificates
+				ca_filenames = set(repository_target.get("ca_filename") for repository_target in [ target, stage.args["target"] ] if (BackupMethod(repository_target["method"]) == BackupMethod.REST) and (repository_target.get("protocol", "https") == "https"))
+				if (None in ca_filenames) and (len(ca_filenames) > 1):
+					raise ConfigurationException(f"Copy stage {stage.name} cannot verify one repository with a CA file and the other with the system certificates.")
+
+		# Kahn's algorithm, anything left over is part of a cycle
+		remaining = { stage.name: set(stage.after) for stage in stages }
+		while len(remaining) > 0:
+			ready = [ name for (name, dependencies) in remaining.items() if len(dependencies) == 0 ]
+			if len(ready) == 0:
+				raise ConfigurationException(f"Pipeline contains a dependency cycle among stages {', '.join(sorted(remaining))}.")
+			for name in ready:
+				del remaining[name]
+			for dependencies in remaining.values():
+				dependencies.difference_update(ready)
+		return stages
+
 	@classmethod
-	def parse(cls, plan_name: str, plan_data: dict):
+	def parse(cls, plan_name: str, plan_data: dict, cache_base_dir: str = "/var/cache/rebade", default_schedule: dict | None = None):
 		source = BackupSource.parse(plan_data["source"])
 		target = plan_data["target"]
 		pre_hooks = [ ] if ("pre_hooks" not in plan_data) else [ Hook.parse(hook_data) for hook_data in plan_data["pre_hooks"] ]
 		post_hooks = [ ] if ("post_hooks" not in plan_data) else [ Hook.parse(hook_data) for hook_data in plan_data["post_hooks"] ]
-		return cls(name = plan_name, is_default = plan_data.get("default", False), keyfile = plan_data["keyfile"], soft_period_secs = plan_data.get("soft_period_secs", 12 * 3600), hard_period_secs = plan_data.get("hard_period_secs", 16 * 3600), source = source, target = target, pre_hooks = pre_hooks, post_hooks = post_hooks)
+		performance = cls.parse_performance(plan_data.get("performance", { }))
+		if "," in plan_name:
+			# Plan names end up in restic tags, which are comma-separated
+			raise ConfigurationException(f"Plan name must not contain a comma: {plan_name}")
+		cache_dir = plan_data.get("cache_dir", os.path.join(cache_base_dir, cls.target_repository_key(target)))
+		schedule = cls.parse_schedule((default_schedule or { }) | plan_data.get("schedule", { }))
+		pipeline = cls.parse_pipeline(plan_data.get("pipeline", [ ]), target, cache_base_dir = cache_base_dir)
+		timeouts = cls.parse_timeouts(plan_data.get("timeouts", { }))
+		return cls(name = plan_name, is_default = plan_data.get("default", False), keyfile = plan_data["keyfile"], soft_period_secs = plan_data.get("soft_period_secs", 12 * 3600), hard_period_secs = plan_data.get("hard_period_secs", 16 * 3600), source = source, target = target, pre_hooks = pre_hooks, post_hooks = post_hooks, performance = performance, cache_dir = cache_dir, schedule = schedule, pipeline = pipeline, host = plan_data.get("host"), timeouts = timeouts, definition = plan_data)
 
 class Configuration():
-	def __init__(self, plans: dict):
+	def __init__(self, plans: dict, database_filename: str | None = None, include_dir: str | None = None, index_dir: str = "/var/cache/rebade/index", global_definition: dict | None = None):
 		self._plans = plans
+		self._include_dir = include_dir
+		self._index_dir = index_dir
+		self._global_definition = global_definition
+		self._plan_db = PlanDatabase(database_filename or self.default_database_filename())
 		self._default_plan = None
 		self._process_data()
 
@@ -186,21 +482,86 @@ class Configuration():
 					raise ConfigurationException("Invalid plan configuration, duplicate default plan found.")
 				self._default_plan = plan
 
+	@property
+	def include_dir(self):
+		return self._include_dir
+
+	@property
+	def index_dir(self):
+		return self._index_dir
+
+	def diff(self, other: "Configuration") -> tuple[list[str], list[str], list[str]]:
+		added = sorted(set(other._plans) - set(self._plans))
+		removed = sorted(set(self._plans) - set(other._plans))
+		changed = sorted(plan_name for plan_name in set(self._plans) & set(other._plans) if self._plans[plan_name] is not other._plans[plan_name])
+		return (added, removed, changed)
+
+	@staticmethod
+	def group_by_repository(plans: list[BackupPlan]) -> dict[str, list[BackupPlan]]:
+		# Repository-wide operations (forget, prune, check, ...) need to run
+		# only once for all plans that share a repository
+		groups = { }
+		for plan in plans:
+			groups.setdefault(plan.repository_key, [ ]).append(plan)
+		return groups
+
+	@property
+	def plans(self):
+		return list(self._plans.values())
+
+	@property
+	def plan_db(self):
+		return self._plan_db
+
 	@property
 	def default_plan(self):
 		if self._default_plan is None:
 			raise NoDefaultPlanException("No plan defined as default.")
 		return self._default_plan
 
+	@staticmethod
+	def default_database_filename():
+		# Used when the configuration does not come from a file; a non-root
+		# user cannot write below /etc
+		if os.geteuid() == 0:
+			return "/etc/rebade/plandb.json"
+		state_dir = os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state")
+		return os.path.join(state_dir, "rebade", "plandb.json")
+
 	@classmethod
-	def parse_json(cls, json_data: dict):
+	def parse_json(cls, json_data: dict, previous: "Configuration | None" = None):
+		# When a previous configuration is given, plans whose definition did
+		# not change are taken over as-is instead of being parsed (and
+		# validated) again.
+		global_definition = { key: value for (key, value) in json_data.items() if key != "plans" }
+		reuse_plans = (previous is not None) and (previous._global_definition == global_definition)
 		plans = { }
 		for (plan_name, plan_data) in json_data.get("plans", { }).items():
-			plan = BackupPlan.parse(plan_name, plan_data)
+			if reuse_plans and (plan_name in previous._plans) and (previous._plans[plan_name].definition == plan_data):
+				plan = previous._plans[plan_name]
+			else:
+				plan = BackupPlan.parse(plan_name, plan_data, cache_base_dir = json_data.get("cache_dir", "/var/cache/rebade"), default_schedule = json_data.get("schedule"))
 			plans[plan_name] = plan
-		return cls(plans = plans)
+		index_dir = json_data.get("index_dir", os.path.join(json_data.get("cache_dir", "/var/cache/rebade"), "index"))
+		return cls(plans = plans, database_filename = json_data.get("database_file"), include_dir = json_data.get("include_dir"), index_dir = index_dir, global_definition = global_definition)
 
 	@classmethod
-	def parse_json_file(cls, json_filename: str):
-		with open(json_filename) as f:
-			return cls.parse_json(json.load(f))
+	def parse_json_file(cls, json_filename: str, previous: "Configuration | None" = None):
+		with tracer.span("parse_config", filename = json_filename):
+			with open(json_filename) as f:
+				json_data = json.load(f)
+
+			# Plans may additionally be defined in an include directory
+			json_data["include_dir"] = json_data.get("include_dir", os.path.join(os.path.dirname(os.path.realpath(json_filename)), "conf.d"))
+
+			# The plan database is kept next to the configuration by default
+			json_data["database_file"] = json_data.get("database_file", os.path.join(os.path.dirname(os.path.realpath(json_filename)), "plandb.json"))
+			plans = json_data.setdefault("plans", { })
+			for included_filename in sorted(glob.glob(os.path.join(json_data["include_dir"], "*.json"))):
+				with open(included_filename) as f:
+					included_data = json.load(f)
+				for (plan_name, plan_data) in included_data.get("plans", { }).items():
+					if plan_name in plans:
+						raise ConfigurationException(f"Invalid plan configuration, duplicate plan {plan_name} found in {included_filename}.")
+					plans[plan_name] = plan_data
+			return cls.parse_json(json_data, previous = previous)
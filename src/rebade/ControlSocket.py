@@ -0,0 +1,104 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import socket
+import threading
+import contextlib
+import socketserver
+import logging
+from rebade.Exceptions import ControlException
+
+_log = logging.getLogger(__spec__.name)
+
+# Requests and responses are single-line JSON objects. A request always has
+# a "cmd" key, a response always has a "status" key which is either "ok" (and
+# then optionally carries "data") or "error" (and then carries "message").
+class _ControlRequestHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		for line in self.rfile:
+			try:
+				request = json.loads(line)
+				if (not isinstance(request, dict)) or ("cmd" not in request):
+					raise ControlException("Request must be a JSON object with a 'cmd' key.")
+				response = { "status": "ok", "data": self.server.request_handler(request) }
+			except (ControlException, ValueError) as e:
+				response = { "status": "error", "message": str(e) }
+			except Exception as e:
+				# Never drop the connection without a response
+				_log.exception("Failed to handle control request %s", line.decode(errors = "replace").rstrip("\n"))
+				response = { "status": "error", "message": f"Internal error: {e.__class__.__name__}: {str(e)}" }
+			self.wfile.write(json.dumps(response).encode() + b"\n")
+
+class _ThreadingUnixStreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+class ControlServer():
+	def __init__(self, socket_filename: str, request_handler: callable):
+		self._socket_filename = socket_filename
+		self._request_handler = request_handler
+		self._server = None
+		self._thread = None
+
+	def start(self):
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(os.path.dirname(self._socket_filename), mode = 0o700)
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(self._socket_filename)
+		old_umask = os.umask(0o077)
+		try:
+			self._server = _ThreadingUnixStreamServer(self._socket_filename, _ControlRequestHandler)
+		finally:
+			os.umask(old_umask)
+		self._server.request_handler = self._request_handler
+		self._thread = threading.Thread(target = self._server.serve_forever, name = "control", daemon = True)
+		self._thread.start()
+		_log.debug("Control socket listening at %s", self._socket_filename)
+
+	def stop(self):
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._server = None
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(self._socket_filename)
+
+class ControlClient():
+	def __init__(self, socket_filename: str, timeout_secs: float = 5):
+		self._socket_filename = socket_filename
+		self._timeout_secs = timeout_secs
+
+	def request(self, cmd: str, **kwargs):
+		request = { "cmd": cmd }
+		request.update(kwargs)
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+			sock.settimeout(self._timeout_secs)
+			sock.connect(self._socket_filename)
+			sock.sendall(json.dumps(request).encode() + b"\n")
+			with sock.makefile("rb") as f:
+				line = f.readline()
+		if len(line) == 0:
+			raise ControlException("Daemon closed the control connection without responding.")
+		response = json.loads(line)
+		if response["status"] != "ok":
+			raise ControlException(response.get("message", "Unknown error"))
+		return response.get("data")
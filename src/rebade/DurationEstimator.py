@@ -0,0 +1,94 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import statistics
+
+class DurationEstimator():
+	# Models the duration of a plan's backup as
+	#   duration = a + b * files_scanned + c * bytes_added
+	# fitted by least squares to the summaries of previous runs. The number
+	# of bytes that the next backup will add is extrapolated from the rate at
+	# which data changed between previous backups and the time that passed
+	# since the last one.
+	_SCALE = (1, 1e6, 1e9)
+
+	def __init__(self, plan_db: "PlanDatabase", min_samples: int = 4):
+		self._plan_db = plan_db
+		self._min_samples = min_samples
+
+	def _successful_runs(self, plan: "BackupPlan"):
+		return [ run for run in self._plan_db.get(plan.name, "runs", [ ]) if run["returncode"] in [ 0, 3 ] ]
+
+	@staticmethod
+	def _solve(matrix: list[list[float]], vector: list[float]) -> list[float] | None:
+		# Gaussian elimination with partial pivoting
+		n = len(vector)
+		rows = [ matrix[i][:] + [ vector[i] ] for i in range(n) ]
+		for col in range(n):
+			pivot = max(range(col, n), key = lambda row: abs(rows[row][col]))
+			if abs(rows[pivot][col]) < 1e-12:
+				return None
+			(rows[col], rows[pivot]) = (rows[pivot], rows[col])
+			for row in range(col + 1, n):
+				factor = rows[row][col] / rows[col][col]
+				for k in range(col, n + 1):
+					rows[row][k] -= factor * rows[col][k]
+		solution = [ 0 ] * n
+		for row in reversed(range(n)):
+			solution[row] = (rows[row][n] - sum(rows[row][k] * solution[k] for k in range(row + 1, n))) / rows[row][row]
+		return solution
+
+	def _features(self, files: float, bytes_added: float):
+		return [ value / scale for (value, scale) in zip((1, files, bytes_added), self._SCALE) ]
+
+	def fit(self, runs: list[dict]) -> list[float] | None:
+		features = [ self._features(run["summary"]["total_files_processed"], run["summary"]["data_added"]) for run in runs ]
+		durations = [ run["duration_secs"] for run in runs ]
+		# Normal equations with a little ridge regularization, the number of
+		# scanned files barely changes between runs
+		matrix = [ [ sum(x[i] * x[j] for x in features) + (1e-6 if (i == j) else 0) for j in range(3) ] for i in range(3) ]
+		vector = [ sum(x[i] * duration for (x, duration) in zip(features, durations)) for i in range(3) ]
+		coefficients = self._solve(matrix, vector)
+		if (coefficients is None) or any(coefficient < 0 for coefficient in coefficients):
+			return None
+		return coefficients
+
+	@staticmethod
+	def _expected_bytes_added(runs: list[dict], now: float | None):
+		intervals = [ current["start"] - previous["start"] for (previous, current) in zip(runs, runs[1:]) ]
+		rates = [ current["summary"]["data_added"] / interval for (current, interval) in zip(runs[1:], intervals) if interval > 0 ]
+		if len(rates) == 0:
+			return statistics.median(run["summary"]["data_added"] for run in runs)
+		interval = statistics.median(intervals) if (now is None) else (now - runs[-1]["start"])
+		return statistics.median(rates) * max(0, interval)
+
+	def estimate_secs(self, plan: "BackupPlan", now: float | None = None) -> float | None:
+		# When "now" is not given, estimates the duration of a typical run
+		runs = self._successful_runs(plan)
+		if len(runs) == 0:
+			return None
+		runs_with_summary = [ run for run in runs if "summary" in run ]
+		if len(runs_with_summary) >= self._min_samples:
+			coefficients = self.fit(runs_with_summary)
+			if coefficients is not None:
+				features = self._features(runs_with_summary[-1]["summary"]["total_files_processed"], self._expected_bytes_added(runs_with_summary, now))
+				return sum(coefficient * feature for (coefficient, feature) in zip(coefficients, features))
+		return statistics.median(run["duration_secs"] for run in runs)
@@ -28,3 +28,14 @@ class ResticBackupReturncodes(enum.IntEnum):
 	NoSuchRepository = 10
 	RepositoryLocked = 11
 	PasswordIncorrect = 12
+
+	# Not returned by restic itself, but the command that produced the data
+	# of a stream source failed
+	StreamSourceFailed = 256
+
+	# A pipeline stage other than the backup itself failed before the backup
+	# could run
+	PipelineStageFailed = 257
+
+	# The target did not respond to a probe, restic was not even started
+	TargetUnreachable = 258
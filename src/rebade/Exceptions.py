@@ -24,3 +24,6 @@ class ConfigurationException(RebadeException): pass
 class PlanNotFoundException(RebadeException): pass
 class InsecurePermissionsException(RebadeException): pass
 class NoDefaultPlanException(RebadeException): pass
+class ControlException(RebadeException): pass
+class TargetUnreachableException(RebadeException): pass
+class NoSuchSnapshotException(RebadeException): pass
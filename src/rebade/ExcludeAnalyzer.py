@@ -0,0 +1,173 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import queue
+import threading
+import dataclasses
+from rebade.TreeScanner import TreeScanner
+
+@dataclasses.dataclass
+class ExcludeCandidate():
+	path: str
+	reason: str
+	# Restic exclude pattern that covers this candidate, generic ones (like
+	# "node_modules") match the directory name anywhere
+	pattern: str | None
+	covered: bool = False
+	total_bytes: int = 0
+	total_files: int = 0
+
+@dataclasses.dataclass
+class ExcludeRule():
+	name: str
+	reason: str
+	# Only a candidate if a sibling or a file inside the directory with this
+	# name exists
+	sibling: str | None = None
+	contains: str | None = None
+
+	@property
+	def generic(self):
+		return (self.sibling is None) and (self.contains is None)
+
+class ExcludeAnalyzer():
+	# Finds directories in the backup sources that only hold caches or build
+	# output which can be regenerated, by their names, by files next to or
+	# inside them and by CACHEDIR.TAG markers. Candidates are not descended
+	# into; their sizes are determined afterwards with a TreeScanner.
+	_CACHEDIR_SIGNATURE = b"Signature: 8a477f597d28d172789f06886806bc55"
+	_RULES = [
+		ExcludeRule("node_modules", "npm packages"),
+		ExcludeRule("__pycache__", "Python bytecode"),
+		ExcludeRule(".pytest_cache", "pytest cache"),
+		ExcludeRule(".mypy_cache", "mypy cache"),
+		ExcludeRule(".ruff_cache", "ruff cache"),
+		ExcludeRule(".tox", "tox environments"),
+		ExcludeRule(".nox", "nox environments"),
+		ExcludeRule(".gradle", "Gradle cache"),
+		ExcludeRule(".venv", "Python virtualenv", contains = "pyvenv.cfg"),
+		ExcludeRule("venv", "Python virtualenv", contains = "pyvenv.cfg"),
+		ExcludeRule("target", "Cargo build output", sibling = "Cargo.toml"),
+		ExcludeRule("target", "Maven build output", sibling = "pom.xml"),
+		ExcludeRule("build", "Gradle build output", sibling = "build.gradle"),
+		ExcludeRule("build", "Gradle build output", sibling = "build.gradle.kts"),
+		ExcludeRule(".next", "Next.js build output", sibling = "package.json"),
+		ExcludeRule("cache2", "Firefox cache", contains = "entries"),
+		ExcludeRule("Cache", "Chromium cache", contains = "Cache_Data"),
+		ExcludeRule("Code Cache", "Chromium code cache", contains = "js"),
+		ExcludeRule("GPUCache", "Chromium GPU cache", contains = "index"),
+	]
+
+	def __init__(self, thread_count: int | None = None, markers: list[str] | None = None, exclude_caches: bool = False, is_excluded: callable = None):
+		self._thread_count = thread_count or min(32, 2 * (os.cpu_count() or 1))
+		# Marker files given to restic's --exclude-if-present
+		self._markers = markers or [ ]
+		self._exclude_caches = exclude_caches
+		self._is_excluded = is_excluded or (lambda path: False)
+		self._rules = { }
+		for rule in self._RULES:
+			self._rules.setdefault(rule.name, [ ]).append(rule)
+
+	@classmethod
+	def _has_cachedir_tag(cls, path: str):
+		try:
+			with open(os.path.join(path, "CACHEDIR.TAG"), "rb") as f:
+				return f.read(len(cls._CACHEDIR_SIGNATURE)) == cls._CACHEDIR_SIGNATURE
+		except OSError:
+			return False
+
+	def _classify(self, path: str, sibling_names: set[str]) -> ExcludeCandidate | None:
+		for rule in self._rules.get(os.path.basename(path), [ ]):
+			if (rule.sibling is not None) and (rule.sibling not in sibling_names):
+				continue
+			if (rule.contains is not None) and (not os.path.lexists(os.path.join(path, rule.contains))):
+				continue
+			return ExcludeCandidate(path = path, reason = rule.reason, pattern = rule.name if rule.generic else path)
+		for marker in self._markers:
+			if os.path.lexists(os.path.join(path, marker)):
+				return ExcludeCandidate(path = path, reason = f"marked by {marker}", pattern = None, covered = True)
+		if self._has_cachedir_tag(path):
+			return ExcludeCandidate(path = path, reason = "marked by CACHEDIR.TAG", pattern = None if self._exclude_caches else path, covered = self._exclude_caches)
+		return None
+
+	def _scan_directory(self, path: str) -> tuple[list[str], list[ExcludeCandidate]]:
+		(subdirs, candidates) = ([ ], [ ])
+		try:
+			with os.scandir(path) as entries:
+				entries = [ entry for entry in entries if not self._is_excluded(entry.path) ]
+		except OSError:
+			return (subdirs, candidates)
+		names = set(entry.name for entry in entries)
+		for entry in entries:
+			try:
+				if not entry.is_dir(follow_symlinks = False):
+					continue
+			except OSError:
+				continue
+			candidate = self._classify(entry.path, names)
+			if candidate is None:
+				subdirs.append(entry.path)
+			else:
+				candidates.append(candidate)
+		return (subdirs, candidates)
+
+	def analyze(self, roots: list[str]) -> list[ExcludeCandidate]:
+		candidates = [ ]
+		pending = queue.Queue()
+		lock = threading.Lock()
+
+		def worker():
+			while True:
+				path = pending.get()
+				if path is None:
+					pending.task_done()
+					return
+				(subdirs, found) = self._scan_directory(path)
+				with lock:
+					candidates.extend(found)
+				for subdir in subdirs:
+					pending.put(subdir)
+				pending.task_done()
+
+		for root in roots:
+			if os.path.isdir(root) and not os.path.islink(root):
+				pending.put(root)
+
+		threads = [ threading.Thread(target = worker, daemon = True) for _ in range(self._thread_count) ]
+		for thread in threads:
+			thread.start()
+		pending.join()
+		for thread in threads:
+			pending.put(None)
+		for thread in threads:
+			thread.join()
+
+		scan_result = TreeScanner(thread_count = self._thread_count, max_depth = 1, is_excluded = self._is_excluded).scan([ candidate.path for candidate in candidates ])
+		for candidate in candidates:
+			(candidate.total_bytes, candidate.total_files) = scan_result.total(candidate.path)
+		candidates.sort(key = lambda candidate: candidate.total_bytes, reverse = True)
+		return candidates
+
+	@staticmethod
+	def patterns(candidates: list[ExcludeCandidate]) -> list[str]:
+		patterns = set(candidate.pattern for candidate in candidates if (candidate.pattern is not None) and (not candidate.covered))
+		return sorted(patterns)
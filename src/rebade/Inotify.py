@@ -0,0 +1,73 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import ctypes
+import ctypes.util
+import struct
+import collections
+
+class Inotify():
+	IN_MODIFY = 0x00000002
+	IN_CLOSE_WRITE = 0x00000008
+	IN_MOVED_FROM = 0x00000040
+	IN_MOVED_TO = 0x00000080
+	IN_CREATE = 0x00000100
+	IN_DELETE = 0x00000200
+	_EVENT_HEADER = struct.Struct("iIII")
+	Event = collections.namedtuple("Event", [ "path", "name", "mask" ])
+
+	def __init__(self):
+		self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+		self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if self._fd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+		self._watches = { }
+
+	def fileno(self):
+		return self._fd
+
+	def add_watch(self, path: str, mask: int):
+		wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+		if wd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno), path)
+		self._watches[wd] = path
+		return wd
+
+	def read_events(self) -> list[Event]:
+		events = [ ]
+		while True:
+			try:
+				data = os.read(self._fd, 64 * 1024)
+			except BlockingIOError:
+				return events
+			offset = 0
+			while offset < len(data):
+				(wd, mask, cookie, name_length) = self._EVENT_HEADER.unpack_from(data, offset)
+				offset += self._EVENT_HEADER.size
+				name = data[offset : offset + name_length].rstrip(b"\x00").decode(errors = "replace")
+				offset += name_length
+				events.append(self.Event(path = self._watches.get(wd), name = name, mask = mask))
+
+	def close(self):
+		os.close(self._fd)
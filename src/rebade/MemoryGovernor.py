@@ -0,0 +1,124 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import logging
+import threading
+import contextlib
+import dataclasses
+from rebade.Tools import SystemTools
+
+_log = logging.getLogger(__spec__.name)
+
+@dataclasses.dataclass
+class MemoryLease():
+	reserved_bytes: int
+	gomemlimit: int | None = None
+	gogc: int | None = None
+
+	@property
+	def environment(self) -> dict:
+		environment = { }
+		if self.gomemlimit is not None:
+			environment["GOMEMLIMIT"] = f"{self.gomemlimit // 1024 // 1024}MiB"
+		if self.gogc is not None:
+			environment["GOGC"] = str(self.gogc)
+		return environment
+
+class MemoryGovernor():
+	# Every restic launch reserves the memory it is expected to need, judging
+	# from the peak RSS of previous runs. The Go runtime lets the heap grow to
+	# live * (1 + GOGC / 100) before collecting, so the live heap is estimated
+	# from a previous peak and the GOGC it ran with, and GOGC is lowered as far
+	# as necessary for the next peak to fit into what is available.
+	# GOMEMLIMIT additionally makes the runtime collect more aggressively when
+	# approaching the budget instead of running into the OOM killer. Launches
+	# that do not fit wait until others have finished; a launch that would
+	# run alone always proceeds, since waiting does not help it. The memory
+	# already used by running restic processes is part of both their
+	# reservations and the drop in available memory, so while leases are
+	# held, reservations are only subtracted from the memory that was
+	# available when the first of them was taken.
+	def __init__(self, reserve_bytes: int = 64 * 1024 * 1024, min_gogc: int = 25, default_gogc: int = 100, safety_factor: float = 1.1, poll_secs: float = 5, get_available_memory: callable = SystemTools.get_available_memory):
+		self._reserve_bytes = reserve_bytes
+		self._min_gogc = min_gogc
+		self._default_gogc = default_gogc
+		self._safety_factor = safety_factor
+		self._poll_secs = poll_secs
+		self._get_available_memory = get_available_memory
+		self._cond = threading.Condition()
+		self._reserved_bytes = 0
+		self._active_leases = 0
+		self._idle_available_bytes = None
+
+	def _budget_bytes(self) -> int | None:
+		available_bytes = self._get_available_memory()
+		if available_bytes is None:
+			return None
+		if self._active_leases == 0:
+			self._idle_available_bytes = available_bytes
+		else:
+			# Memory may also have been taken by other processes meanwhile
+			available_bytes = min(available_bytes, self._idle_available_bytes - self._reserved_bytes)
+		return max(0, available_bytes - self._reserve_bytes)
+
+	def settings(self, expected_peak_bytes: int | None, recorded_gogc: int, budget_bytes: int | None) -> tuple[MemoryLease, bool]:
+		if budget_bytes is None:
+			return (MemoryLease(reserved_bytes = 0), True)
+		gomemlimit = max(budget_bytes, self._reserve_bytes)
+		if expected_peak_bytes is None:
+			return (MemoryLease(reserved_bytes = 0, gomemlimit = gomemlimit), True)
+
+		live_bytes = expected_peak_bytes * self._safety_factor / (1 + recorded_gogc / 100)
+		peak_bytes = round(live_bytes * (1 + self._default_gogc / 100))
+		if peak_bytes <= budget_bytes:
+			return (MemoryLease(reserved_bytes = peak_bytes, gomemlimit = gomemlimit), True)
+
+		gogc = int(100 * (budget_bytes / live_bytes - 1))
+		fits = gogc >= self._min_gogc
+		gogc = max(gogc, self._min_gogc)
+		return (MemoryLease(reserved_bytes = round(live_bytes * (1 + gogc / 100)), gomemlimit = gomemlimit, gogc = gogc), fits)
+
+	def fits(self, expected_peak_bytes: int | None, recorded_gogc: int = 100) -> bool:
+		with self._cond:
+			return self.settings(expected_peak_bytes, recorded_gogc, self._budget_bytes())[1]
+
+	@contextlib.contextmanager
+	def lease(self, expected_peak_bytes: int | None, recorded_gogc: int = 100, name: str = "restic"):
+		with self._cond:
+			while True:
+				(lease, fits) = self.settings(expected_peak_bytes, recorded_gogc, self._budget_bytes())
+				if fits or (self._active_leases == 0):
+					break
+				_log.info("Waiting to launch %s, expected peak of %.0f MiB does not fit into available memory while %d other(s) are running", name, expected_peak_bytes / 1024 / 1024, self._active_leases)
+				# Available memory also changes because of other processes,
+				# so re-check periodically and not only when a lease ends
+				self._cond.wait(timeout = self._poll_secs)
+			if not fits:
+				_log.warning("Launching %s although expected peak of %.0f MiB exceeds available memory, limiting to GOGC=%d", name, expected_peak_bytes / 1024 / 1024, lease.gogc)
+			self._reserved_bytes += lease.reserved_bytes
+			self._active_leases += 1
+		try:
+			yield lease
+		finally:
+			with self._cond:
+				self._reserved_bytes -= lease.reserved_bytes
+				self._active_leases -= 1
+				self._cond.notify_all()
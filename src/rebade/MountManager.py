@@ -0,0 +1,205 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import signal
+import threading
+import contextlib
+import subprocess
+import dataclasses
+import logging
+from rebade.Tools import FileSystemTools
+from rebade.Exceptions import ControlException, TargetUnreachableException
+
+_log = logging.getLogger(__spec__.name)
+
+@dataclasses.dataclass
+class ManagedMount():
+	plan: "BackupPlan"
+	mountpoint: str
+	mounted_at: float
+	last_used: float
+	# None while restic is being started
+	process: subprocess.Popen | None = None
+	ready: bool = False
+	stop_reason: str | None = None
+
+	@property
+	def alive(self):
+		return (self.process is None) or (self.process.poll() is None)
+
+class MountManager():
+	# Mounts that the daemon creates on request and removes again once no
+	# process has used them for a while. A mount keeps the repository locked
+	# and restic's index in memory, so it also gives way to any backup of the
+	# same repository; it is mounted again on the next request. Starting and
+	# stopping restic takes a while, so it happens outside of the lock; a
+	# mount that is still being set up is in the table but not yet ready.
+	def __init__(self, mount_dir: str, start_mount: callable, idle_secs: float = 600, mount_timeout_secs: float = 30, unmount_timeout_secs: float = 10):
+		self._mount_dir = mount_dir
+		self._start_mount = start_mount
+		self._idle_secs = idle_secs
+		self._mount_timeout_secs = mount_timeout_secs
+		self._unmount_timeout_secs = unmount_timeout_secs
+		self._lock = threading.Lock()
+		self._mounts = { }
+		self._yielding = set()
+
+	def mountpoint(self, plan: "BackupPlan") -> str:
+		return os.path.join(self._mount_dir, plan.name)
+
+	def status(self, plan_name: str) -> dict | None:
+		with self._lock:
+			mount = self._mounts.get(plan_name)
+			if mount is None:
+				return None
+			now = time.monotonic()
+			return { "mountpoint": mount.mountpoint, "mounted_secs": now - mount.mounted_at, "idle_secs": now - mount.last_used, "mounting": not mount.ready }
+
+	def _is_current(self, mount: ManagedMount) -> bool:
+		with self._lock:
+			return self._mounts.get(mount.plan.name) is mount
+
+	def _abandon(self, mount: ManagedMount, reason: str):
+		with self._lock:
+			if self._mounts.get(mount.plan.name) is mount:
+				self._mounts.pop(mount.plan.name)
+				mount.stop_reason = reason
+		self._stop(mount)
+
+	def _wait_mounted(self, mount: ManagedMount):
+		tend = time.monotonic() + self._mount_timeout_secs
+		while time.monotonic() < tend:
+			if not self._is_current(mount):
+				# Removed while restic was being started, it may not have
+				# been there to be stopped
+				self._stop(mount)
+				raise ControlException(f"Mounting {mount.plan.name} was aborted: {mount.stop_reason}.")
+			if not mount.alive:
+				self._abandon(mount, "restic exited")
+				raise ControlException(f"Mounting {mount.plan.name} failed, restic exited with status {mount.process.returncode}.")
+			if (mount.process is not None) and FileSystemTools.is_mountpoint(mount.mountpoint):
+				mount.ready = True
+				return
+			time.sleep(0.25)
+		self._abandon(mount, "timed out")
+		raise ControlException(f"Mounting {mount.plan.name} did not complete within {self._mount_timeout_secs} secs.")
+
+	def mount(self, plan: "BackupPlan") -> str:
+		with self._lock:
+			if plan.repository_key in self._yielding:
+				raise ControlException(f"Repository of {plan.name} is being backed up, mount it once the backup has finished.")
+			mount = self._mounts.get(plan.name)
+			if (mount is not None) and (not mount.alive):
+				# Detach what a crashed restic left behind, quick since the
+				# process is already gone
+				self._mounts.pop(plan.name)
+				self._stop(mount)
+				mount = None
+			if mount is not None:
+				mount.last_used = time.monotonic()
+				starting = False
+			else:
+				now = time.monotonic()
+				mount = ManagedMount(plan = plan, mountpoint = self.mountpoint(plan), mounted_at = now, last_used = now)
+				self._mounts[plan.name] = mount
+				starting = True
+
+		if starting:
+			_log.info("Mounting %s at %s on request", plan.name, mount.mountpoint)
+			try:
+				process = self._start_mount(plan, mount.mountpoint)
+			except TargetUnreachableException as e:
+				self._abandon(mount, "target unreachable")
+				raise ControlException(str(e)) from e
+			except BaseException:
+				self._abandon(mount, "restic could not be started")
+				raise
+			mount.process = process
+		if not mount.ready:
+			self._wait_mounted(mount)
+		return mount.mountpoint
+
+	def _stop(self, mount: ManagedMount):
+		# restic unmounts by itself when interrupted
+		if (mount.process is not None) and mount.alive:
+			mount.process.send_signal(signal.SIGINT)
+			try:
+				mount.process.wait(timeout = self._unmount_timeout_secs)
+			except subprocess.TimeoutExpired:
+				_log.warning("restic mount of %s did not terminate, killing it", mount.plan.name)
+				mount.process.kill()
+				mount.process.wait()
+		if FileSystemTools.is_mountpoint(mount.mountpoint):
+			# Lazily detach whatever is left behind by a killed restic
+			subprocess.call([ "umount", "--lazy", mount.mountpoint ])
+
+	def _remove(self, plan_name: str, reason: str) -> ManagedMount:
+		# Called with the lock held, the caller stops the returned mount once
+		# it has released the lock
+		mount = self._mounts.pop(plan_name)
+		mount.stop_reason = reason
+		_log.info("Unmounting %s from %s: %s", plan_name, mount.mountpoint, reason)
+		return mount
+
+	def _stop_all(self, mounts: list[ManagedMount]):
+		for mount in mounts:
+			self._stop(mount)
+
+	def unmount(self, plan_name: str):
+		with self._lock:
+			removed = [ self._remove(plan_name, "requested") ] if (plan_name in self._mounts) else [ ]
+		self._stop_all(removed)
+
+	def unmount_all(self):
+		with self._lock:
+			removed = [ self._remove(plan_name, "shutting down") for plan_name in list(self._mounts) ]
+		self._stop_all(removed)
+
+	def unmount_idle(self):
+		now = time.monotonic()
+		removed = [ ]
+		with self._lock:
+			for (plan_name, mount) in list(self._mounts.items()):
+				if not mount.ready:
+					# Still being mounted, the requester takes care of it
+					continue
+				if not mount.alive:
+					_log.warning("restic mount of %s exited with status %d", plan_name, mount.process.returncode)
+					removed.append(self._remove(plan_name, "restic exited"))
+				elif FileSystemTools.path_in_use(mount.mountpoint):
+					mount.last_used = now
+				elif now - mount.last_used >= self._idle_secs:
+					removed.append(self._remove(plan_name, f"unused for {now - mount.last_used:.0f} secs"))
+		self._stop_all(removed)
+
+	@contextlib.contextmanager
+	def yield_to(self, plan: "BackupPlan"):
+		with self._lock:
+			self._yielding.add(plan.repository_key)
+			removed = [ self._remove(plan_name, f"making way for backup of {plan.name}") for (plan_name, mount) in list(self._mounts.items()) if mount.plan.repository_key == plan.repository_key ]
+		try:
+			self._stop_all(removed)
+			yield
+		finally:
+			with self._lock:
+				self._yielding.discard(plan.repository_key)
@@ -0,0 +1,153 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import time
+import enum
+import logging
+import concurrent.futures
+from rebade.Configuration import StageType, Condition
+from rebade.Enums import ResticBackupReturncodes
+from rebade.Tracing import tracer
+
+_log = logging.getLogger(__spec__.name)
+
+class StageState(enum.Enum):
+	Pending = "pending"
+	Success = "success"
+	Failed = "failed"
+	Skipped = "skipped"
+	Inactive = "inactive"
+
+class PipelineExecutor():
+	def __init__(self, backup_engine: "BackupEngine", plan: "BackupPlan"):
+		self._engine = backup_engine
+		self._plan = plan
+		self._stages = { stage.name: stage for stage in plan.pipeline }
+		self._states = { stage.name: StageState.Pending for stage in plan.pipeline }
+		self._records = { }
+		self._backup_status = None
+
+	def _run_stage(self, stage: "PipelineStage") -> bool:
+		match stage.stage_type:
+			case StageType.Command:
+				return self._engine.execute_command(stage.args["command"]) == 0
+
+			case StageType.Backup:
+				self._backup_status = self._engine.execute_backup(self._plan)
+				return self._backup_status in [ ResticBackupReturncodes.Success, ResticBackupReturncodes.IncompleteSnapshot ]
+
+			case StageType.Copy:
+				return self._engine.execute_copy(self._plan, target = stage.args["target"], keyfile = stage.args["keyfile"], cache_dir = stage.args["cache_dir"]) == 0
+
+			case StageType.Forget:
+				return self._engine.execute_forget(self._plan, scale = stage.args["scale"], prune = stage.args["prune"]) == 0
+
+			case StageType.Prune:
+				return self._engine.execute_prune(self._plan) == 0
+
+			case StageType.Check:
+				return self._engine.execute_check(self._plan, read_data_subset = stage.args.get("read_data_subset")) == 0
+
+			case StageType.Notify:
+				self._engine.execute_hook(stage.args["hook"], { })
+				return True
+
+		raise NotImplementedError(stage.stage_type)
+
+	def _timed_stage(self, stage: "PipelineStage"):
+		t0 = time.time()
+		with tracer.span("stage", plan = self._plan.name, stage = stage.name, stage_type = stage.stage_type.value) as span:
+			try:
+				success = self._run_stage(stage)
+			except Exception as e:
+				_log.error("Pipeline stage %s of %s failed: %s: %s", stage.name, self._plan.name, e.__class__.__name__, str(e))
+				success = False
+			span.set("success", success)
+		return (success, t0, time.time() - t0)
+
+	def _decide(self, stage: "PipelineStage") -> StageState | None:
+		# Returns the state a stage ends up in without running it, or None if
+		# it needs to run. Inactive stages (e.g., a failure notification when
+		# nothing failed) do not hold up their successors.
+		dependency_states = [ self._states[name] for name in stage.after ]
+		if StageState.Pending in dependency_states:
+			return StageState.Pending
+		failed = any(state in [ StageState.Failed, StageState.Skipped ] for state in dependency_states)
+		match stage.condition:
+			case Condition.Success:
+				return StageState.Skipped if failed else None
+
+			case Condition.Failure:
+				return None if failed else StageState.Inactive
+
+			case Condition.Always:
+				return None
+
+	def run(self):
+		t0 = time.time()
+		running = { }
+		with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, len(self._stages))) as executor:
+			while True:
+				# Settle all stages that can be decided without running them
+				# first, this may cascade down the graph
+				progress = True
+				while progress:
+					progress = False
+					for stage in self._stages.values():
+						if (self._states[stage.name] != StageState.Pending) or (stage.name in running.values()):
+							continue
+						decision = self._decide(stage)
+						if decision is None:
+							_log.debug("Starting pipeline stage %s of %s", stage.name, self._plan.name)
+							running[executor.submit(self._timed_stage, stage)] = stage.name
+						elif decision != StageState.Pending:
+							_log.info("Pipeline stage %s of %s is %s", stage.name, self._plan.name, decision.value)
+							self._states[stage.name] = decision
+							self._records[stage.name] = { "state": decision.value }
+							progress = True
+
+				if len(running) == 0:
+					break
+				(done, _) = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+				for future in done:
+					stage_name = running.pop(future)
+					(success, stage_t0, duration_secs) = future.result()
+					self._states[stage_name] = StageState.Success if success else StageState.Failed
+					self._records[stage_name] = { "state": self._states[stage_name].value, "start": stage_t0, "duration_secs": duration_secs }
+					_log.info("Pipeline stage %s of %s finished after %.0f secs: %s", stage_name, self._plan.name, duration_secs, self._states[stage_name].value)
+
+		if self._engine.plan_db is not None:
+			self._engine.plan_db.append(self._plan.name, "pipeline_runs", { "start": t0, "duration_secs": time.time() - t0, "stages": self._records })
+		return self.status
+
+	@property
+	def states(self):
+		return dict(self._states)
+
+	@property
+	def status(self):
+		# The outcome of the backup itself is what matters for scheduling, a
+		# failing forget or check should not cause the backup to be repeated.
+		if self._backup_status is not None:
+			return self._backup_status
+		if any(state in [ StageState.Failed, StageState.Skipped ] for state in self._states.values()):
+			return ResticBackupReturncodes.PipelineStageFailed
+		return ResticBackupReturncodes.Success
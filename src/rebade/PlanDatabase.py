@@ -0,0 +1,79 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import fcntl
+import contextlib
+from rebade.Tracing import tracer
+
+class PlanDatabase():
+	# Keeps what rebade learns about plans over time. May be written by the
+	# daemon and by timer-invoked backups concurrently, hence the lock and the
+	# atomic replacement of the file.
+	def __init__(self, filename: str):
+		self._filename = filename
+
+	@property
+	def filename(self):
+		return self._filename
+
+	@contextlib.contextmanager
+	def _locked(self):
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(os.path.dirname(os.path.realpath(self._filename)))
+		with open(f"{self._filename}.lock", "a") as lockfile:
+			fcntl.flock(lockfile, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+	def _load(self) -> dict:
+		try:
+			with open(self._filename) as f:
+				return json.load(f)
+		except (FileNotFoundError, json.decoder.JSONDecodeError):
+			return { }
+
+	def _store(self, data: dict):
+		tmpname = f"{self._filename}.tmp"
+		with tracer.span("plan_db_write"):
+			with open(tmpname, "w") as f:
+				json.dump(data, f)
+			os.rename(tmpname, self._filename)
+
+	def get(self, plan_name: str, key: str, default = None):
+		return self._load().get(plan_name, { }).get(key, default)
+
+	def set(self, plan_name: str, key: str, value):
+		with self._locked():
+			data = self._load()
+			data.setdefault(plan_name, { })[key] = value
+			self._store(data)
+
+	def append(self, plan_name: str, key: str, value, max_length: int = 32):
+		with self._locked():
+			data = self._load()
+			values = data.setdefault(plan_name, { }).setdefault(key, [ ])
+			values.append(value)
+			del values[:-max_length]
+			self._store(data)
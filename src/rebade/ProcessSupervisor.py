@@ -0,0 +1,338 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import queue
+import signal
+import selectors
+import threading
+import contextlib
+import subprocess
+import collections
+import dataclasses
+import weakref
+import logging
+
+_log = logging.getLogger(__spec__.name)
+
+@dataclasses.dataclass
+class ProcessLimits():
+	total_secs: float | None = None
+	no_progress_secs: float | None = None
+	grace_secs: float = 30
+
+class RingBuffer():
+	def __init__(self, max_bytes: int = 64 * 1024):
+		self._max_bytes = max_bytes
+		self._lines = collections.deque()
+		self._size = 0
+
+	def append(self, line: bytes):
+		self._lines.append(line)
+		self._size += len(line)
+		while (self._size > self._max_bytes) and (len(self._lines) > 1):
+			self._size -= len(self._lines.popleft())
+
+	def __bytes__(self):
+		return b"".join(self._lines)
+
+class SupervisedProcess():
+	# Handle of a process that the supervisor thread reads from and reaps.
+	# Lines read from stdout are queued so that the owner consumes them in
+	# its own thread; reading from a process is paused while too many of its
+	# lines are queued so a slow consumer cannot exhaust memory.
+	_HIGH_WATERMARK = 4096
+	_LOW_WATERMARK = 1024
+
+	def __init__(self, supervisor: "ProcessSupervisor", name: str, proc: subprocess.Popen, limits: ProcessLimits, capture_stdout: bool, capture_stderr: bool):
+		self._supervisor = supervisor
+		self._name = name
+		self._proc = proc
+		self._limits = limits
+		self._started = time.monotonic()
+		self._last_progress = self._started
+		self._first_output = None
+		self._stdout_lines = queue.Queue() if capture_stdout else None
+		self._stderr_tail = RingBuffer() if capture_stderr else None
+		self._partial = { }
+		self._paused = False
+		self._open_streams = int(capture_stdout) + int(capture_stderr)
+		self._interrupted_at = None
+		self._timeout_reason = None
+		self._rusage = None
+		self._pidfd = None
+		self._exited = threading.Event()
+
+	@property
+	def name(self):
+		return self._name
+
+	@property
+	def pid(self):
+		return self._proc.pid
+
+	@property
+	def returncode(self):
+		return self._proc.returncode
+
+	@property
+	def timeout_reason(self):
+		return self._timeout_reason
+
+	@property
+	def max_rss(self):
+		# The peak RSS reported by wait4() includes all descendants that
+		# were waited for, i.e., restic below systemd-inhibit
+		return None if (self._rusage is None) else self._rusage.ru_maxrss * 1024
+
+	@property
+	def first_output_secs(self):
+		# Includes the startup of wrappers such as systemd-inhibit
+		return None if (self._first_output is None) else self._first_output - self._started
+
+	@property
+	def stderr_tail(self) -> bytes:
+		return b"" if (self._stderr_tail is None) else bytes(self._stderr_tail)
+
+	def lines(self):
+		while True:
+			line = self._stdout_lines.get()
+			if line is None:
+				return
+			if self._paused and (self._stdout_lines.qsize() < self._LOW_WATERMARK):
+				self._supervisor._resume(self)
+			yield line
+
+	def wait(self, timeout: float | None = None) -> int | None:
+		self._exited.wait(timeout)
+		return self.returncode
+
+	def cancel(self, reason: str | None = None):
+		self._supervisor._cancel(self, reason)
+
+class ProcessSupervisor():
+	# A single thread multiplexes the output of all running processes and
+	# waits for them via pidfds. It enforces a total and a no-progress time
+	# limit per process, interrupting (SIGINT, which lets restic remove its
+	# locks) and eventually killing the whole process group. Output on
+	# stderr goes to the log line by line, the last part of it is kept to
+	# report when a process fails. It is logged as a warning by default,
+	# which keeps restic's warnings visible at the default verbosity like
+	# when stderr was inherited.
+	_instances = weakref.WeakSet()
+
+	def __init__(self, log_level: int = logging.WARNING):
+		self._instances.add(self)
+		self._log_level = log_level
+		self._lock = threading.Lock()
+		self._selector = None
+		self._thread = None
+		self._processes = set()
+		(self._wakeup_r, self._wakeup_w) = (None, None)
+
+	def _ensure_running(self):
+		if self._thread is not None:
+			return
+		self._selector = selectors.DefaultSelector()
+		(self._wakeup_r, self._wakeup_w) = os.pipe()
+		os.set_blocking(self._wakeup_r, False)
+		os.set_blocking(self._wakeup_w, False)
+		self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+		self._thread = threading.Thread(target = self._run, name = "supervisor", daemon = True)
+		self._thread.start()
+
+	def _wakeup(self):
+		try:
+			os.write(self._wakeup_w, b"\0")
+		except BlockingIOError:
+			# Already pending
+			pass
+
+	def start(self, cmdline: list[str], env: dict | None = None, stdin = None, stdout = None, stderr = None, capture_stdout: bool = False, limits: ProcessLimits | None = None, name: str | None = None) -> SupervisedProcess:
+		# stderr is captured unless explicitly redirected. The process runs in
+		# a session of its own so that it can be signalled as a group, it
+		# therefore does not receive the terminal's interrupt.
+		capture_stderr = stderr is None
+		proc = subprocess.Popen(cmdline, env = env, stdin = stdin, stdout = subprocess.PIPE if capture_stdout else stdout, stderr = subprocess.PIPE if capture_stderr else stderr, start_new_session = True)
+		process = SupervisedProcess(self, name or os.path.basename(cmdline[0]), proc, limits or ProcessLimits(), capture_stdout = capture_stdout, capture_stderr = capture_stderr)
+		with self._lock:
+			self._ensure_running()
+			self._processes.add(process)
+			for stream in [ proc.stdout, proc.stderr ]:
+				if stream is not None:
+					os.set_blocking(stream.fileno(), False)
+					self._selector.register(stream, selectors.EVENT_READ, (process, stream))
+			try:
+				process._pidfd = os.pidfd_open(proc.pid)
+				self._selector.register(process._pidfd, selectors.EVENT_READ, (process, None))
+			except (AttributeError, OSError):
+				# Kernel or Python too old, reaping falls back to polling
+				process._pidfd = None
+		self._wakeup()
+		return process
+
+	def _resume(self, process: SupervisedProcess):
+		with self._lock:
+			if process._paused:
+				process._paused = False
+				if process._proc.stdout is not None and not process._proc.stdout.closed:
+					self._selector.register(process._proc.stdout, selectors.EVENT_READ, (process, process._proc.stdout))
+		self._wakeup()
+
+	def _signal(self, process: SupervisedProcess, signum: int):
+		try:
+			os.killpg(process.pid, signum)
+		except ProcessLookupError:
+			pass
+
+	def _cancel(self, process: SupervisedProcess, reason: str | None = None):
+		with self._lock:
+			self._interrupt(process, reason or "cancelled", time.monotonic())
+		self._wakeup()
+
+	def _interrupt(self, process: SupervisedProcess, reason: str, now: float):
+		if (process._interrupted_at is not None) or process._exited.is_set():
+			return
+		_log.warning("Interrupting %s (pid %d): %s", process.name, process.pid, reason)
+		process._timeout_reason = reason
+		process._interrupted_at = now
+		self._signal(process, signal.SIGINT)
+
+	def cancel_all(self, reason: str = "cancelled"):
+		with self._lock:
+			now = time.monotonic()
+			for process in list(self._processes):
+				self._interrupt(process, reason, now)
+		if self._thread is not None:
+			self._wakeup()
+
+	@classmethod
+	def cancel_all_supervisors(cls, reason: str = "cancelled"):
+		for supervisor in list(cls._instances):
+			supervisor.cancel_all(reason)
+
+	def _handle_output(self, process: SupervisedProcess, stream):
+		try:
+			data = os.read(stream.fileno(), 65536)
+		except BlockingIOError:
+			return
+		if len(data) == 0:
+			self._selector.unregister(stream)
+			remainder = process._partial.pop(stream, b"")
+			if len(remainder) > 0:
+				self._handle_line(process, stream, remainder)
+			stream.close()
+			process._open_streams -= 1
+			self._finish_if_done(process)
+			return
+
+		process._last_progress = time.monotonic()
+		if process._first_output is None:
+			process._first_output = process._last_progress
+		lines = (process._partial.pop(stream, b"") + data).split(b"\n")
+		if len(lines[-1]) > 0:
+			process._partial[stream] = lines[-1]
+		for line in lines[:-1]:
+			self._handle_line(process, stream, line + b"\n")
+		if (stream is process._proc.stdout) and (process._stdout_lines.qsize() >= process._HIGH_WATERMARK):
+			process._paused = True
+			self._selector.unregister(stream)
+
+	def _handle_line(self, process: SupervisedProcess, stream, line: bytes):
+		if stream is process._proc.stdout:
+			process._stdout_lines.put(line)
+		else:
+			process._stderr_tail.append(line)
+			_log.log(self._log_level, "%s: %s", process.name, line.decode(errors = "replace").rstrip("\n"))
+
+	def _reap(self, process: SupervisedProcess, block: bool = False):
+		(pid, status, rusage) = os.wait4(process.pid, 0 if block else os.WNOHANG)
+		if pid == 0:
+			return False
+		process._proc.returncode = os.waitstatus_to_exitcode(status)
+		process._rusage = rusage
+		if process._pidfd is not None:
+			self._selector.unregister(process._pidfd)
+			os.close(process._pidfd)
+			process._pidfd = None
+		self._finish_if_done(process)
+		return True
+
+	def _finish_if_done(self, process: SupervisedProcess):
+		# Only done once the process has exited and all of its output has
+		# been read, a process may exit before its pipes are drained
+		if (process._proc.returncode is None) or (process._open_streams > 0):
+			return
+		self._processes.discard(process)
+		if process._stdout_lines is not None:
+			process._stdout_lines.put(None)
+		process._exited.set()
+
+	def _check_limits(self, now: float) -> float:
+		timeout = None if all(process._pidfd is not None for process in self._processes) else 0.5
+		for process in list(self._processes):
+			# After the process itself exited, the rest of its group may
+			# still hold its output open and need to be killed
+			if process._exited.is_set():
+				continue
+			if process._interrupted_at is not None:
+				deadline = process._interrupted_at + process._limits.grace_secs
+				if now >= deadline:
+					_log.error("%s (pid %d) did not terminate within %.0f secs after interrupting it, killing it", process.name, process.pid, process._limits.grace_secs)
+					self._signal(process, signal.SIGKILL)
+					process._interrupted_at = float("inf")
+					continue
+			else:
+				deadlines = [ ]
+				if process._limits.total_secs is not None:
+					deadlines.append((process._started + process._limits.total_secs, f"exceeded time limit of {process._limits.total_secs:.0f} secs"))
+				if (process._limits.no_progress_secs is not None) and (not process._paused):
+					deadlines.append((process._last_progress + process._limits.no_progress_secs, f"no output for {process._limits.no_progress_secs:.0f} secs"))
+				expired = [ reason for (deadline, reason) in deadlines if now >= deadline ]
+				if len(expired) > 0:
+					self._interrupt(process, expired[0], now)
+					deadline = now + process._limits.grace_secs
+				elif len(deadlines) > 0:
+					deadline = min(deadline for (deadline, reason) in deadlines)
+				else:
+					continue
+			if deadline != float("inf"):
+				timeout = max(0, deadline - now) if (timeout is None) else min(timeout, max(0, deadline - now))
+		return timeout
+
+	def _run(self):
+		while True:
+			with self._lock:
+				timeout = self._check_limits(time.monotonic())
+			for (key, events) in self._selector.select(timeout):
+				with self._lock:
+					if key.data is None:
+						with contextlib.suppress(BlockingIOError):
+							os.read(self._wakeup_r, 4096)
+					elif key.data[1] is None:
+						self._reap(key.data[0])
+					else:
+						self._handle_output(*key.data)
+			with self._lock:
+				for process in list(self._processes):
+					if (process._pidfd is None) and (process._proc.returncode is None):
+						self._reap(process)
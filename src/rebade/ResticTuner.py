@@ -0,0 +1,238 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import stat
+import time
+import random
+import socket
+import secrets
+import tempfile
+import itertools
+import subprocess
+import contextlib
+import logging
+import dataclasses
+from rebade.Tools import FileSystemTools
+from rebade.TreeScanner import TreeScanner
+
+_log = logging.getLogger(__spec__.name)
+
+@dataclasses.dataclass
+class TuningResult():
+	settings: dict
+	returncode: int
+	elapsed_secs: float
+	cpu_secs: float
+	maxrss_kib: int
+	sample_bytes: int
+
+	@property
+	def success(self):
+		return self.returncode == 0
+
+	@property
+	def throughput(self):
+		if self.elapsed_secs <= 0:
+			return 0
+		return self.sample_bytes / self.elapsed_secs
+
+	def to_dict(self):
+		return {
+			"settings": self.settings,
+			"elapsed_secs": self.elapsed_secs,
+			"throughput": self.throughput,
+			"cpu_secs": self.cpu_secs,
+			"maxrss_kib": self.maxrss_kib,
+			"sample_bytes": self.sample_bytes,
+		}
+
+class ResticTuner():
+	def __init__(self, restic_binary: str, plan: "BackupPlan", sample_size_bytes: int, rest_server_binary: str | None = None, repository_version: int = 2):
+		self._restic_binary = restic_binary
+		self._plan = plan
+		self._sample_size_bytes = sample_size_bytes
+		self._rest_server_binary = rest_server_binary
+		# The benchmark repository has the same version as the actual one,
+		# version 1 repositories do not support compression
+		self._repository_version = repository_version
+
+	def _is_excluded(self, path: str):
+		return FileSystemTools.matches_exclude(path, self._plan.source.exclude)
+
+	def collect_sample(self) -> tuple[list[str], int]:
+		# Taking the first files in walk order would sample only a corner of
+		# the sources, so every file is picked with the probability that
+		# spreads the sample size over the total size of the sources
+		scan_result = TreeScanner(is_excluded = self._is_excluded).scan(self._plan.source.paths)
+		total_bytes = sum(scan_result.total(source_path)[0] for source_path in self._plan.source.paths)
+		probability = min(1, self._sample_size_bytes / max(total_bytes, 1))
+		rng = random.Random(self._plan.name)
+		sample_files = [ ]
+		sample_bytes = 0
+		for source_path in self._plan.source.paths:
+			for (dirname, subdirs, filenames) in os.walk(source_path):
+				subdirs[:] = [ subdir for subdir in subdirs if not self._is_excluded(os.path.join(dirname, subdir)) ]
+				for filename in filenames:
+					full_filename = os.path.join(dirname, filename)
+					if self._is_excluded(full_filename):
+						continue
+					try:
+						statres = os.lstat(full_filename)
+					except OSError:
+						continue
+					if not stat.S_ISREG(statres.st_mode):
+						continue
+					if rng.random() >= probability:
+						continue
+					if sample_bytes + statres.st_size > self._sample_size_bytes:
+						continue
+					sample_files.append(full_filename)
+					sample_bytes += statres.st_size
+					if sample_bytes >= 0.99 * self._sample_size_bytes:
+						return (sample_files, sample_bytes)
+		return (sample_files, sample_bytes)
+
+	def candidates(self, pack_sizes: list[int], compressions: list[str], read_concurrencies: list[int], connections: list[int]):
+		if self._rest_server_binary is None:
+			# Connection count only makes a difference with a remote
+			# repository, do not waste time on it otherwise
+			connections = [ None ]
+		if self._repository_version < 2:
+			compressions = [ None ]
+		for (pack_size, compression, read_concurrency, connection_count) in itertools.product(pack_sizes, compressions, read_concurrencies, connections):
+			settings = {
+				"pack_size": pack_size,
+				"read_concurrency": read_concurrency,
+			}
+			if compression is not None:
+				settings["compression"] = compression
+			if connection_count is not None:
+				settings["connections"] = connection_count
+			yield settings
+
+	@staticmethod
+	def _warm_page_cache(sample_files: list[str]):
+		# Every candidate should read the sample from the page cache;
+		# otherwise the first candidate is penalized by cold reads.
+		for filename in sample_files:
+			with contextlib.suppress(OSError), open(filename, "rb") as f:
+				while len(f.read(1024 * 1024)) > 0:
+					pass
+
+	@staticmethod
+	def _free_tcp_port():
+		with socket.socket() as sock:
+			sock.bind(("127.0.0.1", 0))
+			return sock.getsockname()[1]
+
+	@staticmethod
+	def _wait_for_tcp_port(port: int, timeout_secs: float = 10):
+		tend = time.monotonic() + timeout_secs
+		while True:
+			try:
+				with socket.create_connection(("127.0.0.1", port), timeout = 1):
+					return
+			except OSError:
+				if time.monotonic() > tend:
+					raise
+				time.sleep(0.05)
+
+	@contextlib.contextmanager
+	def _repository(self, tmpdir: str):
+		if self._rest_server_binary is None:
+			yield os.path.join(tmpdir, "repo")
+			return
+
+		port = self._free_tcp_port()
+		rest_server = subprocess.Popen([ self._rest_server_binary, "--path", os.path.join(tmpdir, "rest"), "--listen", f"127.0.0.1:{port}", "--no-auth" ], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+		try:
+			self._wait_for_tcp_port(port)
+			yield f"rest:http://127.0.0.1:{port}/"
+		finally:
+			rest_server.terminate()
+			rest_server.wait()
+
+	@staticmethod
+	def _measure(cmdline: list[str], stderr_filename: str) -> tuple[int, float, float, int]:
+		with open(stderr_filename, "w") as stderr:
+			t0 = time.monotonic()
+			proc = subprocess.Popen(cmdline, stdout = subprocess.DEVNULL, stderr = stderr)
+			(pid, status, rusage) = os.wait4(proc.pid, 0)
+			elapsed_secs = time.monotonic() - t0
+		proc.returncode = os.waitstatus_to_exitcode(status)
+		return (proc.returncode, elapsed_secs, rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss)
+
+	def benchmark(self, settings: dict, filelist_filename: str, sample_bytes: int) -> TuningResult:
+		with tempfile.TemporaryDirectory(prefix = "rebade_tune_") as tmpdir, self._repository(tmpdir) as repository:
+			keyfile = os.path.join(tmpdir, "key")
+			with open(keyfile, "w", opener = lambda path, flags: os.open(path, flags, 0o600)) as f:
+				f.write(secrets.token_hex(32))
+
+			base_cmdline = [ self._restic_binary, "-r", repository, "-p", keyfile, "--cache-dir", os.path.join(tmpdir, "cache") ]
+			init = subprocess.run(base_cmdline + [ "init", "--repository-version", str(self._repository_version) ], stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+			if init.returncode != 0:
+				_log.warning("Initializing benchmark repository for %s failed with returncode %d: %s", str(settings), init.returncode, init.stderr.decode(errors = "replace").strip())
+				return TuningResult(settings = settings, returncode = init.returncode, elapsed_secs = 0, cpu_secs = 0, maxrss_kib = 0, sample_bytes = sample_bytes)
+
+			cmdline = base_cmdline + [ "backup", "--files-from-verbatim", filelist_filename ]
+			cmdline += [ "--pack-size", str(settings["pack_size"]), "--read-concurrency", str(settings["read_concurrency"]) ]
+			if "compression" in settings:
+				cmdline += [ "--compression", settings["compression"] ]
+			if "connections" in settings:
+				cmdline += [ "-o", f"rest.connections={settings['connections']}" ]
+			stderr_filename = os.path.join(tmpdir, "stderr.txt")
+			(returncode, elapsed_secs, cpu_secs, maxrss_kib) = self._measure(cmdline, stderr_filename)
+			if returncode != 0:
+				with open(stderr_filename) as f:
+					_log.warning("Benchmark with %s failed with returncode %d: %s", str(settings), returncode, f.read().strip())
+			return TuningResult(settings = settings, returncode = returncode, elapsed_secs = elapsed_secs, cpu_secs = cpu_secs, maxrss_kib = maxrss_kib, sample_bytes = sample_bytes)
+
+	def run(self, candidates: list[dict]):
+		(sample_files, sample_bytes) = self.collect_sample()
+		if len(sample_files) == 0:
+			return
+		_log.info("Benchmarking %d candidates against a sample of %d files with %.1f MiB", len(candidates), len(sample_files), sample_bytes / 1024 / 1024)
+		self._warm_page_cache(sample_files)
+		with tempfile.NamedTemporaryFile("w", prefix = "rebade_tune_", suffix = ".txt") as filelist:
+			for filename in sample_files:
+				print(filename, file = filelist)
+			filelist.flush()
+			for settings in candidates:
+				yield self.benchmark(settings, filelist.name, sample_bytes)
+
+	@staticmethod
+	def select_best(results: list[TuningResult], optimize: str = "throughput") -> TuningResult | None:
+		results = [ result for result in results if result.success ]
+		if len(results) == 0:
+			return None
+		match optimize:
+			case "throughput":
+				return max(results, key = lambda result: result.throughput)
+
+			case "cpu":
+				return min(results, key = lambda result: (result.cpu_secs, -result.throughput))
+
+			case "memory":
+				return min(results, key = lambda result: (result.maxrss_kib, -result.throughput))
+
+			case _:
+				raise NotImplementedError(optimize)
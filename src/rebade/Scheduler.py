@@ -0,0 +1,115 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import logging
+
+_log = logging.getLogger(__spec__.name)
+
+class Scheduler():
+	# Decides which plans are due. When the user is inactive, the soft period
+	# applies, otherwise only the hard period. The user is considered
+	# inactive either after a fixed inactivity time or, when an activity
+	# profile predicts an idle window long enough to complete the backup,
+	# right at the beginning of that window. Of the plans that are only
+	# soft-due, just those that fit into the predicted idle window are
+	# started. Soft-due plans that are not expected to fit into the currently
+	# available memory are deferred. Due plans are run shortest first.
+	def __init__(self, inactivity_threshold_secs: int = 300, profile: "ActivityProfile | None" = None, duration_estimator: callable = None, memory_check: callable = None):
+		self._inactivity_threshold_secs = inactivity_threshold_secs
+		self._profile = profile
+		self._duration_estimator = duration_estimator
+		self._memory_check = memory_check
+
+	@staticmethod
+	def failure_holdoff_secs(consecutive_unreachable: int = 0):
+		# When the target was unreachable nothing was started, so try again
+		# soon but back off while it stays unreachable
+		if consecutive_unreachable > 0:
+			return min(60 * (2 ** (consecutive_unreachable - 1)), 1800)
+		return 1800
+
+	def expected_duration_secs(self, plan: "BackupPlan", now: float):
+		if self._duration_estimator is None:
+			return None
+		return self._duration_estimator(plan, now)
+
+	def predict_idle_secs(self, now: float):
+		if self._profile is None:
+			return None
+		return self._profile.predict_idle_secs(now)
+
+	def user_inactive(self, inactivity_secs: int):
+		return inactivity_secs > self._inactivity_threshold_secs
+
+	def soft_threshold_applies(self, plan: "BackupPlan", now: float, inactivity_secs: int, expected_duration_secs: float | None = None):
+		if self.user_inactive(inactivity_secs):
+			return True
+		if (inactivity_secs > 0) and (expected_duration_secs is not None):
+			predicted_idle_secs = self.predict_idle_secs(now)
+			if (predicted_idle_secs is not None) and (predicted_idle_secs >= expected_duration_secs):
+				_log.debug(f"Predicted idle window of {predicted_idle_secs} secs suffices for {expected_duration_secs:.0f} secs backup of {plan.name}")
+				return True
+		return False
+
+	def threshold_secs(self, plan: "BackupPlan", now: float, inactivity_secs: int, expected_duration_secs: float | None = None):
+		if self.soft_threshold_applies(plan, now, inactivity_secs, expected_duration_secs):
+			return plan.soft_period_secs
+		else:
+			return plan.hard_period_secs
+
+	def due_plans(self, plans: list["BackupPlan"], now: float, inactivity_secs: int, activity_secs: dict, holdoffs: dict, triggered: set = frozenset(), paused: set = frozenset()):
+		expected_durations = { plan.name: self.expected_duration_secs(plan, now) for plan in plans }
+		forced = [ ]
+		soft_due = [ ]
+		for plan in plans:
+			if plan.name in triggered:
+				forced.append(plan)
+				continue
+			if plan.name in paused:
+				continue
+			threshold = self.threshold_secs(plan, now, inactivity_secs, expected_durations[plan.name])
+			_log.debug(f"Plan {plan.name} has {activity_secs[plan.name]} secs of activity, holdoff at {holdoffs[plan.name]}, threshold at {threshold} secs, expected duration {expected_durations[plan.name]} secs")
+			if (activity_secs[plan.name] > threshold) and (now > holdoffs[plan.name]):
+				if activity_secs[plan.name] > plan.hard_period_secs:
+					forced.append(plan)
+				else:
+					soft_due.append(plan)
+
+		def shortest_first(plan):
+			expected_duration_secs = expected_durations[plan.name]
+			return (expected_duration_secs is None, expected_duration_secs or 0)
+
+		soft_due.sort(key = shortest_first)
+		remaining_idle_secs = self.predict_idle_secs(now)
+		due = list(forced)
+		for plan in soft_due:
+			if (self._memory_check is not None) and (not self._memory_check(plan)):
+				_log.info(f"Deferring {plan.name}, its expected memory usage exceeds the currently available memory")
+				continue
+			expected_duration_secs = expected_durations[plan.name]
+			if (remaining_idle_secs is not None) and (expected_duration_secs is not None):
+				if expected_duration_secs > remaining_idle_secs:
+					_log.debug(f"Not starting {plan.name}, expected duration of {expected_duration_secs:.0f} secs exceeds remaining idle window of {remaining_idle_secs} secs")
+					continue
+				remaining_idle_secs -= expected_duration_secs
+			due.append(plan)
+		due.sort(key = shortest_first)
+		return due
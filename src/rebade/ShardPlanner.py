@@ -0,0 +1,108 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import heapq
+
+class ShardPlanner():
+	# Partitions the source paths of a plan into shards of similar cost. Large
+	# directories are split into their subdirectories, which become units of
+	# their own, and the directory's remaining entries (a "residual" unit).
+	# Units are then distributed over the shards by longest processing time
+	# first. Since restic only finds a parent snapshot when the paths are
+	# identical, a partition should be kept as long as it remains balanced.
+	def __init__(self, scan_result: "TreeScanResult", shard_count: int, file_weight_bytes: int = 65536, max_units_per_shard: int = 16):
+		self._scan_result = scan_result
+		self._shard_count = shard_count
+		self._file_weight_bytes = file_weight_bytes
+		self._max_units_per_shard = max_units_per_shard
+
+	def _weight(self, bytes_files: tuple[int, int]):
+		(size_bytes, file_count) = bytes_files
+		return size_bytes + (file_count * self._file_weight_bytes)
+
+	def unit_weight(self, unit: dict):
+		if unit["residual"]:
+			return self._weight(self._scan_result.own(unit["path"]))
+		else:
+			return self._weight(self._scan_result.total(unit["path"]))
+
+	def shard_weight(self, shard: list[dict]):
+		return sum(self.unit_weight(unit) for unit in shard)
+
+	def imbalance(self, shards: list[list[dict]]):
+		weights = [ self.shard_weight(shard) for shard in shards ]
+		mean_weight = sum(weights) / len(weights)
+		if mean_weight == 0:
+			return 1
+		return max(weights) / mean_weight
+
+	def _split_units(self, roots: list[str]):
+		target_weight = sum(self._weight(self._scan_result.total(root)) for root in roots) / self._shard_count
+		# Max-heap of whole (i.e., non-residual) units by weight
+		whole_units = [ (-self._weight(self._scan_result.total(root)), root) for root in roots ]
+		heapq.heapify(whole_units)
+		unsplittable = [ ]
+		residual_units = [ ]
+		while (len(whole_units) > 0) and (len(whole_units) + len(unsplittable) + len(residual_units) < self._shard_count * self._max_units_per_shard):
+			(negative_weight, path) = heapq.heappop(whole_units)
+			if -negative_weight <= target_weight / 2:
+				heapq.heappush(whole_units, (negative_weight, path))
+				break
+			children = self._scan_result.children(path)
+			if len(children) == 0:
+				unsplittable.append(path)
+				continue
+			residual_units.append(path)
+			for child in children:
+				heapq.heappush(whole_units, (-self._weight(self._scan_result.total(child)), child))
+		units = [ { "path": path, "residual": False } for (negative_weight, path) in whole_units ]
+		units += [ { "path": path, "residual": False } for path in unsplittable ]
+		units += [ { "path": path, "residual": True } for path in residual_units ]
+		return units
+
+	def partition(self, roots: list[str]) -> list[list[dict]]:
+		units = sorted(self._split_units(roots), key = self.unit_weight, reverse = True)
+		shards = [ [ ] for _ in range(self._shard_count) ]
+		loads = [ (0, i) for i in range(self._shard_count) ]
+		for unit in units:
+			(load, i) = heapq.heappop(loads)
+			shards[i].append(unit)
+			heapq.heappush(loads, (load + self.unit_weight(unit), i))
+		return [ shard for shard in shards if len(shard) > 0 ]
+
+	@staticmethod
+	def expand(shard: list[dict], all_units: list[dict]) -> list[str]:
+		# Residual units are expanded at backup time, so that entries
+		# created after partitioning are still backed up
+		unit_paths = set(unit["path"] for unit in all_units)
+		paths = [ ]
+		for unit in shard:
+			if not unit["residual"]:
+				if os.path.lexists(unit["path"]):
+					paths.append(unit["path"])
+			else:
+				try:
+					with os.scandir(unit["path"]) as entries:
+						paths += sorted(entry.path for entry in entries if entry.path not in unit_paths)
+				except OSError:
+					pass
+		return paths
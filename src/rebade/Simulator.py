@@ -0,0 +1,120 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import random
+import dataclasses
+from rebade.Scheduler import Scheduler
+from rebade.ActivityProfile import ActivityProfile
+
+@dataclasses.dataclass
+class SimulatedPlan():
+	name: str
+	soft_period_secs: int
+	hard_period_secs: int
+	duration_secs: float
+
+class Simulator():
+	# Replays a recorded activity trace on a virtual clock through the same
+	# Scheduler (and activity profile) the daemon uses. Like in the daemon,
+	# a backup blocks the loop for its duration, activity during a backup is
+	# not counted and a failed backup incurs a holdoff. Periods in which the
+	# machine was off are skipped.
+	def __init__(self, plans: list[SimulatedPlan], segments: list["TraceSegment"], timestep_secs: int = 30, inactivity_threshold_secs: int = 300, forecast: bool = True, failure_rate: float = 0, seed: int = 0):
+		self._plans = plans
+		self._segments = segments
+		self._timestep_secs = timestep_secs
+		self._profile = ActivityProfile({ }) if forecast else None
+		self._scheduler = Scheduler(inactivity_threshold_secs = inactivity_threshold_secs, profile = self._profile, duration_estimator = lambda plan, now: plan.duration_secs)
+		self._failure_rate = failure_rate
+		self._random = random.Random(seed)
+
+	def _active_secs(self, index: int, start: float, end: float) -> float:
+		active_secs = 0
+		while (index < len(self._segments)) and (self._segments[index].start < end):
+			segment = self._segments[index]
+			if segment.active:
+				active_secs += max(0, min(end, segment.end) - max(start, segment.start))
+			index += 1
+		return active_secs
+
+	def run(self) -> dict:
+		if len(self._segments) == 0:
+			return { "days": 0, "activity_secs": 0, "plans": { } }
+		activity_secs = { plan.name: 0 for plan in self._plans }
+		holdoffs = { plan.name: 0 for plan in self._plans }
+		stats = { plan.name: { "backups": 0, "forced": 0, "failed": 0, "while_active": 0, "active_secs_during_backup": 0, "max_pending_secs": 0, "backup_secs": 0, "covered_ticks": 0 } for plan in self._plans }
+		total_activity_secs = 0
+		inactivity_secs = 0
+		ticks = 0
+
+		index = 0
+		now = self._segments[0].start
+		while True:
+			while (index < len(self._segments)) and (self._segments[index].end <= now):
+				index += 1
+			if index == len(self._segments):
+				break
+			# Machine was off until the next segment starts
+			now = max(now, self._segments[index].start)
+
+			had_activity = self._active_secs(index, now, now + self._timestep_secs) > 0
+			now += self._timestep_secs
+			if self._profile is not None:
+				self._profile.record(now, self._timestep_secs if had_activity else 0, self._timestep_secs)
+			if had_activity:
+				total_activity_secs += self._timestep_secs
+				for plan in self._plans:
+					activity_secs[plan.name] += self._timestep_secs
+					stats[plan.name]["max_pending_secs"] = max(stats[plan.name]["max_pending_secs"], activity_secs[plan.name])
+				inactivity_secs = 0
+			else:
+				inactivity_secs += self._timestep_secs
+			ticks += 1
+			for plan in self._plans:
+				if activity_secs[plan.name] <= plan.soft_period_secs:
+					stats[plan.name]["covered_ticks"] += 1
+
+			for plan in self._scheduler.due_plans(self._plans, now, inactivity_secs, activity_secs, holdoffs):
+				plan_stats = stats[plan.name]
+				plan_stats["backups"] += 1
+				plan_stats["backup_secs"] += plan.duration_secs
+				if activity_secs[plan.name] > plan.hard_period_secs:
+					plan_stats["forced"] += 1
+				active_secs = self._active_secs(index, now, now + plan.duration_secs)
+				if had_activity or (active_secs > 0):
+					plan_stats["while_active"] += 1
+				plan_stats["active_secs_during_backup"] += active_secs
+				now += plan.duration_secs
+				if self._random.random() < self._failure_rate:
+					plan_stats["failed"] += 1
+					holdoffs[plan.name] = now + Scheduler.failure_holdoff_secs()
+				else:
+					activity_secs[plan.name] = 0
+
+		days = (self._segments[-1].end - self._segments[0].start) / 86400
+		for plan in self._plans:
+			plan_stats = stats[plan.name]
+			plan_stats["backups_per_day"] = plan_stats["backups"] / days if (days > 0) else 0
+			plan_stats["pending_secs"] = activity_secs[plan.name]
+			# Share of the time in which no more than the soft period's worth
+			# of activity was without backup
+			plan_stats["coverage"] = plan_stats.pop("covered_ticks") / ticks if (ticks > 0) else 1
+		return { "days": days, "activity_secs": total_activity_secs, "plans": stats }
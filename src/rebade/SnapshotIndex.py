@@ -0,0 +1,137 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import sqlite3
+import contextlib
+
+class SnapshotIndex():
+	# Paths are stored once and full-text indexed with a trigram tokenizer,
+	# which allows for substring searches. Every snapshot then only adds a
+	# row per file that references the path.
+	_SCHEMA = [
+		"CREATE TABLE IF NOT EXISTS snapshots (id TEXT PRIMARY KEY, short_id TEXT NOT NULL, time TEXT NOT NULL, hostname TEXT, plan TEXT, tags TEXT NOT NULL, indexed_at REAL NOT NULL)",
+		"CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE)",
+		"CREATE TABLE IF NOT EXISTS entries (snapshot_id TEXT NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE, path_id INTEGER NOT NULL REFERENCES paths(id), type TEXT NOT NULL, size INTEGER, mtime TEXT, PRIMARY KEY (snapshot_id, path_id)) WITHOUT ROWID",
+		"CREATE INDEX IF NOT EXISTS entries_path ON entries (path_id)",
+		"CREATE VIRTUAL TABLE IF NOT EXISTS paths_fts USING fts5(path, content = 'paths', content_rowid = 'id', tokenize = 'trigram')",
+		"CREATE TRIGGER IF NOT EXISTS paths_insert AFTER INSERT ON paths BEGIN INSERT INTO paths_fts (rowid, path) VALUES (new.id, new.path); END",
+		"CREATE TRIGGER IF NOT EXISTS paths_delete AFTER DELETE ON paths BEGIN INSERT INTO paths_fts (paths_fts, rowid, path) VALUES ('delete', old.id, old.path); END",
+	]
+
+	def __init__(self, filename: str):
+		with contextlib.suppress(FileExistsError):
+			# File names can be sensitive
+			os.makedirs(os.path.dirname(os.path.realpath(filename)), mode = 0o700)
+		self._db = sqlite3.connect(filename)
+		self._db.execute("PRAGMA foreign_keys = ON")
+		self._db.execute("PRAGMA journal_mode = WAL")
+		with self._db:
+			for statement in self._SCHEMA:
+				self._db.execute(statement)
+
+	def close(self):
+		self._db.close()
+
+	@property
+	def indexed_snapshot_ids(self) -> set[str]:
+		return set(row[0] for row in self._db.execute("SELECT id FROM snapshots"))
+
+	def remove_snapshots(self, snapshot_ids: list[str]):
+		with self._db:
+			self._db.executemany("DELETE FROM snapshots WHERE id = ?", [ (snapshot_id, ) for snapshot_id in snapshot_ids ])
+			self._db.execute("DELETE FROM paths WHERE NOT EXISTS (SELECT 1 FROM entries WHERE entries.path_id = paths.id)")
+
+	def _path_ids(self, paths: list[str]) -> list[int]:
+		self._db.executemany("INSERT OR IGNORE INTO paths (path) VALUES (?)", [ (path, ) for path in paths ])
+		path_ids = { }
+		for offset in range(0, len(paths), 500):
+			chunk = paths[offset : offset + 500]
+			path_ids.update(self._db.execute(f"SELECT path, id FROM paths WHERE path IN ({', '.join('?' * len(chunk))})", chunk).fetchall())
+		return [ path_ids[path] for path in paths ]
+
+	def add_snapshot(self, snapshot: dict, lister: callable, batch_size: int = 5000) -> bool:
+		# The lister is called with a callback that takes the lines of
+		# "restic ls --json" and returns whether listing succeeded. Only
+		# then the snapshot is committed, otherwise nothing of it is kept.
+		batch = [ ]
+		def flush():
+			path_ids = self._path_ids([ node["path"] for node in batch ])
+			self._db.executemany("INSERT OR REPLACE INTO entries (snapshot_id, path_id, type, size, mtime) VALUES (?, ?, ?, ?, ?)", [ (snapshot["id"], path_id, node.get("type", "file"), node.get("size"), node.get("mtime")) for (path_id, node) in zip(path_ids, batch) ])
+			batch.clear()
+
+		def add_line(line: bytes):
+			try:
+				node = json.loads(line)
+			except ValueError:
+				return
+			if (node.get("struct_type", "node") != "node") or ("path" not in node):
+				return
+			batch.append(node)
+			if len(batch) >= batch_size:
+				flush()
+
+		success = False
+		try:
+			plan_tags = [ tag for tag in snapshot.get("tags", [ ]) if tag.startswith("rebade-plan=") ]
+			plan_name = plan_tags[0].split("=", 1)[1] if (len(plan_tags) > 0) else None
+			self._db.execute("INSERT OR REPLACE INTO snapshots (id, short_id, time, hostname, plan, tags, indexed_at) VALUES (?, ?, ?, ?, ?, ?, strftime('%s', 'now'))", (snapshot["id"], snapshot.get("short_id", snapshot["id"][:8]), snapshot["time"], snapshot.get("hostname"), plan_name, json.dumps(snapshot.get("tags", [ ]))))
+			success = lister(add_line)
+			if success:
+				flush()
+		finally:
+			if success:
+				self._db.commit()
+			else:
+				self._db.rollback()
+		return success
+
+	def find(self, pattern: str, plan_names: list[str] | None = None, limit: int = 1000) -> list[dict]:
+		# The trigram tokenizer needs at least three characters, shorter
+		# patterns fall back to a (slower) scan of all paths
+		if len(pattern) >= 3:
+			query = "SELECT paths.id, paths.path FROM paths_fts JOIN paths ON paths.id = paths_fts.rowid WHERE paths_fts MATCH ? ORDER BY paths.path LIMIT ?"
+			args = ("\"" + pattern.replace("\"", "\"\"") + "\"", limit)
+		else:
+			query = "SELECT id, path FROM paths WHERE instr(lower(path), lower(?)) > 0 ORDER BY path LIMIT ?"
+			args = (pattern, limit)
+
+		# Snapshots from before rebade tagged them with the plan name match
+		# any plan
+		version_query = "SELECT snapshots.id, snapshots.short_id, snapshots.time, entries.type, entries.size, entries.mtime FROM entries JOIN snapshots ON snapshots.id = entries.snapshot_id WHERE entries.path_id = ?"
+		plan_args = [ ]
+		if plan_names is not None:
+			version_query += f" AND ((snapshots.plan IS NULL) OR (snapshots.plan IN ({', '.join('?' * len(plan_names))})))"
+			plan_args = list(plan_names)
+		version_query += " ORDER BY snapshots.time"
+
+		results = [ ]
+		for (path_id, path) in self._db.execute(query, args).fetchall():
+			versions = { }
+			for (snapshot_id, short_id, snapshot_time, node_type, size, mtime) in self._db.execute(version_query, [ path_id ] + plan_args):
+				# Identical size and mtime in several snapshots are considered
+				# the same version of the file
+				version = versions.setdefault((node_type, size, mtime), { "type": node_type, "size": size, "mtime": mtime, "snapshots": [ ] })
+				version["snapshots"].append({ "id": snapshot_id, "short_id": short_id, "time": snapshot_time })
+			if len(versions) > 0:
+				results.append({ "path": path, "versions": list(versions.values()) })
+		return results
@@ -0,0 +1,121 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+from rebade.Exceptions import NoSuchSnapshotException
+
+class SnapshotSelector():
+	# Resolves a snapshot given on the command line to the snapshots that
+	# need to be read. "latest" means the latest backup of the plan that
+	# contains the selected paths, which for sharded plans is the whole shard
+	# group; snapshots of stream sources only contain their dump and are only
+	# considered when that is what was asked for. Selected paths are mapped
+	# onto the snapshot(s) that actually contain them.
+	def __init__(self, plan: "BackupPlan", snapshots: list[dict]):
+		self._plan = plan
+		self._snapshots = sorted(snapshots, key = lambda snapshot: snapshot["time"])
+		self._stream_paths = set(self._normalize(stream.filename) for stream in plan.source.streams)
+
+	@staticmethod
+	def _normalize(path: str) -> str:
+		return os.path.normpath("/" + path.lstrip("/"))
+
+	@staticmethod
+	def _shard_group(snapshot: dict) -> str | None:
+		for tag in snapshot.get("tags") or [ ]:
+			if tag.startswith("rebade-shard-group="):
+				return tag.split("=", 1)[1]
+		return None
+
+	@staticmethod
+	def is_below(path: str, root: str) -> bool:
+		return (path == root) or path.startswith(root.rstrip("/") + "/")
+
+	@classmethod
+	def disjoint_roots(cls, paths: list[str]) -> list[str]:
+		roots = [ ]
+		for path in sorted(set(os.path.normpath(path) for path in paths)):
+			if not any(cls.is_below(path, root) for root in roots):
+				roots.append(path)
+		return roots
+
+	def _is_stream(self, snapshot: dict) -> bool:
+		paths = snapshot.get("paths") or [ ]
+		return (len(paths) > 0) and all((self._normalize(path) in self._stream_paths) for path in paths)
+
+	def _overlaps(self, snapshot: dict, path: str) -> bool:
+		return any((self.is_below(path, snapshot_path) or self.is_below(snapshot_path, path)) for snapshot_path in (snapshot.get("paths") or [ "/" ]))
+
+	def _candidates(self, path: str | None) -> list[dict]:
+		if (path is not None) and (self._normalize(path) in self._stream_paths):
+			return [ snapshot for snapshot in self._snapshots if self._is_stream(snapshot) ]
+		return [ snapshot for snapshot in self._snapshots if not self._is_stream(snapshot) ] or self._snapshots
+
+	def _with_group(self, snapshot: dict) -> list[dict]:
+		group_id = self._shard_group(snapshot)
+		if group_id is None:
+			return [ snapshot ]
+		return [ other for other in self._snapshots if self._shard_group(other) == group_id ]
+
+	def _latest(self, paths: list[str] | None) -> list[dict]:
+		if len(self._snapshots) == 0:
+			raise NoSuchSnapshotException(f"Plan {self._plan.name} has no snapshots.")
+		if paths is None:
+			candidates = self._candidates(None)
+			return self._with_group(candidates[-1])
+		resolved = { }
+		for path in paths:
+			for snapshot in reversed(self._candidates(path)):
+				if self._overlaps(snapshot, path):
+					resolved.update((member["id"], member) for member in self._with_group(snapshot))
+					break
+		return sorted(resolved.values(), key = lambda snapshot: snapshot["time"])
+
+	def resolve(self, snapshot_id: str, paths: list[str] | None = None) -> list[dict]:
+		if snapshot_id == "latest":
+			return self._latest(paths)
+		matches = [ snapshot for snapshot in self._snapshots if snapshot["id"].startswith(snapshot_id) ]
+		if len(matches) != 1:
+			raise NoSuchSnapshotException(f"Snapshot {snapshot_id} is {'ambiguous' if (len(matches) > 1) else 'not a snapshot of plan ' + self._plan.name}.")
+		return matches
+
+	def select(self, snapshot_id: str, paths: list[str] | None = None) -> list[tuple[dict, list[str]]]:
+		# Returns the snapshots along with the disjoint roots to read from
+		# each of them. Without paths, the complete snapshots are selected.
+		selection = [ ]
+		for snapshot in self.resolve(snapshot_id, paths):
+			snapshot_paths = snapshot.get("paths") or [ "/" ]
+			if paths is None:
+				roots = self.disjoint_roots(snapshot_paths)
+			else:
+				roots = [ ]
+				for path in paths:
+					for snapshot_path in snapshot_paths:
+						if self.is_below(path, snapshot_path):
+							roots.append(path)
+						elif self.is_below(snapshot_path, path):
+							roots.append(snapshot_path)
+				roots = self.disjoint_roots(roots)
+			if len(roots) > 0:
+				selection.append((snapshot, roots))
+		if len(selection) == 0:
+			raise NoSuchSnapshotException(f"None of the selected paths are contained in snapshot {snapshot_id} of plan {self._plan.name}.")
+		return selection
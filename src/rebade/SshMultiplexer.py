@@ -0,0 +1,104 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+import logging
+
+_log = logging.getLogger(__spec__.name)
+
+class SshMultiplexer():
+	# Keeps one SSH master connection per SFTP server so that consecutive
+	# restic invocations do not each need a full SSH handshake. restic's ssh
+	# is pointed at the master's socket through sftp.args; if there is no
+	# master (e.g., because it could not be started non-interactively), ssh
+	# simply connects on its own. ControlPersist makes a master exit by
+	# itself after being idle, even if rebade never gets to close it.
+	def __init__(self, ssh_binary: str = "ssh", persist_secs: int = 60, connect_timeout_secs: int = 15, retry_secs: int = 300):
+		self._ssh_binary = ssh_binary
+		self._persist_secs = persist_secs
+		self._connect_timeout_secs = connect_timeout_secs
+		self._lock = threading.Lock()
+		self._socket_dir = None
+		self._retry_secs = retry_secs
+		self._masters = { }
+		self._failed = { }
+
+	@staticmethod
+	def _destination(target: dict) -> list[str]:
+		destination = [ ]
+		if "port" in target:
+			destination += [ "-p", str(target["port"]) ]
+		destination.append(f"{target['username']}@{target['hostname']}" if ("username" in target) else target["hostname"])
+		return destination
+
+	def _socket_path(self, destination: list[str]):
+		if self._socket_dir is None:
+			# Unix socket paths are short, so keep them in a directory of our own
+			self._socket_dir = tempfile.mkdtemp(prefix = "rebade_ssh_")
+		return os.path.join(self._socket_dir, hashlib.sha256(" ".join(destination).encode()).hexdigest()[:16])
+
+	def _start_master(self, destination: list[str], socket_path: str) -> bool:
+		cmdline = [ self._ssh_binary, "-M", "-N", "-f", "-o", f"ControlPath={socket_path}", "-o", f"ControlPersist={self._persist_secs}", "-o", "BatchMode=yes", "-o", f"ConnectTimeout={self._connect_timeout_secs}" ] + destination
+		try:
+			result = subprocess.run(cmdline, stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, timeout = self._connect_timeout_secs + 5, check = False)
+		except (OSError, subprocess.TimeoutExpired) as e:
+			_log.debug("Unable to start SSH master for %s: %s", " ".join(destination), str(e))
+			return False
+		if result.returncode != 0:
+			_log.debug("Unable to start SSH master for %s: %s", " ".join(destination), result.stderr.decode("utf-8", errors = "replace").strip())
+			return False
+		_log.debug("Started SSH master for %s", " ".join(destination))
+		return True
+
+	def _master_alive(self, destination: list[str], socket_path: str) -> bool:
+		return subprocess.run([ self._ssh_binary, "-O", "check", "-o", f"ControlPath={socket_path}" ] + destination, stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = False).returncode == 0
+
+	def restic_options(self, target: dict) -> list[str]:
+		destination = self._destination(target)
+		with self._lock:
+			socket_path = self._socket_path(destination)
+			if (socket_path not in self._masters) or (not self._master_alive(destination, socket_path)):
+				self._masters.pop(socket_path, None)
+				# Do not hold up every restic invocation with another
+				# attempt when starting a master just failed
+				if time.monotonic() - self._failed.get(socket_path, -self._retry_secs) >= self._retry_secs:
+					if self._start_master(destination, socket_path):
+						self._masters[socket_path] = destination
+					else:
+						self._failed[socket_path] = time.monotonic()
+			if socket_path not in self._masters:
+				return [ ]
+		return [ "-o", f"sftp.args=-o ControlPath={socket_path} -o ControlMaster=no" ]
+
+	def close(self):
+		with self._lock:
+			for (socket_path, destination) in self._masters.items():
+				subprocess.run([ self._ssh_binary, "-O", "exit", "-o", f"ControlPath={socket_path}" ] + destination, stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = False)
+			self._masters = { }
+			if self._socket_dir is not None:
+				shutil.rmtree(self._socket_dir, ignore_errors = True)
+				self._socket_dir = None
@@ -21,6 +21,8 @@
 
 import json
 import time
+import threading
+from rebade.Tracing import tracer
 
 class StateFile():
 	def __init__(self, filename: str, write_every_secs: int = 300):
@@ -35,28 +37,45 @@ class StateFile():
 				"holdoff": { },
 			}
 		self._dirty = None
+		# The daemon's control socket reads and modifies state from another thread
+		self._lock = threading.RLock()
 
 	def add_activity(self, name: str, increment_secs: int):
-		if name not in self._state["activity"]:
-			self.reset_activity(name)
-		self._state["activity"][name] += increment_secs
-		self._on_change()
+		with self._lock:
+			if name not in self._state["activity"]:
+				self.reset_activity(name)
+			self._state["activity"][name] += increment_secs
+			self._on_change()
 
 	def reset_activity(self, name: str):
-		self._state["activity"][name] = 0
-		self._persist()
+		with self._lock:
+			self._state["activity"][name] = 0
+			self._persist()
 
 	def get_activity(self, name: str):
-		if name not in self._state["activity"]:
-			self.reset_activity(name)
-		return self._state["activity"][name]
+		with self._lock:
+			if name not in self._state["activity"]:
+				self.reset_activity(name)
+			return self._state["activity"][name]
 
 	def get_holdoff(self, name: str):
-		return self._state["holdoff"].get(name, 0)
+		with self._lock:
+			return self._state["holdoff"].get(name, 0)
 
 	def set_holdoff(self, name: str, timestamp: float):
-		self._state["holdoff"][name] = timestamp
-		self._persist()
+		with self._lock:
+			self._state["holdoff"][name] = timestamp
+			self._persist()
+
+	def get_section(self, name: str) -> dict:
+		# Returns a dictionary that callers may modify in-place; call
+		# mark_changed() afterwards to have it persisted eventually
+		with self._lock:
+			return self._state.setdefault(name, { })
+
+	def mark_changed(self):
+		with self._lock:
+			self._on_change()
 
 	def _on_change(self):
 		if self._dirty is None:
@@ -66,6 +85,7 @@ class StateFile():
 			self._persist()
 
 	def _persist(self):
-		with open(self._filename, "w") as f:
-			json.dump(self._state, f)
-		self._dirty = None
+		with self._lock, tracer.span("state_file_write"):
+			with open(self._filename, "w") as f:
+				json.dump(self._state, f)
+			self._dirty = None
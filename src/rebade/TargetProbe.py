@@ -0,0 +1,149 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import socket
+import ipaddress
+import threading
+import subprocess
+import dataclasses
+import logging
+from rebade.Configuration import BackupMethod
+
+_log = logging.getLogger(__spec__.name)
+
+@dataclasses.dataclass
+class ProbeResult():
+	reachable: bool
+	reason: str
+	duration_secs: float
+	timestamp: float = dataclasses.field(default_factory = time.monotonic)
+
+class TargetProbe():
+	# Checks within a fraction of a second whether a target can possibly be
+	# reached, so that restic is not started just to wait out SSH or TCP
+	# timeouts. Any response from the server counts as reachable, the probe
+	# does not attempt to authenticate. Results are cached briefly because
+	# several restic invocations for the same target usually follow each
+	# other. For SFTP targets, the host and port ssh actually connects to are
+	# taken from the SSH configuration; when ssh goes through a proxy or its
+	# configuration cannot be determined, the result is inconclusive and the
+	# target is treated as reachable.
+	def __init__(self, timeout_secs: float = 3, cache_secs: float = 30, ssh_binary: str = "ssh"):
+		self._timeout_secs = timeout_secs
+		self._ssh_binary = ssh_binary
+		self._cache_secs = cache_secs
+		self._cache = { }
+		self._lock = threading.Lock()
+
+	def _probe_tcp(self, hostname: str, port: int) -> tuple[bool, str]:
+		try:
+			with socket.create_connection((hostname, port), timeout = self._timeout_secs):
+				return (True, f"connected to {hostname}:{port}")
+		except OSError as e:
+			return (False, f"cannot connect to {hostname}:{port}: {e}")
+
+	@staticmethod
+	def _is_address(hostname: str) -> bool:
+		try:
+			ipaddress.ip_address(hostname)
+			return True
+		except ValueError:
+			return False
+
+	def _ssh_config(self, target: dict) -> dict | None:
+		cmdline = [ self._ssh_binary, "-G" ]
+		if "port" in target:
+			cmdline += [ "-p", str(target["port"]) ]
+		cmdline.append(f"{target['username']}@{target['hostname']}" if ("username" in target) else target["hostname"])
+		try:
+			result = subprocess.run(cmdline, stdin = subprocess.DEVNULL, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, timeout = self._timeout_secs, check = False)
+		except (OSError, subprocess.TimeoutExpired) as e:
+			_log.debug("Unable to determine SSH configuration of %s: %s", target["hostname"], str(e))
+			return None
+		if result.returncode != 0:
+			return None
+		config = { }
+		for line in result.stdout.decode("utf-8", errors = "replace").splitlines():
+			(key, _, value) = line.partition(" ")
+			config.setdefault(key.lower(), value)
+		return config
+
+	def _probe_sftp(self, target: dict) -> tuple[bool, str]:
+		config = self._ssh_config(target)
+		if config is None:
+			if not self._is_address(target["hostname"]):
+				return (True, f"inconclusive, unable to determine SSH configuration of {target['hostname']}")
+			return self._probe_tcp(target["hostname"], int(target.get("port", 22)))
+		for option in [ "proxyjump", "proxycommand" ]:
+			if config.get(option, "none") != "none":
+				return (True, f"inconclusive, {target['hostname']} is reached through {option} {config[option]}")
+		return self._probe_tcp(config.get("hostname", target["hostname"]), int(config.get("port", target.get("port", 22))))
+
+	def _probe_rest(self, target: dict) -> tuple[bool, str]:
+		# http.client pulls in ssl, which is expensive to import
+		import http.client
+		import ssl
+		protocol = target.get("protocol", "https")
+		port = int(target.get("port", 443 if (protocol == "https") else 80))
+		if protocol == "https":
+			context = ssl.create_default_context(cafile = target.get("ca_filename"))
+			connection = http.client.HTTPSConnection(target["hostname"], port, timeout = self._timeout_secs, context = context)
+		else:
+			connection = http.client.HTTPConnection(target["hostname"], port, timeout = self._timeout_secs)
+		path = target["remote_path"].rstrip("/") + "/config"
+		try:
+			connection.request("HEAD", path)
+			response = connection.getresponse()
+			return (True, f"HEAD {path} returned {response.status}")
+		except (OSError, http.client.HTTPException) as e:
+			return (False, f"HEAD {path} on {target['hostname']}:{port} failed: {e}")
+		finally:
+			connection.close()
+
+	def _probe(self, target: dict) -> tuple[bool, str]:
+		match BackupMethod(target["method"]):
+			case BackupMethod.SFTP:
+				return self._probe_sftp(target)
+
+			case BackupMethod.REST:
+				return self._probe_rest(target)
+
+			case BackupMethod.Local:
+				if os.path.isdir(target["remote_path"]):
+					return (True, f"{target['remote_path']} exists")
+				return (False, f"{target['remote_path']} does not exist or is not mounted")
+
+	def probe(self, target: dict, cache_key: str) -> ProbeResult:
+		if not target.get("probe", True):
+			return ProbeResult(reachable = True, reason = "probing disabled", duration_secs = 0)
+		with self._lock:
+			cached = self._cache.get(cache_key)
+			if (cached is not None) and (time.monotonic() - cached.timestamp < self._cache_secs):
+				return cached
+		t0 = time.monotonic()
+		(reachable, reason) = self._probe(target)
+		result = ProbeResult(reachable = reachable, reason = reason, duration_secs = time.monotonic() - t0)
+		_log.debug("Probe of target %s: %s (%.3f secs)", cache_key, reason, result.duration_secs)
+		with self._lock:
+			self._cache[cache_key] = result
+		return result
@@ -0,0 +1,45 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import hashlib
+
+class TimerSchedule():
+	# Spreads the timer-triggered backups of many hosts over a time window.
+	# The slot within the window is derived from a hash of host and plan name,
+	# so it is stable from night to night but differs between hosts.
+	def __init__(self, hostname: str):
+		self._hostname = hostname
+
+	@staticmethod
+	def _hash_fraction(text: str) -> float:
+		return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big") / (1 << 64)
+
+	def slot_offset_secs(self, plan: "BackupPlan", expected_duration_secs: float | None = None) -> int:
+		# Long-running plans get a proportionally narrower range of start
+		# times so that they still finish within the window
+		usable_secs = max(0, plan.schedule["window_secs"] - (expected_duration_secs or 0))
+		return int(self._hash_fraction(f"{self._hostname}/{plan.name}") * usable_secs)
+
+	def on_calendar(self, plan: "BackupPlan", expected_duration_secs: float | None = None) -> str:
+		if "on_calendar" in plan.schedule:
+			return plan.schedule["on_calendar"]
+		start_secs = (plan.schedule["window_start_secs"] + self.slot_offset_secs(plan, expected_duration_secs)) % 86400
+		return f"{plan.schedule['days']} {start_secs // 3600:02d}:{start_secs // 60 % 60:02d}:{start_secs % 60:02d}"
@@ -19,7 +19,9 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import os
 import re
+import fnmatch
 import collections
 
 class FileSystemTools():
@@ -34,3 +36,70 @@ class FileSystemTools():
 				rematch = rematch.groupdict()
 				mntpnt = cls.OCT_ESCAPE_RE.sub(lambda innermatch: chr(int(innermatch.groupdict()["value"], 8)), rematch["mntpnt"])
 				yield cls.MountedFileSystem(fstype = rematch["fstype"], mountpoint = mntpnt)
+
+	@classmethod
+	def is_mountpoint(cls, path: str) -> bool:
+		return any(mounted_fs.mountpoint == path for mounted_fs in cls.get_mounted_filesystems())
+
+	@classmethod
+	def path_in_use(cls, path: str) -> bool:
+		# Like fuser, looks for any process whose working directory, root or
+		# open files are below the path
+		prefix = path.rstrip("/") + "/"
+		for pid in os.listdir("/proc"):
+			if not pid.isdigit():
+				continue
+			try:
+				links = [ f"/proc/{pid}/cwd", f"/proc/{pid}/root" ] + [ f"/proc/{pid}/fd/{fd}" for fd in os.listdir(f"/proc/{pid}/fd") ]
+			except OSError:
+				# Process exited or belongs to someone we may not inspect
+				continue
+			for link in links:
+				try:
+					target = os.readlink(link)
+				except OSError:
+					continue
+				if (target == path) or target.startswith(prefix):
+					return True
+		return False
+
+	@classmethod
+	def get_directory_usage(cls, path: str) -> tuple[int, int]:
+		(total_bytes, total_files) = (0, 0)
+		for (dirname, subdirs, filenames) in os.walk(path):
+			for filename in filenames:
+				try:
+					total_bytes += os.lstat(os.path.join(dirname, filename)).st_size
+					total_files += 1
+				except FileNotFoundError:
+					pass
+		return (total_bytes, total_files)
+
+	@classmethod
+	def matches_exclude(cls, path: str, patterns: list[str]) -> bool:
+		# Approximation of restic's exclude semantics, sufficient to avoid
+		# scanning what restic will not back up anyway
+		for pattern in patterns:
+			if (path == pattern) or path.startswith(pattern.rstrip("/") + "/"):
+				return True
+			if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(os.path.basename(path), pattern):
+				return True
+		return False
+
+class SystemTools():
+	@classmethod
+	def get_meminfo(cls) -> dict:
+		meminfo = { }
+		with open("/proc/meminfo") as f:
+			for line in f:
+				(key, value) = line.split(":", 1)
+				value = value.split()
+				meminfo[key] = int(value[0]) * (1024 if (len(value) > 1) and (value[1] == "kB") else 1)
+		return meminfo
+
+	@classmethod
+	def get_available_memory(cls) -> int | None:
+		try:
+			return cls.get_meminfo().get("MemAvailable")
+		except (FileNotFoundError, ValueError):
+			return None
@@ -0,0 +1,154 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import threading
+
+class _NullSpan():
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		return False
+
+	def set(self, key: str, value):
+		pass
+
+class _Span():
+	def __init__(self, tracer: "Tracer", name: str, args: dict):
+		self._tracer = tracer
+		self._name = name
+		self._args = args
+		self._start_ns = None
+
+	def set(self, key: str, value):
+		self._args[key] = value
+
+	def __enter__(self):
+		stack = self._tracer._stack()
+		self._parent = stack[-1]._name if (len(stack) > 0) else None
+		self._depth = len(stack)
+		stack.append(self)
+		self._start_ns = time.perf_counter_ns()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		end_ns = time.perf_counter_ns()
+		self._tracer._stack().pop()
+		if exc_type is not None:
+			self._args["error"] = exc_type.__name__
+		self._tracer._record({
+			"name": self._name,
+			"parent": self._parent,
+			"depth": self._depth,
+			"start_secs": (self._start_ns - self._tracer._t0_ns) / 1e9,
+			"duration_secs": (end_ns - self._start_ns) / 1e9,
+			"thread": threading.current_thread().name,
+			"tid": threading.get_native_id(),
+			"args": self._args,
+		})
+		return False
+
+class Tracer():
+	# Timing spans around the phases of a run. Spans nest per thread. When
+	# tracing is disabled (the default), span() returns a shared object that
+	# does nothing, so spans can stay in place everywhere. Output is either
+	# a Chrome trace (chrome://tracing, Perfetto), written when the tracer is
+	# closed, or one JSON object per finished span, written immediately.
+	_NULL_SPAN = _NullSpan()
+
+	def __init__(self):
+		self._enabled = False
+		self._output_format = None
+		self._filename = None
+		self._f = None
+		self._lock = threading.Lock()
+		self._local = threading.local()
+		self._events = [ ]
+		self._t0_ns = time.perf_counter_ns()
+		self._t0_wallclock = time.time()
+
+	@property
+	def enabled(self):
+		return self._enabled
+
+	def enable(self, filename: str, output_format: str = "chrome"):
+		if output_format not in [ "chrome", "jsonl" ]:
+			raise ValueError(f"Unknown trace format: {output_format}")
+		self._filename = filename
+		self._output_format = output_format
+		if output_format == "jsonl":
+			self._f = open(filename, "w")
+		self._enabled = True
+
+	def _stack(self) -> list:
+		if not hasattr(self._local, "stack"):
+			self._local.stack = [ ]
+		return self._local.stack
+
+	def span(self, name: str, **args):
+		if not self._enabled:
+			return self._NULL_SPAN
+		return _Span(self, name, args)
+
+	def _record(self, event: dict):
+		with self._lock:
+			if self._output_format == "jsonl":
+				import json
+				event = dict(event)
+				event["time"] = self._t0_wallclock + event["start_secs"]
+				print(json.dumps(event, default = str), file = self._f, flush = True)
+			else:
+				self._events.append(event)
+
+	def _chrome_trace(self) -> dict:
+		pid = os.getpid()
+		trace_events = [ ]
+		threads = { }
+		for event in self._events:
+			threads[event["tid"]] = event["thread"]
+			trace_events.append({
+				"name": event["name"],
+				"ph": "X",
+				"ts": event["start_secs"] * 1e6,
+				"dur": event["duration_secs"] * 1e6,
+				"pid": pid,
+				"tid": event["tid"],
+				"args": event["args"],
+			})
+		for (tid, thread_name) in threads.items():
+			trace_events.append({ "name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": { "name": thread_name } })
+		return { "traceEvents": trace_events, "displayTimeUnit": "ms", "otherData": { "start_time": self._t0_wallclock } }
+
+	def close(self):
+		if not self._enabled:
+			return
+		self._enabled = False
+		with self._lock:
+			if self._output_format == "chrome":
+				import json
+				with open(self._filename, "w") as f:
+					json.dump(self._chrome_trace(), f, default = str)
+			else:
+				self._f.close()
+
+tracer = Tracer()
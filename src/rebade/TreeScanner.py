@@ -0,0 +1,151 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import queue
+import threading
+
+class TreeScanResult():
+	def __init__(self, directories: dict):
+		# Maps directory path to (own bytes, own files, subdirectories)
+		self._directories = directories
+		self._totals = { }
+		for path in directories:
+			self._compute_total(path)
+
+	def _compute_total(self, path: str):
+		# Post-order along the subdirectory links; depth cannot be derived
+		# from the number of slashes since "/" or roots with a trailing slash
+		# have as many as their children
+		stack = [ (path, False) ]
+		while len(stack) > 0:
+			(path, children_done) = stack.pop()
+			if path in self._totals:
+				continue
+			(own_bytes, own_files, subdirs) = self._directories.get(path, (0, 0, [ ]))
+			if not children_done:
+				stack.append((path, True))
+				stack += [ (subdir, False) for subdir in subdirs if subdir not in self._totals ]
+				continue
+			(total_bytes, total_files) = (own_bytes, own_files)
+			for subdir in subdirs:
+				(subdir_bytes, subdir_files) = self._totals.get(subdir, (0, 0))
+				total_bytes += subdir_bytes
+				total_files += subdir_files
+			self._totals[path] = (total_bytes, total_files)
+
+	def __contains__(self, path: str):
+		return path in self._directories
+
+	def own(self, path: str) -> tuple[int, int]:
+		(own_bytes, own_files, subdirs) = self._directories.get(path, (0, 0, [ ]))
+		return (own_bytes, own_files)
+
+	def total(self, path: str) -> tuple[int, int]:
+		return self._totals.get(path, (0, 0))
+
+	def children(self, path: str) -> list[str]:
+		return self._directories.get(path, (0, 0, [ ]))[2]
+
+class TreeScanner():
+	# Determines sizes and file counts of directory trees by scanning
+	# directories concurrently. Directories deeper than max_depth below a root
+	# are not tracked individually but accounted to their ancestor.
+	def __init__(self, thread_count: int | None = None, max_depth: int = 6, is_excluded: callable = None):
+		self._thread_count = thread_count or min(32, 2 * (os.cpu_count() or 1))
+		self._max_depth = max_depth
+		self._is_excluded = is_excluded or (lambda path: False)
+
+	def _scan_subtree(self, path: str) -> tuple[int, int]:
+		(total_bytes, total_files) = (0, 0)
+		stack = [ path ]
+		while len(stack) > 0:
+			try:
+				with os.scandir(stack.pop()) as entries:
+					for entry in entries:
+						if self._is_excluded(entry.path):
+							continue
+						if entry.is_dir(follow_symlinks = False):
+							stack.append(entry.path)
+						else:
+							total_bytes += entry.stat(follow_symlinks = False).st_size
+							total_files += 1
+			except OSError:
+				pass
+		return (total_bytes, total_files)
+
+	def _scan_directory(self, path: str, depth: int):
+		(own_bytes, own_files, subdirs) = (0, 0, [ ])
+		try:
+			with os.scandir(path) as entries:
+				for entry in entries:
+					if self._is_excluded(entry.path):
+						continue
+					try:
+						if not entry.is_dir(follow_symlinks = False):
+							own_bytes += entry.stat(follow_symlinks = False).st_size
+							own_files += 1
+						elif depth + 1 < self._max_depth:
+							subdirs.append(entry.path)
+						else:
+							(subtree_bytes, subtree_files) = self._scan_subtree(entry.path)
+							own_bytes += subtree_bytes
+							own_files += subtree_files
+					except OSError:
+						pass
+		except OSError:
+			pass
+		return (own_bytes, own_files, subdirs)
+
+	def scan(self, roots: list[str]) -> TreeScanResult:
+		directories = { }
+		pending = queue.Queue()
+		lock = threading.Lock()
+
+		def worker():
+			while True:
+				item = pending.get()
+				if item is None:
+					pending.task_done()
+					return
+				(path, depth) = item
+				result = self._scan_directory(path, depth)
+				with lock:
+					directories[path] = result
+				for subdir in result[2]:
+					pending.put((subdir, depth + 1))
+				pending.task_done()
+
+		for root in roots:
+			if os.path.isdir(root) and not os.path.islink(root):
+				pending.put((root, 0))
+			elif os.path.lexists(root):
+				directories[root] = (os.lstat(root).st_size, 1, [ ])
+
+		threads = [ threading.Thread(target = worker, daemon = True) for _ in range(self._thread_count) ]
+		for thread in threads:
+			thread.start()
+		pending.join()
+		for thread in threads:
+			pending.put(None)
+		for thread in threads:
+			thread.join()
+		return TreeScanResult(directories)
@@ -21,16 +21,33 @@
 
 import sys
 import rebade
+import importlib
 from rebade.MultiCommand import MultiCommand
-from rebade.actions.ActionBackup import ActionBackup
-from rebade.actions.ActionDaemon import ActionDaemon
-from rebade.actions.ActionMount import ActionMount
-from rebade.actions.ActionForget import ActionForget
-from rebade.actions.ActionGeneric import ActionGeneric
-from rebade.actions.ActionCronjob import ActionCronjob
+from rebade.Tracing import tracer
+
+def _lazy_action(class_name: str):
+	# Actions (and their possibly heavy dependencies) are only imported once
+	# the command line has been parsed and the action is actually run
+	def instantiate(multi_command, cmd, args):
+		if args.profile is not None:
+			tracer.enable(args.profile, output_format = args.profile_format)
+		with tracer.span("import", action = class_name):
+			action_class = getattr(importlib.import_module(f"rebade.actions.{class_name}"), class_name)
+		return action_class(multi_command, cmd, args)
+	return instantiate
+
+def _with_profile_options(genparser: callable):
+	def genparser_with_profile_options(parser):
+		genparser(parser)
+		parser.add_argument("--profile", metavar = "filename", help = "Record how long each phase of the run takes and write the timings to this file.")
+		parser.add_argument("--profile-format", choices = [ "chrome", "jsonl" ], default = "chrome", help = "Format of the --profile output, either a Chrome trace (for chrome://tracing or Perfetto) written at exit, or one JSON object per phase written as it completes. Can be one of %(choices)s, defaults to %(default)s.")
+	return genparser_with_profile_options
 
 def main():
 	mc = MultiCommand(description = "Restic Backup Daemon -- frontend to Restic", trailing_text = f"rebade v{rebade.VERSION}")
+	def register(commandname: str, description: str, genparser: callable, **kwargs):
+		# Every subcommand can be profiled
+		mc.register(commandname, description, _with_profile_options(genparser), **kwargs)
 
 	def genparser(parser):
 		parser.add_argument("-m", "--max-backup-attempts", type = int, default = 5, help = "When backup fails with a fatal error (i.e., no snapshot was created), rebade will retry a number of times. By default, this number is %(default)d. When set to zero, this means retry infinitely.")
@@ -38,7 +55,7 @@ def main():
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
 		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to execute. If not specified, uses the default plan.")
-	mc.register("backup", "Perform a backup plan", genparser, action = ActionBackup)
+	register("backup", "Perform a backup plan", genparser, action = _lazy_action("ActionBackup"))
 
 	def genparser(parser):
 		parser.add_argument("--systemd-unit-filename", metavar = "filename", default = "/etc/systemd/system/rebade-daemon.service", help = "Systemd unit when installing/deinstalling. Defaults to %(default)s.")
@@ -47,68 +64,197 @@ def main():
 		parser.add_argument("-s", "--state-file", metavar = "filename", default = "/etc/rebade/state.json", help = "Specifies the file in which the state is kept. Defaults to %(default)s.")
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-t", "--timestep-secs", metavar = "secs", type = int, default = 30, help = "Timestep interval in which to look for activity. Defaults to %(default)d secs.")
+		parser.add_argument("--control-socket", metavar = "filename", default = "/run/rebade/control.sock", help = "Unix domain socket on which the daemon answers control requests. Defaults to %(default)s.")
+		parser.add_argument("-i", "--inactivity-secs", metavar = "secs", type = int, default = 300, help = "After this many seconds without activity, the user is considered away and the soft period of plans applies. Defaults to %(default)d secs.")
+		parser.add_argument("--no-forecast", action = "store_true", help = "Do not predict idle windows from the learned weekly activity profile. By default, a soft-due backup is started as soon as the user becomes inactive when an idle window that is long enough to complete the backup is expected.")
+		parser.add_argument("--device-glob", metavar = "pattern", default = "/dev/input/event*", help = "Input devices that are watched for user activity. Defaults to %(default)s.")
+		parser.add_argument("--record-trace", metavar = "filename", help = "Append a compact trace of user activity to this file, for use with rebade simulate.")
+		parser.add_argument("--mount-dir", metavar = "path", default = "/run/rebade/mnt", help = "Directory below which plans are mounted on request (rebade mount --managed). Defaults to %(default)s.")
+		parser.add_argument("--mount-idle-secs", metavar = "secs", type = int, default = 600, help = "Unmount plans mounted on request after nothing used them for this long. Defaults to %(default)d secs.")
+		parser.add_argument("--prewarm-ratio", metavar = "ratio", type = float, default = 0.8, help = "When a plan has reached this fraction of its soft period and the user is idle, pre-warm the plan's restic cache. Defaults to %(default).1f.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
 		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to execute. If not specified, uses the default plan.")
-	mc.register("daemon", "Watch for activity and execute backup when a threshold is reached", genparser, action = ActionDaemon)
+	register("daemon", "Watch for activity and execute backup when a threshold is reached", genparser, action = _lazy_action("ActionDaemon"))
 
 	def genparser(parser):
 		parser.add_argument("--systemd-unit-name", metavar = "name", default = "main", help = "Systemd unit when installing/deinstalling. Defaults to %(default)s.")
 		parser.add_argument("-d", "--delete", action = "store_true", help = "Remove the cronjob.")
+		parser.add_argument("--hostname", metavar = "name", help = "Host name from which the stable time slot within the schedule window is derived. Defaults to the name of this host.")
 		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
 		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to forget. If not specified, uses the default plan.")
-	mc.register("cronjob", "Schedule a systemd timer cronjob that executes the backup plan(s)", genparser, action = ActionCronjob)
+	register("cronjob", "Schedule a systemd timer cronjob that executes the backup plan(s)", genparser, action = _lazy_action("ActionCronjob"))
 
 	def genparser(parser):
 		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-m", "--mountpoint", metavar = "path", default = "/mnt/restic", help = "Specifies the mountpoint. Defaults to %(default)s.")
+		parser.add_argument("-M", "--managed", action = "store_true", help = "Have the running daemon mount the plan instead and print the mountpoint. The daemon unmounts it again when it is idle or a backup of the repository starts.")
+		parser.add_argument("--control-socket", metavar = "filename", default = "/run/rebade/control.sock", help = "Control socket of the running daemon, for --managed. Defaults to %(default)s.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
 		parser.add_argument("plan_name", nargs = "?", help = "Backup plan to mount. If not specified, uses the default plan.")
-	mc.register("mount", "Mount a remote backup target", genparser, action = ActionMount)
+	register("mount", "Mount a remote backup target", genparser, action = _lazy_action("ActionMount"))
 
 	def genparser(parser):
 		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("--check", action = "store_true", help = "Check each repository after pruning it.")
 		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to forget. If not specified, uses the default plan.")
-	mc.register("forget", "Forget remote backup repository snapshot(s)", genparser, action = ActionForget)
+	register("forget", "Forget remote backup repository snapshot(s)", genparser, action = _lazy_action("ActionForget"))
 
 	def genparser(parser):
 		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("-j", "--parallel", metavar = "count", type = int, default = 1, help = "Run restic against this many repositories in parallel. Output is then captured and shown per repository, followed by a summary. Defaults to %(default)d.")
+		parser.add_argument("--json", action = "store_true", help = "Capture restic's JSON output of all repositories and print it as a single JSON document.")
 		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to forget. If not specified, uses the default plan.")
-	mc.register("unlock", "Remove remote backup repository lock(s)", genparser, action = ActionGeneric)
+	register("unlock", "Remove remote backup repository lock(s)", genparser, action = _lazy_action("ActionGeneric"))
 
 	def genparser(parser):
 		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("-j", "--parallel", metavar = "count", type = int, default = 1, help = "Run restic against this many repositories in parallel. Output is then captured and shown per repository, followed by a summary. Defaults to %(default)d.")
+		parser.add_argument("--json", action = "store_true", help = "Capture restic's JSON output of all repositories and print it as a single JSON document.")
 		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to forget. If not specified, uses the default plan.")
-	mc.register("check", "Check remote backup repository fidelity", genparser, action = ActionGeneric)
+	register("check", "Check remote backup repository fidelity", genparser, action = _lazy_action("ActionGeneric"))
 
 	def genparser(parser):
 		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("-g", "--group-shards", action = "store_true", help = "Show the snapshots of a sharded backup as one logical backup.")
+		parser.add_argument("-j", "--parallel", metavar = "count", type = int, default = 1, help = "Run restic against this many repositories in parallel. Output is then captured and shown per repository, followed by a summary. Defaults to %(default)d.")
+		parser.add_argument("--json", action = "store_true", help = "Capture restic's JSON output of all repositories and print it as a single JSON document.")
 		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to forget. If not specified, uses the default plan.")
-	mc.register("snapshots", "List snapshots in remote repository", genparser, action = ActionGeneric)
+	register("snapshots", "List snapshots in remote repository", genparser, action = _lazy_action("ActionGeneric"))
 
 	def genparser(parser):
 		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("-j", "--parallel", metavar = "count", type = int, default = 1, help = "Run restic against this many repositories in parallel. Output is then captured and shown per repository, followed by a summary. Defaults to %(default)d.")
+		parser.add_argument("--json", action = "store_true", help = "Capture restic's JSON output of all repositories and print it as a single JSON document.")
 		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to forget. If not specified, uses the default plan.")
-	mc.register("prune", "Remove unused files from repository", genparser, action = ActionGeneric)
+	register("prune", "Remove unused files from repository", genparser, action = _lazy_action("ActionGeneric"))
 
 	def genparser(parser):
 		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
 		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("-j", "--parallel", metavar = "count", type = int, default = 1, help = "Run restic against this many repositories in parallel. Output is then captured and shown per repository, followed by a summary. Defaults to %(default)d.")
+		parser.add_argument("--json", action = "store_true", help = "Capture restic's JSON output of all repositories and print it as a single JSON document.")
 		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to forget. If not specified, uses the default plan.")
-	mc.register("init", "Initialize a repository", genparser, action = ActionGeneric)
+	register("init", "Initialize a repository", genparser, action = _lazy_action("ActionGeneric"))
+
+	def genparser(parser):
+		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
+		parser.add_argument("--rest-server-binary", metavar = "filename", help = "When given, benchmark against a local instance of this rest-server binary instead of a local repository. This also measures the number of connections, which is reported but not stored since a local server says nothing about the actual remote.")
+		parser.add_argument("-s", "--sample-size", metavar = "MiB", type = int, default = 256, help = "Amount of data to sample from the plan's sources. Defaults to %(default)d MiB.")
+		parser.add_argument("--pack-sizes", metavar = "list", default = "16,64", help = "Comma-separated pack sizes in MiB to try. Defaults to %(default)s.")
+		parser.add_argument("--compressions", metavar = "list", default = "auto,off,max", help = "Comma-separated compression modes to try. Defaults to %(default)s.")
+		parser.add_argument("--read-concurrencies", metavar = "list", default = "2,4", help = "Comma-separated file read concurrencies to try. Defaults to %(default)s.")
+		parser.add_argument("--connections", metavar = "list", default = "5,10", help = "Comma-separated backend connection counts to try (only with --rest-server-binary). Defaults to %(default)s.")
+		parser.add_argument("-o", "--optimize", choices = [ "throughput", "cpu", "memory" ], default = "throughput", help = "Criterion by which the best settings are chosen. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("-n", "--no-store", action = "store_true", help = "Only show the benchmark results, do not store the best settings for the plan.")
+		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("plan_name", nargs = "?", help = "Backup plan to tune. If not specified, uses the default plan.")
+	register("tune", "Benchmark restic performance settings for a plan and store the best ones", genparser, action = _lazy_action("ActionTune"))
+
+	def genparser(parser):
+		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
+		parser.add_argument("-j", "--threads", metavar = "count", type = int, help = "Number of threads scanning the sources concurrently. Defaults to twice the number of CPUs, at most 32.")
+		parser.add_argument("-m", "--min-size", metavar = "MiB", type = float, default = 0, help = "Only report candidates of at least this size. Defaults to %(default).0f MiB.")
+		parser.add_argument("-a", "--apply", action = "store_true", help = "Store the generated exclude patterns for the plan, replacing previously stored ones. Subsequent backups exclude them in addition to the configured excludes.")
+		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("plan_name", nargs = "?", help = "Backup plan to analyze. If not specified, uses the default plan.")
+	register("analyze-excludes", "Find cache and build directories in the sources of a plan that could be excluded", genparser, action = _lazy_action("ActionAnalyzeExcludes"))
+
+	def genparser(parser):
+		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
+		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
+		parser.add_argument("-p", "--prewarm", action = "store_true", help = "Pre-warm the cache by loading the metadata of the latest snapshot.")
+		parser.add_argument("--cleanup", action = "store_true", help = "Remove old cache directories.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) whose cache to show. If not specified, uses the default plan.")
+	register("cache", "Show, pre-warm or clean up the restic cache of plan(s)", genparser, action = _lazy_action("ActionCache"))
+
+	def genparser(parser):
+		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
+		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
+		parser.add_argument("-o", "--offline", action = "store_true", help = "Only search the local index, do not index new snapshots first.")
+		parser.add_argument("-l", "--limit", metavar = "count", type = int, default = 1000, help = "Show at most this many matching paths. Defaults to %(default)d.")
+		parser.add_argument("--json", action = "store_true", help = "Print results as JSON.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("pattern", help = "Part of the path to search for (case-insensitive).")
+		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) whose snapshots to search. If not specified, uses the default plan.")
+	register("find", "Find files in the snapshots of plan(s) using a local index", genparser, action = _lazy_action("ActionFind"))
+
+	def genparser(parser):
+		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
+		parser.add_argument("-t", "--timestep-secs", metavar = "secs", type = int, default = 30, help = "Timestep interval of the simulated daemon. Defaults to %(default)d secs.")
+		parser.add_argument("-i", "--inactivity-secs", metavar = "secs", type = int, default = 300, help = "Inactivity after which the soft period of plans applies. Defaults to %(default)d secs.")
+		parser.add_argument("--no-forecast", action = "store_true", help = "Simulate a daemon that does not predict idle windows.")
+		parser.add_argument("--soft-period-secs", metavar = "secs", type = int, help = "Use this soft period for all plans instead of the configured ones.")
+		parser.add_argument("--hard-period-secs", metavar = "secs", type = int, help = "Use this hard period for all plans instead of the configured ones.")
+		parser.add_argument("--backup-secs", metavar = "secs", type = int, default = 600, help = "Duration of a backup for plans without previous runs in the plan database. Defaults to %(default)d secs.")
+		parser.add_argument("--failure-rate", metavar = "ratio", type = float, default = 0, help = "Fraction of backups that fail and incur a holdoff. Defaults to %(default).1f.")
+		parser.add_argument("--json", action = "store_true", help = "Print results as JSON.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("trace_file", help = "Activity trace recorded by the daemon with --record-trace.")
+		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) to simulate. If not specified, uses the default plan.")
+	register("simulate", "Replay a recorded activity trace to evaluate scheduling settings", genparser, action = _lazy_action("ActionSimulate"))
+
+	def genparser(parser):
+		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
+		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
+		parser.add_argument("-s", "--snapshot", metavar = "id", default = "latest", help = "Snapshot to restore from. Defaults to %(default)s, which includes all shards of the latest sharded backup.")
+		parser.add_argument("-i", "--include", metavar = "path", action = "append", help = "Only restore this path from the snapshot. Can be given multiple times. By default, everything is restored.")
+		parser.add_argument("-t", "--target", metavar = "path", required = True, help = "Directory to restore to. Files are restored with their full path below it.")
+		parser.add_argument("-j", "--parallel", metavar = "count", type = int, default = 1, help = "Restore disjoint subtrees of the selection with this many restic processes concurrently. Defaults to %(default)d.")
+		parser.add_argument("--sparse", action = "store_true", help = "Restore files as sparse files, not writing runs of zeros to disk.")
+		parser.add_argument("--verify", action = "store_true", help = "Read back and verify the restored files.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("plan_name", nargs = "?", help = "Backup plan to restore from. If not specified, uses the default plan.")
+	register("restore", "Restore files from a snapshot without mounting it", genparser, action = _lazy_action("ActionRestore"))
+
+	def genparser(parser):
+		parser.add_argument("--restic-binary", metavar = "filename", default = "restic", help = "Specifies the restic binary. Defaults to %(default)s.")
+		parser.add_argument("-c", "--config-file", metavar = "filename", default = "/etc/rebade/config.json", help = "Specifies the global configuration file. Defaults to %(default)s.")
+		parser.add_argument("-s", "--snapshot", metavar = "id", default = "latest", help = "Snapshot to dump from. Defaults to %(default)s.")
+		parser.add_argument("-a", "--archive", choices = [ "tar", "zip" ], default = "tar", help = "Archive format to write. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("-f", "--force", action = "store_true", help = "Write the archive even if stdout is a terminal.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("path", help = "File or directory in the snapshot to dump.")
+		parser.add_argument("plan_name", nargs = "?", help = "Backup plan to dump from. If not specified, uses the default plan.")
+	register("dump", "Write a directory from a snapshot as an archive to stdout", genparser, action = _lazy_action("ActionDump"))
+
+	def genparser(parser):
+		parser.add_argument("--control-socket", metavar = "filename", default = "/run/rebade/control.sock", help = "Control socket of the running daemon. Defaults to %(default)s.")
+		parser.add_argument("-j", "--json", action = "store_true", help = "Print the status as JSON.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+	register("status", "Query the live status of the running daemon", genparser, action = _lazy_action("ActionControl"))
+
+	def genparser(parser):
+		parser.add_argument("--control-socket", metavar = "filename", default = "/run/rebade/control.sock", help = "Control socket of the running daemon. Defaults to %(default)s.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Can be given multiple times.")
+		parser.add_argument("command", choices = [ "trigger", "pause", "resume", "clear-holdoff", "unmount" ], help = "Control command to send to the daemon. Can be one of %(choices)s.")
+		parser.add_argument("plan_name", nargs = "*", help = "Backup plan(s) the command applies to. If not specified, it applies to all plans the daemon watches.")
+	register("control", "Trigger, pause or resume backups of the running daemon or unmount managed mounts", genparser, action = _lazy_action("ActionControl"))
 
-	returncode = mc.run(sys.argv[1:])
+	try:
+		returncode = mc.run(sys.argv[1:])
+	except KeyboardInterrupt:
+		# Child processes run in sessions of their own and did not see the
+		# interrupt, pass it on so they can clean up before we exit
+		if "rebade.ProcessSupervisor" in sys.modules:
+			sys.modules["rebade.ProcessSupervisor"].ProcessSupervisor.cancel_all_supervisors("interrupted")
+		raise
+	finally:
+		tracer.close()
 	return (returncode or 0)
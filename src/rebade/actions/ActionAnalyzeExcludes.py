@@ -0,0 +1,59 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import time
+from rebade.MultiCommand import LoggingAction
+from rebade.Configuration import Configuration
+from rebade.BackupEngine import BackupEngine
+from rebade.ExcludeAnalyzer import ExcludeAnalyzer
+from rebade.Tools import FileSystemTools
+
+class ActionAnalyzeExcludes(LoggingAction):
+	def run(self):
+		self._config = Configuration.parse_json_file(self._args.config_file)
+		plan = self._config.get_plan_by_name(self._args.plan_name, return_default_plan = True)
+		backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
+
+		# Previously applied patterns are deliberately not excluded from the
+		# analysis, so that applying again replaces them
+		excludes = plan.source.exclude + list(backup_engine.excluded_mountpoints(plan))
+		analyzer = ExcludeAnalyzer(thread_count = self._args.threads, markers = plan.source.exclude_if_present, exclude_caches = plan.source.exclude_caches, is_excluded = lambda path: FileSystemTools.matches_exclude(path, excludes))
+		t0 = time.monotonic()
+		candidates = [ candidate for candidate in analyzer.analyze(plan.source.paths) if candidate.total_bytes >= self._args.min_size * 1024 * 1024 ]
+		tdiff = time.monotonic() - t0
+
+		print(f"{'MiB':>9s} {'files':>8s}  {'reason':<24s} path")
+		for candidate in candidates:
+			covered = " (already excluded)" if candidate.covered else ""
+			print(f"{candidate.total_bytes / 1024 / 1024:9.1f} {candidate.total_files:8d}  {candidate.reason:<24s} {candidate.path}{covered}")
+		uncovered = [ candidate for candidate in candidates if not candidate.covered ]
+		print(f"{len(candidates)} candidates in the sources of {plan.name} found in {tdiff:.1f} secs, {sum(candidate.total_bytes for candidate in uncovered) / 1024 / 1024:.1f} MiB in {sum(candidate.total_files for candidate in uncovered)} files not yet excluded.")
+
+		patterns = ExcludeAnalyzer.patterns(candidates)
+		stored = self._config.plan_db.get(plan.name, "auto_excludes", { }).get("patterns", [ ])
+		if len(patterns) > 0:
+			print(f"Generated exclude patterns: {' '.join(patterns)}")
+		if self._args.apply:
+			self._config.plan_db.set(plan.name, "auto_excludes", { "timestamp": time.time(), "patterns": patterns })
+			print(f"Stored {len(patterns)} exclude patterns for {plan.name}, replacing {len(stored)} previous ones.")
+		elif len(stored) > 0:
+			print(f"Currently applied exclude patterns: {' '.join(stored)}")
+		return 0
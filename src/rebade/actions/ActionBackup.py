@@ -29,28 +29,31 @@ from rebade.Enums import ResticBackupReturncodes
 class ActionBackup(LoggingAction):
 	def run(self):
 		self._config = Configuration.parse_json_file(self._args.config_file)
-		backup_engine = BackupEngine(self._args.restic_binary)
-		attempt_count = 0
+		backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
+		try:
+			attempt_count = 0
 
-		plans = self._config.get_plans_by_name(self._args.plan_name)
-		while True:
-			repeat_plans = [ ]
-			attempt_count += 1
-			for plan in plans:
-				backup_status = backup_engine.execute_backup(plan)
-				if backup_status not in [ ResticBackupReturncodes.Success, ResticBackupReturncodes.IncompleteSnapshot ]:
-					# We need to repeat this plan
-					print(f"Backup plan {plan.name} failed: {backup_status.name if hasattr(backup_status, 'name') else backup_status}", file = sys.stderr)
-					repeat_plans.append(plan)
-				else:
-					print(f"Backup plan {plan.name} finished: {backup_status.name if hasattr(backup_status, 'name') else backup_status}", file = sys.stderr)
+			plans = self._config.get_plans_by_name(self._args.plan_name)
+			while True:
+				repeat_plans = [ ]
+				attempt_count += 1
+				for plan in plans:
+					backup_status = backup_engine.execute_plan(plan)
+					if backup_status not in [ ResticBackupReturncodes.Success, ResticBackupReturncodes.IncompleteSnapshot ]:
+						# We need to repeat this plan
+						print(f"Backup plan {plan.name} failed: {backup_status.name if hasattr(backup_status, 'name') else backup_status}", file = sys.stderr)
+						repeat_plans.append(plan)
+					else:
+						print(f"Backup plan {plan.name} finished: {backup_status.name if hasattr(backup_status, 'name') else backup_status}", file = sys.stderr)
 
-			if (len(repeat_plans) == 0) or ((self._args.max_backup_attempts != 0) and (attempt_count >= self._args.max_backup_attempts)):
-				break
+				if (len(repeat_plans) == 0) or ((self._args.max_backup_attempts != 0) and (attempt_count >= self._args.max_backup_attempts)):
+					break
 
-			# We need to redo some plans.
-			wait_time_secs = 60 * min(attempt_count, 30)
-			print(f"Attempt #{attempt_count} was unsuccessful, {len(repeat_plans)} of {len(plans)} failed; retrying in {wait_time_secs} seconds...", file = sys.stderr)
-			plans = repeat_plans
-			time.sleep(wait_time_secs)
-		return 0 if (len(repeat_plans) == 0) else 1
+				# We need to redo some plans.
+				wait_time_secs = 60 * min(attempt_count, 30)
+				print(f"Attempt #{attempt_count} was unsuccessful, {len(repeat_plans)} of {len(plans)} failed; retrying in {wait_time_secs} seconds...", file = sys.stderr)
+				plans = repeat_plans
+				time.sleep(wait_time_secs)
+			return 0 if (len(repeat_plans) == 0) else 1
+		finally:
+			backup_engine.close()
@@ -0,0 +1,52 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import time
+from rebade.MultiCommand import LoggingAction
+from rebade.Configuration import Configuration
+from rebade.BackupEngine import BackupEngine
+from rebade.Tools import FileSystemTools
+
+class ActionCache(LoggingAction):
+	def run(self):
+		self._config = Configuration.parse_json_file(self._args.config_file)
+		plans = self._config.get_plans_by_name(self._args.plan_name)
+		backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
+		try:
+			returncode = 0
+			for plan in plans:
+				if self._args.cleanup:
+					returncode = backup_engine.execute_cache_cleanup(plan) or returncode
+				if self._args.prewarm:
+					returncode = backup_engine.execute_cache_prewarm(plan) or returncode
+
+				(cache_bytes, cache_files) = FileSystemTools.get_directory_usage(plan.cache_dir)
+				cache_info = self._config.plan_db.get(plan.name, "cache", { })
+				print(f"{plan.name}: {plan.cache_dir}, {cache_bytes / 1024 / 1024:.1f} MiB in {cache_files} files")
+				if "prewarmed_at" in cache_info:
+					# The time the pre-warming took is what a backup on a cold cache
+					# would additionally spend downloading metadata
+					print(f"    last pre-warmed {(time.time() - cache_info['prewarmed_at']) / 3600:.1f} hours ago; a warm cache saves approx. {cache_info['prewarm_secs']:.0f} secs per backup")
+				if "cleanup_at" in cache_info:
+					print(f"    last cleaned up {(time.time() - cache_info['cleanup_at']) / 3600:.1f} hours ago")
+			return returncode
+		finally:
+			backup_engine.close()
@@ -0,0 +1,63 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import json
+import time
+from rebade.MultiCommand import LoggingAction
+from rebade.ControlSocket import ControlClient
+from rebade.Exceptions import ControlException
+
+class ActionControl(LoggingAction):
+	def _print_status(self, status: dict):
+		if status["running"] is not None:
+			print(f"Running backup of {status['running']['plan']} for {status['running']['duration_secs']:.0f} secs")
+		else:
+			print("No backup running")
+		print(f"User inactive for {status['inactivity_secs']} secs{', all plans paused' if status['paused'] else ''}")
+		if status.get("predicted_idle_secs"):
+			print(f"Predicted idle window: {status['predicted_idle_secs'] / 60:.0f} minutes")
+		print()
+		print(f"{'plan':<20s} {'activity':>9s} {'soft':>7s} {'hard':>7s}  {'holdoff':<12s} flags")
+		now = time.time()
+		for (plan_name, plan_status) in status["plans"].items():
+			holdoff_secs = plan_status["holdoff"] - now
+			holdoff = f"{holdoff_secs:.0f} secs" if (holdoff_secs > 0) else "-"
+			flags = [ flag for flag in [ "paused", "triggered" ] if plan_status[flag] ]
+			if plan_status.get("mount") is not None:
+				flags.append(f"{'mounting' if plan_status['mount'].get('mounting') else 'mounted'} at {plan_status['mount']['mountpoint']}")
+			print(f"{plan_name:<20s} {plan_status['activity_secs']:>9d} {plan_status['soft_period_secs']:>7d} {plan_status['hard_period_secs']:>7d}  {holdoff:<12s} {', '.join(flags)}")
+
+	def run(self):
+		client = ControlClient(self._args.control_socket)
+		try:
+			if self._cmd == "status":
+				status = client.request("status")
+				if self._args.json:
+					print(json.dumps(status, indent = 4))
+				else:
+					self._print_status(status)
+			else:
+				client.request(self._args.command, plans = self._args.plan_name)
+		except (OSError, ControlException) as e:
+			print(f"Failed to talk to the rebade daemon at {self._args.control_socket}: {e.__class__.__name__}: {str(e)}", file = sys.stderr)
+			return 1
+		return 0
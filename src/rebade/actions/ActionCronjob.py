@@ -20,69 +20,131 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import os
+import re
 import sys
+import socket
 import subprocess
+import contextlib
 import logging
 from rebade.MultiCommand import LoggingAction
+from rebade.Configuration import Configuration
+from rebade.TimerSchedule import TimerSchedule
+from rebade.DurationEstimator import DurationEstimator
+from rebade.Exceptions import ConfigurationException
 
 _log = logging.getLogger(__spec__.name)
 
 class ActionCronjob(LoggingAction):
-	@property
-	def systemd_unit_name(self):
-		return f"rebade-{self._args.systemd_unit_name}"
+	_UNIT_NAME_SAFE = re.compile(r"[A-Za-z0-9:_.-]")
+	_EXEC_ARG_SAFE = re.compile(r"[A-Za-z0-9_./:=@+,-]+")
 
-	@property
-	def systemd_service_filename(self):
-		return f"/etc/systemd/system/{self.systemd_unit_name}.service"
+	@classmethod
+	def _escape_unit_name(cls, text: str) -> str:
+		# Like systemd-escape, characters not permitted in unit names (and a
+		# leading dot) become \xNN; dashes are kept since names need not be
+		# unescaped again
+		escaped = [ ]
+		for (index, char) in enumerate(text):
+			if cls._UNIT_NAME_SAFE.fullmatch(char) and not ((index == 0) and (char == ".")):
+				escaped.append(char)
+			else:
+				escaped += [ f"\\x{value:02x}" for value in char.encode("utf-8") ]
+		return "".join(escaped)
+
+	def systemd_unit_name(self, plan: "BackupPlan"):
+		unit_name = f"rebade-{self._escape_unit_name(self._args.systemd_unit_name)}-{self._escape_unit_name(plan.name)}"
+		if len(unit_name) + len(".service") > 255:
+			raise ConfigurationException(f"Plan name {plan.name} is too long to be used as a systemd unit name.")
+		return unit_name
 
 	@property
-	def systemd_timer_filename(self):
-		return f"/etc/systemd/system/{self.systemd_unit_name}.timer"
+	def legacy_systemd_unit_name(self):
+		# Before timers were installed per plan, a single one ran all plans
+		return f"rebade-{self._escape_unit_name(self._args.systemd_unit_name)}"
+
+	def systemd_service_filename(self, plan: "BackupPlan"):
+		return f"/etc/systemd/system/{self.systemd_unit_name(plan)}.service"
 
-	def _run_install(self):
+	def systemd_timer_filename(self, plan: "BackupPlan"):
+		return f"/etc/systemd/system/{self.systemd_unit_name(plan)}.timer"
+
+	def _install_plan(self, plan: "BackupPlan", on_calendar: str):
 		rebade_binary = os.path.realpath(sys.argv[0])
-		with open(self.systemd_service_filename, "w") as f:
-			plan_args = "" if (len(self._args.plan_name) == 0) else f" {' '.join(name for name in self._args.plan_name)}"
+		with open(self.systemd_service_filename(plan), "w") as f:
 			print("[Unit]", file = f)
-			print(f"Description=Restic backup task (via rebade) of {plan_args}", file = f)
+			print(f"Description=Restic backup task (via rebade) of {plan.name.replace('%', '%%')}", file = f)
 			print("After=network-online.target", file = f)
 			print(file = f)
 			print("[Service]", file = f)
 			print("Type=oneshot", file = f)
-			print(f"ExecStart={self._escape(rebade_binary)} backup {plan_args}", file = f)
-			print("Environment=\"XDG_CACHE_HOME=/root/.cache\"", file = f)
+			print(f"ExecStart={self._escape(rebade_binary)} backup --restic-binary {self._escape(self._args.restic_binary)} --config-file {self._escape(os.path.realpath(self._args.config_file))} {self._escape(plan.name)}", file = f)
 			print("Nice=10", file = f)
 
-		with open(self.systemd_timer_filename, "w") as f:
+		with open(self.systemd_timer_filename(plan), "w") as f:
 			print("[Unit]", file = f)
-			print(f"Description=Restic backup timer (via rebade) of {plan_args}", file = f)
+			print(f"Description=Restic backup timer (via rebade) of {plan.name.replace('%', '%%')}", file = f)
 			print(file = f)
 			print("[Timer]", file = f)
-			print("OnCalendar=*-*-* 22:00:00", file = f)
-			print("RandomizedDelaySec=1h", file = f)
+			print(f"OnCalendar={on_calendar}", file = f)
+			print("AccuracySec=1s", file = f)
 			print("Persistent=true", file = f)
 			print(file = f)
 			print("[Install]", file = f)
 			print("WantedBy=timers.target", file = f)
 
+	def _remove_legacy_units(self):
+		unit_name = self.legacy_systemd_unit_name
+		if not os.path.exists(f"/etc/systemd/system/{unit_name}.timer"):
+			return
+		print(f"Removing {unit_name}.timer, which was installed by a previous version for all plans at once")
+		subprocess.call([ "systemctl", "stop", f"{unit_name}.timer" ])
+		subprocess.call([ "systemctl", "disable", f"{unit_name}.timer" ])
+		for suffix in [ ".service", ".timer" ]:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(f"/etc/systemd/system/{unit_name}{suffix}")
+
+	def _run_install(self, plans: list["BackupPlan"]):
+		# Fail before any unit is written
+		for plan in plans:
+			self.systemd_unit_name(plan)
+		self._remove_legacy_units()
+		schedule = TimerSchedule(self._args.hostname or socket.gethostname())
+		duration_estimator = DurationEstimator(self._config.plan_db)
+		for plan in plans:
+			expected_duration_secs = duration_estimator.estimate_secs(plan)
+			on_calendar = schedule.on_calendar(plan, expected_duration_secs)
+			duration_text = "unknown duration" if (expected_duration_secs is None) else f"expected duration {expected_duration_secs:.0f} secs"
+			print(f"{plan.name}: OnCalendar={on_calendar} ({duration_text})")
+			self._install_plan(plan, on_calendar)
+
 		subprocess.check_call([ "systemctl", "daemon-reload" ])
-		subprocess.check_call([ "systemctl", "enable", f"{self.systemd_unit_name}.timer" ])
-		subprocess.check_call([ "systemctl", "start", f"{self.systemd_unit_name}.timer" ])
-
-	def _run_uninstall(self):
-		subprocess.check_call([ "systemctl", "stop", f"{self.systemd_unit_name}.timer" ])
-		subprocess.check_call([ "systemctl", "disable", f"{self.systemd_unit_name}.timer" ])
-		os.unlink(self.systemd_service_filename)
-		os.unlink(self.systemd_timer_filename)
+		for plan in plans:
+			subprocess.check_call([ "systemctl", "enable", f"{self.systemd_unit_name(plan)}.timer" ])
+			subprocess.check_call([ "systemctl", "restart", f"{self.systemd_unit_name(plan)}.timer" ])
+
+	def _run_uninstall(self, plans: list["BackupPlan"]):
+		for plan in plans:
+			subprocess.check_call([ "systemctl", "stop", f"{self.systemd_unit_name(plan)}.timer" ])
+			subprocess.check_call([ "systemctl", "disable", f"{self.systemd_unit_name(plan)}.timer" ])
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(self.systemd_service_filename(plan))
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(self.systemd_timer_filename(plan))
+		self._remove_legacy_units()
 		subprocess.check_call([ "systemctl", "daemon-reload" ])
 
-	def _escape(self, cmd: list[str]) -> list[str]:
-		# TODO IMPLEMENT ME
-		return cmd
+	def _escape(self, arg: str) -> str:
+		# Quoting for systemd's command line parsing, which also expands
+		# specifiers (%) and environment variables ($)
+		if self._EXEC_ARG_SAFE.fullmatch(arg):
+			return arg
+		escaped = arg.replace("\\", "\\\\").replace("\"", "\\\"").replace("%", "%%").replace("$", "$$")
+		return f"\"{escaped}\""
 
 	def run(self):
+		self._config = Configuration.parse_json_file(self._args.config_file)
+		plans = self._config.get_plans_by_name(self._args.plan_name)
 		if self._args.delete:
-			self._run_uninstall()
+			self._run_uninstall(plans)
 		else:
-			self._run_install()
+			self._run_install(plans)
@@ -23,13 +23,25 @@ import os
 import sys
 import glob
 import select
+import signal
 import time
+import threading
+import contextlib
 import subprocess
 import logging
 from rebade.StateFile import StateFile
 from rebade.MultiCommand import LoggingAction
 from rebade.Configuration import Configuration
 from rebade.BackupEngine import BackupEngine
+from rebade.Scheduler import Scheduler
+from rebade.ActivityProfile import ActivityProfile
+from rebade.ActivityTrace import ActivityTrace
+from rebade.DurationEstimator import DurationEstimator
+from rebade.Enums import ResticBackupReturncodes
+from rebade.Inotify import Inotify
+from rebade.ControlSocket import ControlServer
+from rebade.MountManager import MountManager
+from rebade.Exceptions import RebadeException, ControlException
 
 _log = logging.getLogger(__spec__.name)
 
@@ -39,92 +51,274 @@ class ActionDaemon(LoggingAction):
 		return os.path.basename(self._args.systemd_unit_filename)
 
 	def _open_event_devices(self):
-		for filename in glob.glob("/dev/input/event*"):
-			f = open(filename, "rb")
+		for filename in glob.glob(self._args.device_glob):
+			f = open(filename, "rb", buffering = 0)
 			self._descriptors[f.fileno()] = f
 			os.set_blocking(f.fileno(), False)
 
 	def _close_event_devices(self):
 		for f in self._descriptors.values():
 			f.close()
+		self._descriptors = { }
 
 	def _clear_fd(self, fd):
-		f = self._descriptors[fd]
-		while True:
+		# Only the fact that there was input matters, never its content. All
+		# reads go into the same buffer and a device is read at most a few
+		# times per step, no matter how many events it produces; a device
+		# that floods faster than it can be drained is simply active.
+		for _ in range(8):
+			try:
+				length = os.readv(fd, [ self._drain_buffer ])
+			except BlockingIOError:
+				return
 			# This call to read will OSError ("no such device") if the input
 			# device is removed
-			if f.read() is None:
+			if length == 0:
+				raise OSError(f"Input device {self._descriptors[fd].name} was closed")
+			if length < len(self._drain_buffer):
 				return
 
 	def _clear_all_fds(self):
 		for fd in self._descriptors.keys():
 			self._clear_fd(fd)
 
-	def _wait_for_action(self, timeout_secs = 20):
-		(rlist, wlist, xlist) = select.select([ fd for fd in self._descriptors.keys() ], [ ], [ ], timeout_secs)
-		if len(rlist) > 0:
-			# Read from all FDs
+	def _wait_for_action(self, timeout_secs = 20, watch_input = True):
+		# Returns early when woken up by a control request
+		tend = time.time() + timeout_secs
+		while not self._wakeup_requested:
+			remaining = tend - time.time()
+			if remaining <= 0:
+				return False
+			fds = (list(self._descriptors.keys()) if watch_input else [ ]) + list(self._aux_handlers.keys())
+			(rlist, wlist, xlist) = select.select(fds, [ ], [ ], remaining)
+			had_action = False
 			for fd in rlist:
-				self._clear_fd(fd)
-			return True
-		else:
-			return False
+				if fd in self._aux_handlers:
+					# Not an input device, e.g., a configuration change
+					self._aux_handlers[fd]()
+				else:
+					self._clear_fd(fd)
+					had_action = True
+			if had_action:
+				return True
+		return False
 
 	def _time_tick(self, step_secs = 20):
+		# Returns if there was activity and if the step was cut short by a
+		# control request
 		t0 = time.time()
 		tend = t0 + step_secs
 
 		self._clear_all_fds()
 		had_action = self._wait_for_action(step_secs)
-		remaining = tend - time.time()
-		if remaining > 0:
-			time.sleep(remaining)
+		self._wait_for_action(tend - time.time(), watch_input = False)
 		t1 = time.time()
 		tdiff = t1 - t0
-		return had_action and (abs(tdiff - step_secs) < 0.5)
+		if self._wakeup_requested:
+			self._wakeup_requested = False
+			return (had_action, True)
+		return (had_action and (abs(tdiff - step_secs) < 0.5), False)
 
-	def _run_loop(self):
-		inactivity_secs = 0
+	def _wakeup(self):
+		# Called from the control socket's thread
+		with contextlib.suppress(BlockingIOError):
+			os.write(self._wakeup_w, b"\0")
+
+	def _on_wakeup(self):
+		with contextlib.suppress(BlockingIOError):
+			os.read(self._wakeup_r, 4096)
+		self._wakeup_requested = True
+
+	def _maintain_caches(self):
+		# Called only once the user has been inactive for as long as a
+		# soft-due backup would wait and no backup is due
+		cleaned_cache_dirs = set()
+		for plan in self._plans:
+			if (plan.cache_dir not in cleaned_cache_dirs) and self._backup_engine.cache_due_for_cleanup(plan):
+				_log.info(f"Cleaning up cache of {plan.name} at {plan.cache_dir}")
+				self._backup_engine.execute_cache_cleanup(plan)
+				cleaned_cache_dirs.add(plan.cache_dir)
+
+			activity_secs = self._state_file.get_activity(plan.name)
+			if (activity_secs > self._args.prewarm_ratio * plan.soft_period_secs) and self._backup_engine.cache_due_for_prewarm(plan):
+				_log.info(f"Pre-warming cache of {plan.name} with {activity_secs} secs of activity")
+				self._backup_engine.execute_cache_prewarm(plan)
+
+	def _setup_config_watch(self):
+		# Watch the directories instead of the files themselves, editors
+		# commonly replace files by renaming a new file over them
+		for path in [ os.path.dirname(os.path.realpath(self._args.config_file)), self._config.include_dir ]:
+			if (path is not None) and os.path.isdir(path):
+				self._inotify.add_watch(path, Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_MOVED_FROM | Inotify.IN_CREATE | Inotify.IN_DELETE)
+
+	def _on_config_dir_event(self):
+		config_filename = os.path.basename(self._args.config_file)
+		for event in self._inotify.read_events():
+			if (event.name == config_filename) or (event.name == "conf.d") or ((event.path == self._config.include_dir) and event.name.endswith(".json")):
+				self._reload_requested = True
+
+	def _on_sighup(self, signum, frame):
+		self._reload_requested = True
+
+	def _reload_config(self):
+		self._reload_requested = False
+		try:
+			config = Configuration.parse_json_file(self._args.config_file, previous = self._config)
+			plans = config.get_plans_by_name(self._args.plan_name)
+		except (RebadeException, OSError, KeyError, ValueError) as e:
+			_log.error(f"Failed to reload configuration, keeping previous one: {e.__class__.__name__}: {str(e)}")
+			return
+
+		(added, removed, changed) = self._config.diff(config)
+		_log.info(f"Reloaded configuration: {len(added)} plan(s) added, {len(removed)} removed, {len(changed)} changed")
+		for (description, plan_names) in (("Added", added), ("Removed", removed), ("Changed", changed)):
+			if len(plan_names) > 0:
+				_log.info(f"{description}: {', '.join(plan_names)}")
+		if config.plan_db.filename != self._config.plan_db.filename:
+			self._backup_engine.close()
+			self._backup_engine = BackupEngine(self._args.restic_binary, plan_db = config.plan_db)
+		self._config = config
+		self._plans = plans
+		self._setup_config_watch()
+
+	def _control_status(self):
+		now = time.time()
+		with self._control_lock:
+			status = {
+				"inactivity_secs": self._inactivity_secs,
+				"predicted_idle_secs": self._scheduler.predict_idle_secs(now),
+				"paused": self._paused,
+				"running": None if (self._running is None) else { "plan": self._running[0], "since": self._running[1], "duration_secs": now - self._running[1] },
+				"plans": { },
+			}
+			for plan in self._plans:
+				status["plans"][plan.name] = {
+					"activity_secs": self._state_file.get_activity(plan.name),
+					"soft_period_secs": plan.soft_period_secs,
+					"hard_period_secs": plan.hard_period_secs,
+					"holdoff": self._state_file.get_holdoff(plan.name),
+					"paused": plan.name in self._paused_plans,
+					"triggered": plan.name in self._triggered_plans,
+					"expected_duration_secs": self._scheduler.expected_duration_secs(plan, now),
+					"mount": self._mount_manager.status(plan.name),
+				}
+		return status
+
+	def _on_control_request(self, request: dict):
+		# Runs in the control socket's thread
+		known_plan_names = [ plan.name for plan in self._plans ]
+		plan_names = request.get("plans") or [ ]
+		if (not isinstance(request["cmd"], str)) or (not isinstance(plan_names, list)) or (not all(isinstance(plan_name, str) for plan_name in plan_names)):
+			raise ControlException("Control command must be a string and plans a list of plan names.")
+		unknown_plan_names = set(plan_names) - set(known_plan_names)
+		if len(unknown_plan_names) > 0:
+			raise ControlException(f"Daemon does not watch plan(s): {', '.join(sorted(unknown_plan_names))}")
 
+		match request["cmd"]:
+			case "status":
+				return self._control_status()
+
+			case "trigger":
+				with self._control_lock:
+					self._triggered_plans |= set(plan_names or known_plan_names)
+				self._wakeup()
+
+			case "pause":
+				with self._control_lock:
+					if len(plan_names) == 0:
+						self._paused = True
+					else:
+						self._paused_plans |= set(plan_names)
+
+			case "resume":
+				with self._control_lock:
+					if len(plan_names) == 0:
+						self._paused = False
+						self._paused_plans = set()
+					else:
+						self._paused_plans -= set(plan_names)
+				self._wakeup()
+
+			case "mount":
+				if len(plan_names) != 1:
+					raise ControlException("Exactly one plan must be given to mount.")
+				plan = next(plan for plan in self._plans if plan.name == plan_names[0])
+				return { "mountpoint": self._mount_manager.mount(plan) }
+
+			case "unmount":
+				for plan_name in (plan_names or known_plan_names):
+					self._mount_manager.unmount(plan_name)
+
+			case "clear-holdoff":
+				for plan_name in (plan_names or known_plan_names):
+					self._state_file.set_holdoff(plan_name, 0)
+				self._wakeup()
+
+			case _:
+				raise ControlException(f"Unknown control command: {request['cmd']}")
+
+	def _run_loop(self):
 		while True:
-			if self._time_tick(self._args.timestep_secs):
-				# Have activity.
-				for plan in self._plans:
-					self._state_file.add_activity(plan.name, self._args.timestep_secs)
-				inactivity_secs = 0
-			else:
-				inactivity_secs += self._args.timestep_secs
+			if self._reload_requested:
+				self._reload_config()
 
-			# Check if any is above threshold
-			execute_plans = [ ]
+			(had_activity, woken_up) = self._time_tick(self._args.timestep_secs)
 			now = time.time()
-			for plan in self._plans:
-				activity_secs = self._state_file.get_activity(plan.name)
-				holdoff = self._state_file.get_holdoff(plan.name)
-				if inactivity_secs > 5 * 60:
-					# User is currently inactive, use the soft threshold
-					threshold = plan.soft_period_secs
+			if had_activity or (not woken_up):
+				# A step cut short without activity is not accounted at all
+				if self._profile is not None:
+					self._profile.record(now, self._args.timestep_secs if had_activity else 0, self._args.timestep_secs)
+					self._state_file.mark_changed()
+				if self._trace is not None:
+					self._trace.record(now, had_activity)
+				if had_activity:
+					# Have activity.
+					for plan in self._plans:
+						self._state_file.add_activity(plan.name, self._args.timestep_secs)
+					self._inactivity_secs = 0
 				else:
-					# Use is currently active, only run backup if we hit the hard threshold
-					threshold = plan.hard_period_secs
+					self._inactivity_secs += self._args.timestep_secs
+			inactivity_secs = self._inactivity_secs
+			self._mount_manager.unmount_idle()
 
-				_log.debug(f"Plan {plan.name} has {activity_secs} secs of activity, holdoff at {holdoff}, threshold at {threshold} secs")
-				if (activity_secs > threshold) and (now > holdoff):
-					# Add to execution list.
-					execute_plans.append(plan)
+			# Check if any is above threshold
+			activity_secs = { plan.name: self._state_file.get_activity(plan.name) for plan in self._plans }
+			holdoffs = { plan.name: self._state_file.get_holdoff(plan.name) for plan in self._plans }
+			with self._control_lock:
+				triggered = set(self._triggered_plans)
+				paused = set(plan.name for plan in self._plans) if self._paused else set(self._paused_plans)
+			execute_plans = self._scheduler.due_plans(self._plans, now, inactivity_secs, activity_secs, holdoffs, triggered = triggered, paused = paused)
 
 			if len(execute_plans) > 0:
 				for plan in execute_plans:
 					_log.info(f"Now executing: {plan.name}")
-					if self._backup_engine.execute_backup(plan):
+					with self._control_lock:
+						self._triggered_plans.discard(plan.name)
+						self._running = (plan.name, time.time())
+					try:
+						with self._mount_manager.yield_to(plan):
+							backup_status = self._backup_engine.execute_plan(plan)
+					finally:
+						with self._control_lock:
+							self._running = None
+					if backup_status in [ ResticBackupReturncodes.Success, ResticBackupReturncodes.IncompleteSnapshot ]:
 						# Backup successful
+						self._unreachable_counts.pop(plan.name, None)
 						self._state_file.reset_activity(plan.name)
 						_log.info(f"Successfully backed up: {plan.name}")
 					else:
 						# Incur a holdoff, do not reset activity
-						holdoff = time.time() + 1800
-						self._state_file.set_holdoff(plan.name, holdoff)
-						_log.warning(f"Failed to backed up: {plan.name} -- incurring holdoff")
+						if backup_status == ResticBackupReturncodes.TargetUnreachable:
+							self._unreachable_counts[plan.name] = self._unreachable_counts.get(plan.name, 0) + 1
+						else:
+							self._unreachable_counts.pop(plan.name, None)
+						holdoff_secs = Scheduler.failure_holdoff_secs(self._unreachable_counts.get(plan.name, 0))
+						self._state_file.set_holdoff(plan.name, time.time() + holdoff_secs)
+						_log.warning(f"Failed to backed up: {plan.name} -- incurring holdoff of {holdoff_secs} secs")
+				# SSH master connections were only needed for this round
+				self._backup_engine.close()
+			elif self._scheduler.user_inactive(inactivity_secs):
+				self._maintain_caches()
 
 	def _open_run_close(self):
 		try:
@@ -137,15 +331,48 @@ class ActionDaemon(LoggingAction):
 		self._config = Configuration.parse_json_file(self._args.config_file)
 		self._plans = self._config.get_plans_by_name(self._args.plan_name)
 		self._state_file = StateFile(self._args.state_file)
-		self._backup_engine = BackupEngine(self._args.restic_binary)
+		self._backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
 		self._descriptors = { }
-		while True:
-			try:
-				self._open_run_close()
-			except OSError as e:
-				delay_secs = 3
-				print(f"Caught {e.__class__.__name__}: {str(e)} -- restarting in {delay_secs} seconds", file = sys.stderr)
-				time.sleep(delay_secs)
+		self._drain_buffer = bytearray(64 * 1024)
+		self._inactivity_secs = 0
+		self._reload_requested = False
+		self._profile = None if self._args.no_forecast else ActivityProfile(self._state_file.get_section("profile"))
+		self._trace = None if (self._args.record_trace is None) else ActivityTrace(self._args.record_trace, self._args.timestep_secs)
+		self._scheduler = Scheduler(inactivity_threshold_secs = self._args.inactivity_secs, profile = self._profile, duration_estimator = lambda plan, now: DurationEstimator(self._config.plan_db).estimate_secs(plan, now), memory_check = lambda plan: self._backup_engine.memory_fits(plan))
+		self._control_lock = threading.Lock()
+		self._paused = False
+		self._paused_plans = set()
+		self._triggered_plans = set()
+		self._running = None
+		self._unreachable_counts = { }
+		self._mount_manager = MountManager(self._args.mount_dir, lambda plan, mountpoint: self._backup_engine.start_mount(plan, mountpoint), idle_secs = self._args.mount_idle_secs)
+		self._control_server = ControlServer(self._args.control_socket, self._on_control_request)
+		self._control_server.start()
+		self._inotify = Inotify()
+		(self._wakeup_r, self._wakeup_w) = os.pipe()
+		os.set_blocking(self._wakeup_r, False)
+		os.set_blocking(self._wakeup_w, False)
+		self._wakeup_requested = False
+		self._aux_handlers = { self._inotify.fileno(): self._on_config_dir_event, self._wakeup_r: self._on_wakeup }
+		self._setup_config_watch()
+		signal.signal(signal.SIGHUP, self._on_sighup)
+		try:
+			while True:
+				try:
+					self._open_run_close()
+				except OSError as e:
+					delay_secs = 3
+					print(f"Caught {e.__class__.__name__}: {str(e)} -- restarting in {delay_secs} seconds", file = sys.stderr)
+					time.sleep(delay_secs)
+		finally:
+			self._inotify.close()
+			self._control_server.stop()
+			os.close(self._wakeup_r)
+			os.close(self._wakeup_w)
+			self._mount_manager.unmount_all()
+			if self._trace is not None:
+				self._trace.close()
+			self._backup_engine.close()
 
 	def _escape(self, cmd):
 		# TODO IMPLEMENT ME
@@ -161,8 +388,8 @@ class ActionDaemon(LoggingAction):
 			print(file = f)
 			print("[Service]", file = f)
 			print("Type=simple", file = f)
-			print(f"ExecStart={self._escape(rebade_binary)} daemon -a watch --restic-binary {self._escape(self._args.restic_binary)} --state-file {self._escape(self._args.state_file)} --config-file {self._escape(self._args.config_file)} --timestep-secs {self._args.timestep_secs}{plan_args}", file = f)
-			print("Environment=\"XDG_CACHE_HOME=/root/.cache\"", file = f)
+			print("ExecReload=/bin/kill -HUP $MAINPID", file = f)
+			print(f"ExecStart={self._escape(rebade_binary)} daemon -a watch --restic-binary {self._escape(self._args.restic_binary)} --state-file {self._escape(self._args.state_file)} --config-file {self._escape(self._args.config_file)} --timestep-secs {self._args.timestep_secs} --device-glob {self._escape(self._args.device_glob)} --prewarm-ratio {self._args.prewarm_ratio} --inactivity-secs {self._args.inactivity_secs}{' --no-forecast' if self._args.no_forecast else ''}{'' if (self._args.record_trace is None) else f' --record-trace {self._escape(self._args.record_trace)}'} --control-socket {self._escape(self._args.control_socket)} --mount-dir {self._escape(self._args.mount_dir)} --mount-idle-secs {self._args.mount_idle_secs}{plan_args}", file = f)
 			print(file = f)
 			print("[Install]", file = f)
 			print("WantedBy=multi-user.target", file = f)
@@ -0,0 +1,61 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import logging
+from rebade.MultiCommand import LoggingAction
+from rebade.Configuration import Configuration
+from rebade.BackupEngine import BackupEngine
+from rebade.SnapshotSelector import SnapshotSelector
+from rebade.Exceptions import NoSuchSnapshotException
+
+_log = logging.getLogger(__spec__.name)
+
+class ActionDump(LoggingAction):
+	def run(self):
+		if sys.stdout.isatty() and (not self._args.force):
+			_log.error("Refusing to write an archive to a terminal, redirect stdout or use --force.")
+			return 1
+		self._config = Configuration.parse_json_file(self._args.config_file)
+		plan = self._config.get_plan_by_name(self._args.plan_name, return_default_plan = True)
+		path = os.path.normpath(self._args.path)
+		backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
+		try:
+			snapshots = backup_engine.execute_list_snapshots(plan)
+			if snapshots is None:
+				_log.error("Unable to list snapshots of %s", plan.name)
+				return 1
+			try:
+				selection = SnapshotSelector(plan, snapshots).select(self._args.snapshot, paths = [ path ])
+			except NoSuchSnapshotException as e:
+				_log.error("%s", str(e))
+				return 1
+			if len(selection) != 1:
+				_log.error("%s spans multiple snapshots of %s, dump a path within one of %s instead", path, plan.name, ", ".join(root for (snapshot, roots) in selection for root in roots))
+				return 1
+			snapshot = selection[0][0]
+			_log.debug("Dumping %s from snapshot %s", path, snapshot["short_id"])
+			sys.stdout.flush()
+			returncode = backup_engine.execute_dump(plan, snapshot["id"], path, archive = self._args.archive)
+		finally:
+			backup_engine.close()
+		return 0 if (returncode == 0) else 1
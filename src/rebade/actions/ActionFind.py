@@ -0,0 +1,80 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import logging
+from rebade.MultiCommand import LoggingAction
+from rebade.Configuration import Configuration
+from rebade.BackupEngine import BackupEngine
+from rebade.SnapshotIndex import SnapshotIndex
+
+_log = logging.getLogger(__spec__.name)
+
+class ActionFind(LoggingAction):
+	def _update_index(self, backup_engine: BackupEngine, index: SnapshotIndex, plan: "BackupPlan"):
+		# The index holds the snapshots of all plans in the repository, not
+		# only of those searched for, so it does not change with the query
+		scope_plans = [ other for other in self._config.plans if other.repository_key == plan.repository_key ]
+		snapshots = backup_engine.execute_list_snapshots(plan, scope_plans = scope_plans)
+		if snapshots is None:
+			_log.error("Unable to list snapshots of %s, only searching the existing index", plan.name)
+			return
+
+		indexed_ids = index.indexed_snapshot_ids
+		index.remove_snapshots(sorted(indexed_ids - set(snapshot["id"] for snapshot in snapshots)))
+		for snapshot in sorted(snapshots, key = lambda snapshot: snapshot["time"]):
+			if snapshot["id"] in indexed_ids:
+				continue
+			_log.info("Indexing snapshot %s from %s", snapshot["short_id"], snapshot["time"])
+			if not index.add_snapshot(snapshot, lambda add_line: backup_engine.execute_ls(plan, snapshot["id"], add_line) == 0):
+				_log.error("Unable to index snapshot %s", snapshot["short_id"])
+
+	def _print_results(self, results: list[dict]):
+		for result in results:
+			print(result["path"])
+			for version in result["versions"]:
+				size = "" if (version["size"] is None) else f"{version['size']:>12d}"
+				print(f"    {version['type']:<8s} {size:>12s}  {(version['mtime'] or '')[:19].replace('T', ' '):<19s}  {' '.join(snapshot['short_id'] for snapshot in version['snapshots'])}")
+
+	def run(self):
+		self._config = Configuration.parse_json_file(self._args.config_file)
+		plans = self._config.get_plans_by_name(self._args.plan_name)
+		backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
+		results = [ ]
+		try:
+			for repository_plans in Configuration.group_by_repository(plans).values():
+				plan = repository_plans[0]
+				index = SnapshotIndex(os.path.join(self._config.index_dir, f"{plan.repository_key}.sqlite"))
+				try:
+					if not self._args.offline:
+						self._update_index(backup_engine, index, plan)
+					results += index.find(self._args.pattern, plan_names = [ plan.name for plan in repository_plans ], limit = self._args.limit)
+				finally:
+					index.close()
+		finally:
+			backup_engine.close()
+
+		if self._args.json:
+			print(json.dumps(results, indent = 4))
+		else:
+			self._print_results(results)
+		return 0 if (len(results) > 0) else 1
@@ -19,14 +19,29 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import logging
 from rebade.MultiCommand import LoggingAction
 from rebade.Configuration import Configuration
 from rebade.BackupEngine import BackupEngine
 
+_log = logging.getLogger(__spec__.name)
+
 class ActionForget(LoggingAction):
 	def run(self):
 		self._config = Configuration.parse_json_file(self._args.config_file)
 		plans = self._config.get_plans_by_name(self._args.plan_name)
-		backup_engine = BackupEngine(self._args.restic_binary)
-		for plan in plans:
-			backup_engine.execute_forget(plan)
+		backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
+		try:
+			returncode = 0
+			for repository_plans in Configuration.group_by_repository(plans).values():
+				plan = repository_plans[0]
+				if len(repository_plans) > 1:
+					_log.info("Plans %s share a repository, forgetting and pruning it once", ", ".join(plan.name for plan in repository_plans))
+				if backup_engine.execute_forget(plan, scope_plans = repository_plans) != 0:
+					returncode = 1
+					continue
+				if self._args.check and (backup_engine.execute_check(plan) != 0):
+					returncode = 1
+			return returncode
+		finally:
+			backup_engine.close()
@@ -1,5 +1,5 @@
 #	rebade - Restic backup daemon, a friendly frontend for restic
-#	Copyright (C) 2024-2024 Johannes Bauer
+#	Copyright (C) 2024-2026 Johannes Bauer
 #
 #	This file is part of rebade.
 #
@@ -19,14 +19,93 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import sys
+import json
+import logging
+import collections
+import concurrent.futures
 from rebade.MultiCommand import LoggingAction
 from rebade.Configuration import Configuration
 from rebade.BackupEngine import BackupEngine
 
+_log = logging.getLogger(__spec__.name)
+
 class ActionGeneric(LoggingAction):
+	def _print_shard_groups(self, title: str, snapshots: list[dict]):
+		# Shards of one sharded backup are shown as one logical backup
+		groups = collections.OrderedDict()
+		for snapshot in sorted(snapshots, key = lambda snapshot: snapshot["time"]):
+			group_tags = [ tag for tag in snapshot.get("tags", [ ]) if tag.startswith("rebade-shard-group=") ]
+			group_id = group_tags[0].split("=", 1)[1] if (len(group_tags) > 0) else snapshot["short_id"]
+			groups.setdefault(group_id, [ ]).append(snapshot)
+
+		print(f"{title}:")
+		print(f"    {'group':<16s}  {'time':<19s}  {'host':<16s}  shards  snapshots")
+		for (group_id, group_snapshots) in groups.items():
+			print(f"    {group_id:<16s}  {group_snapshots[0]['time'][:19].replace('T', ' ')}  {group_snapshots[0].get('hostname', ''):<16s}  {len(group_snapshots):>6d}  {' '.join(snapshot['short_id'] for snapshot in group_snapshots)}")
+
+	@staticmethod
+	def _decode_json_output(data: bytes):
+		# restic emits either a single document or one message per line
+		try:
+			return json.loads(data)
+		except ValueError:
+			pass
+		try:
+			return [ json.loads(line) for line in data.splitlines() if len(line.strip()) > 0 ]
+		except ValueError:
+			return data.decode("utf-8", errors = "replace")
+
+	def _run_fanout(self, backup_engine: BackupEngine, repository_groups: list[list["BackupPlan"]]):
+		with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, self._args.parallel)) as executor:
+			futures = [ executor.submit(backup_engine.execute_captured_action, repository_plans[0], self._cmd, json_output = self._args.json, scope_plans = repository_plans) for repository_plans in repository_groups ]
+			results = [ future.result() for future in futures ]
+
+		if self._args.json:
+			document = [ {
+				"plans": [ plan.name for plan in repository_plans ],
+				"returncode": result.returncode,
+				"duration_secs": result.duration_secs,
+				"output": self._decode_json_output(result.stdout),
+				"errors": result.stderr.decode("utf-8", errors = "replace"),
+			} for (repository_plans, result) in zip(repository_groups, results) ]
+			print(json.dumps(document, indent = 4))
+		else:
+			for (repository_plans, result) in zip(repository_groups, results):
+				print(f"==> {', '.join(plan.name for plan in repository_plans)}")
+				sys.stdout.flush()
+				sys.stdout.buffer.write(result.stdout)
+				sys.stdout.buffer.write(result.stderr)
+				sys.stdout.buffer.flush()
+				print()
+
+			print(f"{'plans':<40s}  {'returncode':>10s}  {'duration':>10s}")
+			for (repository_plans, result) in zip(repository_groups, results):
+				print(f"{', '.join(plan.name for plan in repository_plans):<40s}  {result.returncode:>10d}  {result.duration_secs:>8.1f} s")
+		return 0 if all(result.returncode == 0 for result in results) else 1
+
 	def run(self):
 		self._config = Configuration.parse_json_file(self._args.config_file)
 		plans = self._config.get_plans_by_name(self._args.plan_name)
-		backup_engine = BackupEngine(self._args.restic_binary)
-		for plan in plans:
-			backup_engine.execute_generic_action(plan, action = self._cmd)
+		backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
+		try:
+			# All of these act on the whole repository, regardless of the plan
+			repository_groups = list(Configuration.group_by_repository(plans).values())
+			if ((self._args.parallel > 1) or self._args.json) and (not getattr(self._args, "group_shards", False)):
+				return self._run_fanout(backup_engine, repository_groups)
+
+			for repository_plans in repository_groups:
+				plan = repository_plans[0]
+				plan_names = ", ".join(plan.name for plan in repository_plans)
+				if len(repository_plans) > 1:
+					_log.info("Plans %s share a repository, running %s once", plan_names, self._cmd)
+				if getattr(self._args, "group_shards", False):
+					snapshots = backup_engine.execute_list_snapshots(plan, scope_plans = repository_plans)
+					if snapshots is None:
+						print(f"Failed to list snapshots of {plan_names}", file = sys.stderr)
+					else:
+						self._print_shard_groups(plan_names, snapshots)
+				else:
+					backup_engine.execute_generic_action(plan, action = self._cmd, scope_plans = repository_plans)
+		finally:
+			backup_engine.close()
@@ -19,13 +19,32 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import sys
 from rebade.MultiCommand import LoggingAction
 from rebade.Configuration import Configuration
 from rebade.BackupEngine import BackupEngine
+from rebade.ControlSocket import ControlClient
+from rebade.Exceptions import ControlException
 
 class ActionMount(LoggingAction):
+	def _run_managed(self, plan: "BackupPlan"):
+		# Mounting includes loading the index, which takes a while
+		client = ControlClient(self._args.control_socket, timeout_secs = 60)
+		try:
+			mount = client.request("mount", plans = [ plan.name ])
+		except (OSError, ControlException) as e:
+			print(f"Failed to have the rebade daemon at {self._args.control_socket} mount {plan.name}: {e.__class__.__name__}: {str(e)}", file = sys.stderr)
+			return 1
+		print(mount["mountpoint"])
+		return 0
+
 	def run(self):
 		self._config = Configuration.parse_json_file(self._args.config_file)
 		plan = self._config.get_plan_by_name(self._args.plan_name, return_default_plan = True)
-		backup_engine = BackupEngine(self._args.restic_binary)
-		backup_engine.execute_mount(plan, self._args.mountpoint)
+		if self._args.managed:
+			return self._run_managed(plan)
+		backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
+		try:
+			backup_engine.execute_mount(plan, self._args.mountpoint)
+		finally:
+			backup_engine.close()
@@ -0,0 +1,107 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+import os
+import json
+import logging
+import concurrent.futures
+from rebade.MultiCommand import LoggingAction
+from rebade.Configuration import Configuration
+from rebade.BackupEngine import BackupEngine
+from rebade.SnapshotSelector import SnapshotSelector
+from rebade.Exceptions import NoSuchSnapshotException
+
+_log = logging.getLogger(__spec__.name)
+
+class ActionRestore(LoggingAction):
+	# A single restic restore is mostly bound by the latency of fetching
+	# packs one after another. The selection is therefore split into
+	# disjoint subtrees (the immediate children of the selected paths) which
+	# are restored by several restic processes concurrently. Every process
+	# loads the repository index on its own, so subtrees are grouped into a
+	# few batches per worker instead of one process per subtree.
+	_BATCHES_PER_WORKER = 4
+
+	@staticmethod
+	def _include_pattern(path: str) -> str:
+		return re.sub(r"([\\*?\[])", r"\\\1", path)
+
+	def _subtrees(self, backup_engine: BackupEngine, plan: "BackupPlan", snapshot: dict, roots: list[str]) -> list[str]:
+		children = { root: [ ] for root in roots }
+		def add_line(line: bytes):
+			node = json.loads(line)
+			if node.get("struct_type", "node") != "node":
+				return
+			parent = os.path.dirname(node["path"])
+			if parent in children:
+				children[parent].append(node["path"])
+		if backup_engine.execute_ls(plan, snapshot["id"], add_line, paths = roots) != 0:
+			_log.warning("Unable to list %s in snapshot %s, restoring it without splitting", ", ".join(roots), snapshot["short_id"])
+			return roots
+		# Plain files and empty directories have no children and are
+		# restored as they are
+		return [ subtree for root in roots for subtree in (children[root] or [ root ]) ]
+
+	def _batches(self, backup_engine: BackupEngine, plan: "BackupPlan", selection: list[tuple[dict, list[str]]]) -> list[tuple[dict, list[str] | None]]:
+		if self._args.parallel <= 1:
+			return [ (snapshot, None if self._args.include is None else roots) for (snapshot, roots) in selection ]
+
+		subtrees = [ (snapshot, subtree) for (snapshot, roots) in selection for subtree in self._subtrees(backup_engine, plan, snapshot, roots) ]
+		batch_count = min(len(subtrees), self._args.parallel * self._BATCHES_PER_WORKER)
+		batches = { }
+		for (index, (snapshot, subtree)) in enumerate(subtrees):
+			batches.setdefault((snapshot["id"], index % batch_count), (snapshot, [ ]))[1].append(subtree)
+		return list(batches.values())
+
+	def _restore_batch(self, backup_engine: BackupEngine, plan: "BackupPlan", snapshot: dict, subtrees: list[str] | None):
+		includes = None if (subtrees is None) else [ self._include_pattern(subtree) for subtree in subtrees ]
+		_log.debug("Restoring %s from snapshot %s", "everything" if (subtrees is None) else ", ".join(subtrees), snapshot["short_id"])
+		return backup_engine.execute_restore(plan, snapshot["id"], self._args.target, includes = includes, sparse = self._args.sparse, verify = self._args.verify)
+
+	def run(self):
+		self._config = Configuration.parse_json_file(self._args.config_file)
+		plan = self._config.get_plan_by_name(self._args.plan_name, return_default_plan = True)
+		backup_engine = BackupEngine(self._args.restic_binary, plan_db = self._config.plan_db)
+		try:
+			snapshots = backup_engine.execute_list_snapshots(plan)
+			if snapshots is None:
+				_log.error("Unable to list snapshots of %s", plan.name)
+				return 1
+			try:
+				selection = SnapshotSelector(plan, snapshots).select(self._args.snapshot, paths = self._args.include)
+			except NoSuchSnapshotException as e:
+				_log.error("%s", str(e))
+				return 1
+
+			batches = self._batches(backup_engine, plan, selection)
+			_log.info("Restoring %d batch(es) from %s to %s using %d worker(s)", len(batches), ", ".join(snapshot["short_id"] for (snapshot, roots) in selection), self._args.target, max(1, self._args.parallel))
+			with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, self._args.parallel)) as executor:
+				futures = [ executor.submit(self._restore_batch, backup_engine, plan, snapshot, subtrees) for (snapshot, subtrees) in batches ]
+				returncodes = [ future.result() for future in futures ]
+		finally:
+			backup_engine.close()
+
+		failed = [ returncode for returncode in returncodes if returncode != 0 ]
+		if len(failed) > 0:
+			_log.error("%d of %d restore batch(es) failed", len(failed), len(returncodes))
+			return 1
+		return 0
@@ -0,0 +1,62 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import json
+import statistics
+from rebade.MultiCommand import LoggingAction
+from rebade.Configuration import Configuration
+from rebade.ActivityTrace import ActivityTrace
+from rebade.Simulator import Simulator, SimulatedPlan
+
+class ActionSimulate(LoggingAction):
+	def _duration_secs(self, plan: "BackupPlan"):
+		# Modelled after previous runs of the plan where available
+		durations = [ run["duration_secs"] for run in self._config.plan_db.get(plan.name, "runs", [ ]) if "duration_secs" in run ]
+		if len(durations) > 0:
+			return statistics.median(durations)
+		return self._args.backup_secs
+
+	def _print_results(self, results: dict):
+		print(f"Simulated {results['days']:.1f} days with {results['activity_secs'] / 3600:.1f} hours of activity")
+		print()
+		print(f"{'plan':<20s} {'backups':>8s} {'per day':>8s} {'forced':>7s} {'failed':>7s} {'active':>7s} {'max pending':>12s} {'coverage':>9s}")
+		for (plan_name, stats) in results["plans"].items():
+			print(f"{plan_name:<20s} {stats['backups']:>8d} {stats['backups_per_day']:>8.2f} {stats['forced']:>7d} {stats['failed']:>7d} {stats['while_active']:>7d} {stats['max_pending_secs'] / 3600:>10.1f} h {100 * stats['coverage']:>8.1f}%")
+
+	def run(self):
+		self._config = Configuration.parse_json_file(self._args.config_file)
+		plans = [ ]
+		for plan in self._config.get_plans_by_name(self._args.plan_name):
+			plans.append(SimulatedPlan(
+				name = plan.name,
+				soft_period_secs = self._args.soft_period_secs if (self._args.soft_period_secs is not None) else plan.soft_period_secs,
+				hard_period_secs = self._args.hard_period_secs if (self._args.hard_period_secs is not None) else plan.hard_period_secs,
+				duration_secs = self._duration_secs(plan),
+			))
+
+		segments = ActivityTrace.read_segments(self._args.trace_file)
+		simulator = Simulator(plans, segments, timestep_secs = self._args.timestep_secs, inactivity_threshold_secs = self._args.inactivity_secs, forecast = not self._args.no_forecast, failure_rate = self._args.failure_rate)
+		results = simulator.run()
+		if self._args.json:
+			print(json.dumps(results, indent = 4))
+		else:
+			self._print_results(results)
+		return 0
@@ -0,0 +1,75 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import time
+from rebade.MultiCommand import LoggingAction
+from rebade.Configuration import Configuration, Compression
+from rebade.BackupEngine import BackupEngine
+from rebade.ResticTuner import ResticTuner
+
+class ActionTune(LoggingAction):
+	@staticmethod
+	def _parse_list(text: str, conversion = int):
+		return [ conversion(value.strip()) for value in text.split(",") if value.strip() != "" ]
+
+	def run(self):
+		self._config = Configuration.parse_json_file(self._args.config_file)
+		plan = self._config.get_plan_by_name(self._args.plan_name, return_default_plan = True)
+		backup_engine = BackupEngine(self._args.restic_binary)
+		try:
+			repository_version = backup_engine.repository_version(plan)
+		finally:
+			backup_engine.close()
+		if repository_version is None:
+			print(f"Unable to determine the repository version of plan {plan.name}; the repository needs to be initialized and reachable.", file = sys.stderr)
+			return 1
+		tuner = ResticTuner(self._args.restic_binary, plan, sample_size_bytes = self._args.sample_size * 1024 * 1024, rest_server_binary = self._args.rest_server_binary, repository_version = repository_version)
+		candidates = list(tuner.candidates(pack_sizes = self._parse_list(self._args.pack_sizes), compressions = self._parse_list(self._args.compressions, lambda value: Compression(value).value), read_concurrencies = self._parse_list(self._args.read_concurrencies), connections = self._parse_list(self._args.connections)))
+
+		results = [ ]
+		print(f"{'pack':>5s} {'compr':>5s} {'rdcc':>4s} {'conn':>4s}  {'time':>7s} {'MiB/s':>8s} {'CPU s':>7s} {'RSS MiB':>7s}")
+		for result in tuner.run(candidates):
+			results.append(result)
+			status = "" if result.success else f"  failed, returncode {result.returncode}"
+			print(f"{result.settings['pack_size']:5d} {result.settings.get('compression', '-'):>5s} {result.settings['read_concurrency']:4d} {str(result.settings.get('connections', '-')):>4s}  {result.elapsed_secs:7.2f} {result.throughput / 1024 / 1024:8.1f} {result.cpu_secs:7.2f} {result.maxrss_kib / 1024:7.1f}{status}")
+
+		if len(results) == 0:
+			print(f"No files found to sample in the sources of plan {plan.name}.", file = sys.stderr)
+			return 1
+
+		best = ResticTuner.select_best(results, optimize = self._args.optimize)
+		if best is None:
+			print(f"All benchmark runs of plan {plan.name} failed, not storing any settings.", file = sys.stderr)
+			return 1
+
+		print(f"Best settings for plan {plan.name} (optimized for {self._args.optimize}): {best.settings}")
+		if "connections" in best.settings:
+			print(f"The connection count was measured against a local rest-server and is not stored; consider it a starting point for the \"connections\" performance setting of {plan.name}.")
+		if not self._args.no_store:
+			tuning = best.to_dict()
+			tuning["settings"] = { key: value for (key, value) in best.settings.items() if key != "connections" }
+			tuning["timestamp"] = time.time()
+			tuning["optimize"] = self._args.optimize
+			tuning["method"] = plan.target["method"]
+			tuning["repository_version"] = repository_version
+			self._config.plan_db.set(plan.name, "tuning", tuning)
+		return 0
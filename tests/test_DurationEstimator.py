@@ -0,0 +1,81 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import types
+import unittest
+from rebade.DurationEstimator import DurationEstimator
+
+class _PlanDatabase():
+	def __init__(self, runs: list[dict]):
+		self._runs = runs
+
+	def get(self, plan_name: str, key: str, default = None):
+		return self._runs if (key == "runs") else default
+
+_PLAN = types.SimpleNamespace(name = "plan")
+
+def _run(start: float, files: int, bytes_added: int, returncode: int = 0, duration_secs: float | None = None):
+	# 30 secs overhead, 20 secs per million scanned files, 100 secs per GB added
+	if duration_secs is None:
+		duration_secs = 30 + 20 * files / 1e6 + 100 * bytes_added / 1e9
+	return { "start": start, "returncode": returncode, "duration_secs": duration_secs, "summary": { "total_files_processed": files, "data_added": bytes_added } }
+
+def _hourly_runs():
+	# 1 GB are added per hour, at irregular intervals
+	starts = [ 0, 3600, 10800, 14400, 25200, 28800 ]
+	files = [ 1000000, 1050000, 980000, 1100000, 1020000, 1070000 ]
+	bytes_added = [ 500000000 ] + [ round((current - previous) / 3600 * 1e9) for (previous, current) in zip(starts, starts[1:]) ]
+	return [ _run(*values) for values in zip(starts, files, bytes_added) ]
+
+class DurationEstimatorTests(unittest.TestCase):
+	def test_fit(self):
+		coefficients = DurationEstimator(_PlanDatabase([ ])).fit(_hourly_runs())
+		for (coefficient, expected) in zip(coefficients, [ 30, 20, 100 ]):
+			self.assertAlmostEqual(coefficient, expected, delta = 0.01)
+
+	def test_estimate_extrapolates_bytes_added(self):
+		runs = _hourly_runs()
+		estimator = DurationEstimator(_PlanDatabase(runs))
+		files = runs[-1]["summary"]["total_files_processed"]
+		self.assertAlmostEqual(estimator.estimate_secs(_PLAN, now = runs[-1]["start"] + 7200), 30 + 20 * files / 1e6 + 200, delta = 0.1)
+		# Without a point in time, the median interval of one hour is assumed
+		self.assertAlmostEqual(estimator.estimate_secs(_PLAN), 30 + 20 * files / 1e6 + 100, delta = 0.1)
+
+	def test_failed_runs_ignored(self):
+		runs = _hourly_runs()
+		runs.insert(3, _run(12000, 5000000, 0, returncode = 1, duration_secs = 5000))
+		estimator = DurationEstimator(_PlanDatabase(runs))
+		self.assertAlmostEqual(estimator.estimate_secs(_PLAN, now = runs[-1]["start"] + 3600), 30 + 20 * runs[-1]["summary"]["total_files_processed"] / 1e6 + 100, delta = 0.1)
+
+	def test_median_fallback(self):
+		runs = [ _run(0, 1000, 0, duration_secs = 10), _run(3600, 1000, 0, duration_secs = 30), _run(7200, 1000, 0, duration_secs = 20) ]
+		self.assertEqual(DurationEstimator(_PlanDatabase(runs)).estimate_secs(_PLAN), 20)
+		self.assertIsNone(DurationEstimator(_PlanDatabase([ ])).estimate_secs(_PLAN))
+
+	def test_negative_coefficient_rejected(self):
+		# Adding more data makes the backup faster, which cannot be right
+		runs = [ _run(3600 * i, 1000000 + 1000 * i, i * 1000000000, duration_secs = 1000 - 100 * i) for i in range(6) ]
+		estimator = DurationEstimator(_PlanDatabase(runs))
+		self.assertIsNone(estimator.fit(runs))
+		self.assertEqual(estimator.estimate_secs(_PLAN), 750)
+
+if __name__ == "__main__":
+	unittest.main()
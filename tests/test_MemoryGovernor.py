@@ -0,0 +1,66 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import unittest
+from rebade.MemoryGovernor import MemoryGovernor
+
+MiB = 1024 * 1024
+
+class MemoryGovernorTests(unittest.TestCase):
+	def setUp(self):
+		self._available_bytes = 4096 * MiB
+		self._governor = MemoryGovernor(reserve_bytes = 0, safety_factor = 1, get_available_memory = lambda: self._available_bytes)
+
+	def test_budget_without_leases(self):
+		self.assertEqual(self._governor._budget_bytes(), 4096 * MiB)
+		self._available_bytes = 3000 * MiB
+		self.assertEqual(self._governor._budget_bytes(), 3000 * MiB)
+
+	def test_reservation_not_counted_twice(self):
+		with self._governor.lease(1024 * MiB) as lease:
+			self.assertEqual(lease.reserved_bytes, 1024 * MiB)
+			# The running process has used up part of its reservation
+			self._available_bytes = 3500 * MiB
+			self.assertEqual(self._governor._budget_bytes(), 3072 * MiB)
+			self.assertTrue(self._governor.fits(3000 * MiB))
+			self.assertFalse(self._governor.fits(6144 * MiB))
+
+	def test_memory_taken_by_others(self):
+		with self._governor.lease(1024 * MiB):
+			self._available_bytes = 2000 * MiB
+			self.assertEqual(self._governor._budget_bytes(), 2000 * MiB)
+
+	def test_budget_after_leases_ended(self):
+		with self._governor.lease(1024 * MiB):
+			self._available_bytes = 3500 * MiB
+		self.assertEqual(self._governor._budget_bytes(), 3500 * MiB)
+
+	def test_gogc_lowered_to_fit(self):
+		(lease, fits) = self._governor.settings(2048 * MiB, 100, 1536 * MiB)
+		self.assertTrue(fits)
+		self.assertEqual(lease.gogc, 50)
+		self.assertEqual(lease.reserved_bytes, 1536 * MiB)
+		(lease, fits) = self._governor.settings(2048 * MiB, 100, 1024 * MiB)
+		self.assertFalse(fits)
+		self.assertEqual(lease.gogc, 25)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,101 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import types
+import threading
+import unittest
+from rebade.Configuration import BackupPlan
+from rebade.PipelineExecutor import PipelineExecutor, StageState
+from rebade.Enums import ResticBackupReturncodes
+from rebade.Exceptions import ConfigurationException
+
+class _Engine():
+	# Runs command stages by name and records the order of their start and
+	# end, stages named in "barrier" wait for each other
+	def __init__(self, failing: set[str] = None, barrier: set[str] = None):
+		self._failing = failing or set()
+		self._barrier_stages = barrier or set()
+		self._barrier = threading.Barrier(max(1, len(self._barrier_stages)), timeout = 5)
+		self._lock = threading.Lock()
+		self.events = [ ]
+		self.plan_db = None
+
+	def execute_command(self, cmdline: list[str]):
+		name = cmdline[0]
+		with self._lock:
+			self.events.append(("start", name))
+		if name in self._barrier_stages:
+			self._barrier.wait()
+		with self._lock:
+			self.events.append(("end", name))
+		return 1 if (name in self._failing) else 0
+
+	def execute_backup(self, plan: "BackupPlan"):
+		self.execute_command([ "backup" ])
+		return ResticBackupReturncodes.Success
+
+def _plan(stages: list[dict]):
+	pipeline = BackupPlan.parse_pipeline([ { "type": "command", "command": [ stage["name"] ] } | stage for stage in stages ], target = { "method": "local", "remote_path": "/repo" })
+	return types.SimpleNamespace(name = "plan", pipeline = pipeline)
+
+class PipelineExecutorTests(unittest.TestCase):
+	def test_dependency_order(self):
+		engine = _Engine(barrier = { "b", "c" })
+		plan = _plan([ { "name": "d", "after": [ "b", "c" ] }, { "name": "b", "after": "a" }, { "name": "c", "after": "a" }, { "name": "a" } ])
+		executor = PipelineExecutor(engine, plan)
+		self.assertEqual(executor.run(), ResticBackupReturncodes.Success)
+		self.assertEqual(engine.events[:2], [ ("start", "a"), ("end", "a") ])
+		# Independent stages run concurrently, otherwise the barrier breaks
+		self.assertEqual(sorted(engine.events[2:4]), [ ("start", "b"), ("start", "c") ])
+		self.assertEqual(engine.events[-2:], [ ("start", "d"), ("end", "d") ])
+		self.assertTrue(all(state == StageState.Success for state in executor.states.values()))
+
+	def test_failure_skips_successors(self):
+		engine = _Engine(failing = { "a" })
+		plan = _plan([ { "name": "a" }, { "name": "b", "after": "a" }, { "name": "c", "after": "b" }, { "name": "on_failure", "after": "c", "condition": "failure" }, { "name": "cleanup", "after": "a", "condition": "always" } ])
+		executor = PipelineExecutor(engine, plan)
+		self.assertEqual(executor.run(), ResticBackupReturncodes.PipelineStageFailed)
+		self.assertEqual(executor.states, { "a": StageState.Failed, "b": StageState.Skipped, "c": StageState.Skipped, "on_failure": StageState.Success, "cleanup": StageState.Success })
+		self.assertNotIn(("start", "b"), engine.events)
+
+	def test_inactive_failure_stage(self):
+		engine = _Engine()
+		plan = _plan([ { "name": "backup", "type": "backup" }, { "name": "on_failure", "after": "backup", "condition": "failure" }, { "name": "after_notification", "after": "on_failure" } ])
+		executor = PipelineExecutor(engine, plan)
+		self.assertEqual(executor.run(), ResticBackupReturncodes.Success)
+		self.assertEqual(executor.states, { "backup": StageState.Success, "on_failure": StageState.Inactive, "after_notification": StageState.Success })
+
+	def test_invalid_dependencies(self):
+		with self.assertRaises(ConfigurationException):
+			_plan([ { "name": "a", "after": "c" }, { "name": "b", "after": "a" }, { "name": "c", "after": "b" } ])
+		with self.assertRaises(ConfigurationException):
+			_plan([ { "name": "a", "after": "unknown" } ])
+
+	def test_copy_certificates(self):
+		target = { "method": "rest", "hostname": "source", "remote_path": "/", "ca_filename": "/etc/rebade/ca.pem" }
+		stage = { "name": "offsite", "type": "copy", "keyfile": "/etc/rebade/offsite.key" }
+		BackupPlan.parse_pipeline([ stage | { "target": { "method": "rest", "hostname": "offsite", "remote_path": "/", "ca_filename": "/etc/rebade/offsite.pem" } } ], target = target)
+		BackupPlan.parse_pipeline([ stage | { "target": { "method": "rest", "protocol": "http", "hostname": "offsite", "remote_path": "/" } } ], target = target)
+		with self.assertRaises(ConfigurationException):
+			BackupPlan.parse_pipeline([ stage | { "target": { "method": "rest", "hostname": "offsite", "remote_path": "/" } } ], target = target)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,81 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import types
+import unittest
+from rebade.Scheduler import Scheduler
+
+def _plan(name: str, soft_period_secs: int = 3600, hard_period_secs: int = 7200):
+	return types.SimpleNamespace(name = name, soft_period_secs = soft_period_secs, hard_period_secs = hard_period_secs)
+
+class _Profile():
+	def __init__(self, idle_secs: float | None):
+		self._idle_secs = idle_secs
+
+	def predict_idle_secs(self, now: float):
+		return self._idle_secs
+
+class SchedulerTests(unittest.TestCase):
+	def _due(self, scheduler: Scheduler, plans: list, activity_secs: dict, inactivity_secs: int, holdoffs: dict | None = None, **kwargs):
+		holdoffs = holdoffs or { plan.name: 0 for plan in plans }
+		return [ plan.name for plan in scheduler.due_plans(plans, now = 1000, inactivity_secs = inactivity_secs, activity_secs = activity_secs, holdoffs = holdoffs, **kwargs) ]
+
+	def test_soft_period_only_when_inactive(self):
+		scheduler = Scheduler(inactivity_threshold_secs = 300)
+		plans = [ _plan("idle"), _plan("soft"), _plan("hard") ]
+		activity_secs = { "idle": 1800, "soft": 5000, "hard": 8000 }
+		self.assertEqual(self._due(scheduler, plans, activity_secs, inactivity_secs = 60), [ "hard" ])
+		self.assertEqual(self._due(scheduler, plans, activity_secs, inactivity_secs = 600), [ "hard", "soft" ])
+
+	def test_holdoff_pause_and_trigger(self):
+		scheduler = Scheduler()
+		plans = [ _plan("held"), _plan("paused"), _plan("triggered") ]
+		activity_secs = { "held": 8000, "paused": 8000, "triggered": 0 }
+		self.assertEqual(self._due(scheduler, plans, activity_secs, inactivity_secs = 600, holdoffs = { "held": 2000, "paused": 0, "triggered": 0 }, triggered = { "triggered" }, paused = { "paused" }), [ "triggered" ])
+
+	def test_predicted_idle_window(self):
+		durations = { "a": 600, "b": 300, "c": 800, "unknown": None }
+		scheduler = Scheduler(inactivity_threshold_secs = 300, profile = _Profile(1000), duration_estimator = lambda plan, now: durations[plan.name])
+		plans = [ _plan(name) for name in durations ]
+		activity_secs = { name: 5000 for name in durations }
+		# Shortest first as long as the window lasts, c no longer fits after
+		# a and b; without an estimate, the soft period does not apply
+		self.assertEqual(self._due(scheduler, plans, activity_secs, inactivity_secs = 30), [ "b", "a" ])
+		# Nothing is predicted for a user who is active right now
+		self.assertEqual(self._due(scheduler, plans, activity_secs, inactivity_secs = 0), [ ])
+
+	def test_memory_deferral(self):
+		scheduler = Scheduler(memory_check = lambda plan: False)
+		plans = [ _plan("soft"), _plan("hard") ]
+		self.assertEqual(self._due(scheduler, plans, { "soft": 5000, "hard": 8000 }, inactivity_secs = 600), [ "hard" ])
+
+	def test_shortest_first(self):
+		durations = { "long": 900, "unknown": None, "short": 60 }
+		scheduler = Scheduler(duration_estimator = lambda plan, now: durations[plan.name])
+		plans = [ _plan(name) for name in durations ]
+		self.assertEqual(self._due(scheduler, plans, { name: 8000 for name in durations }, inactivity_secs = 0), [ "short", "long", "unknown" ])
+
+	def test_failure_holdoff(self):
+		self.assertEqual(Scheduler.failure_holdoff_secs(), 1800)
+		self.assertEqual([ Scheduler.failure_holdoff_secs(count) for count in [ 1, 2, 3, 10 ] ], [ 60, 120, 240, 1800 ])
+
+if __name__ == "__main__":
+	unittest.main()
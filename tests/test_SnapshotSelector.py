@@ -0,0 +1,71 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import types
+import unittest
+from rebade.SnapshotSelector import SnapshotSelector
+from rebade.Exceptions import NoSuchSnapshotException
+
+def _plan(streams: list[str] = None):
+	return types.SimpleNamespace(name = "plan", source = types.SimpleNamespace(streams = [ types.SimpleNamespace(filename = filename) for filename in (streams or [ ]) ]))
+
+def _snapshot(snapshot_id: str, time: str, paths: list[str], group: str | None = None):
+	return { "id": snapshot_id, "time": time, "paths": paths, "tags": [ ] if (group is None) else [ f"rebade-shard-group={group}" ] }
+
+class SnapshotSelectorTests(unittest.TestCase):
+	def test_latest(self):
+		snapshots = [ _snapshot("bbbb", "2026-10-02T10:00:00Z", [ "/home" ]), _snapshot("aaaa", "2026-10-01T10:00:00Z", [ "/home" ]) ]
+		self.assertEqual(SnapshotSelector(_plan(), snapshots).select("latest"), [ (snapshots[0], [ "/home" ]) ])
+
+	def test_latest_skips_stream_snapshot(self):
+		snapshots = [ _snapshot("aaaa", "2026-10-01T10:00:00Z", [ "/home", "/etc" ]), _snapshot("ssss", "2026-10-01T10:05:00Z", [ "/db.sql" ]) ]
+		selector = SnapshotSelector(_plan(streams = [ "db.sql" ]), snapshots)
+		self.assertEqual(selector.select("latest"), [ (snapshots[0], [ "/etc", "/home" ]) ])
+		self.assertEqual(selector.select("latest", paths = [ "/home/u" ]), [ (snapshots[0], [ "/home/u" ]) ])
+		self.assertEqual(selector.select("latest", paths = [ "/db.sql" ]), [ (snapshots[1], [ "/db.sql" ]) ])
+		self.assertEqual(selector.select("latest", paths = [ "/etc", "/db.sql" ]), [ (snapshots[0], [ "/etc" ]), (snapshots[1], [ "/db.sql" ]) ])
+
+	def test_latest_shard_group_with_stream(self):
+		snapshots = [
+			_snapshot("old1", "2026-09-01T10:00:00Z", [ "/home" ], group = "g0"),
+			_snapshot("new1", "2026-10-01T10:00:00Z", [ "/home" ], group = "g1"),
+			_snapshot("new2", "2026-10-01T10:00:01Z", [ "/etc" ], group = "g1"),
+			_snapshot("ssss", "2026-10-01T10:05:00Z", [ "/db.sql" ]),
+		]
+		selector = SnapshotSelector(_plan(streams = [ "db.sql" ]), snapshots)
+		self.assertEqual([ snapshot["id"] for (snapshot, roots) in selector.select("latest") ], [ "new1", "new2" ])
+		self.assertEqual(selector.select("latest", paths = [ "/etc/fstab" ]), [ (snapshots[2], [ "/etc/fstab" ]) ])
+
+	def test_explicit_snapshot(self):
+		snapshots = [ _snapshot("abcd1234", "2026-10-01T10:00:00Z", [ "/home" ], group = "g1"), _snapshot("abce5678", "2026-10-01T10:00:01Z", [ "/etc" ], group = "g1") ]
+		selector = SnapshotSelector(_plan(), snapshots)
+		self.assertEqual(selector.select("abcd"), [ (snapshots[0], [ "/home" ]) ])
+		with self.assertRaises(NoSuchSnapshotException):
+			selector.select("abc")
+		with self.assertRaises(NoSuchSnapshotException):
+			selector.select("abcd", paths = [ "/etc" ])
+
+	def test_no_snapshots(self):
+		with self.assertRaises(NoSuchSnapshotException):
+			SnapshotSelector(_plan(), [ ]).select("latest")
+
+if __name__ == "__main__":
+	unittest.main()
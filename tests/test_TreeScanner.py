@@ -0,0 +1,44 @@
+#	rebade - Restic backup daemon, a friendly frontend for restic
+#	Copyright (C) 2024-2026 Johannes Bauer
+#
+#	This file is part of rebade.
+#
+#	rebade is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	rebade is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with rebade; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import tempfile
+import unittest
+from rebade.TreeScanner import TreeScanner, TreeScanResult
+from rebade.ShardPlanner import ShardPlanner
+
+class TreeScannerTests(unittest.TestCase):
+	def test_filesystem_root(self):
+		result = TreeScanResult({ "/": (0, 0, [ "/home", "/etc" ]), "/home": (1000, 10, [ ]), "/etc": (10, 1, [ ]) })
+		self.assertEqual(result.total("/"), (1010, 11))
+		self.assertEqual(len(ShardPlanner(result, 2).partition([ "/" ])), 2)
+
+	def test_trailing_slash_root(self):
+		with tempfile.TemporaryDirectory() as tmpdir:
+			for (name, size) in [ ("a", 1000), ("b", 10) ]:
+				os.mkdir(os.path.join(tmpdir, name))
+				with open(os.path.join(tmpdir, name, "file"), "wb") as f:
+					f.write(bytes(size))
+			self.assertEqual(TreeScanner().scan([ tmpdir + "/" ]).total(tmpdir + "/"), (1010, 2))
+			self.assertEqual(TreeScanner().scan([ tmpdir ]).total(tmpdir), (1010, 2))
+
+if __name__ == "__main__":
+	unittest.main()